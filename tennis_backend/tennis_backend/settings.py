@@ -34,6 +34,12 @@ CORS_ORIGIN_WHITELIST = [
   'http://localhost:4200'
 ]
 
+# headers of the bracket endpoint read by the frontend
+CORS_EXPOSE_HEADERS = [
+  'Retry-After',
+  'X-Scraped-At'
+]
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -49,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tennis_bracket.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -16,11 +16,15 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from tennis_bracket.views import BracketInformation, PlayerData, TournamentsData
+from tennis_bracket.views import BracketInformation, LeaderboardData, MatchupData, MetricsData, PlayerData, SimulationData, TournamentsData
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('bracket', BracketInformation.as_view()),
+    path('matchups', MatchupData.as_view()),
+    path('simulation', SimulationData.as_view()),
+    path('leaderboard', LeaderboardData.as_view()),
     path('tournaments', TournamentsData.as_view()),
-    path('player', PlayerData.as_view())
+    path('player', PlayerData.as_view()),
+    path('metrics', MetricsData.as_view())
 ]
@@ -0,0 +1,409 @@
+import copy
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from unittest import mock
+from bs4 import BeautifulSoup
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import tennis_scraper
+from tennis_cache import BASE_DIR
+from tennis_extract import findHeadScript
+from tennis_matches import MatchStore
+from tennis_scraper import (ATP_CAREER_URL, ATP_PLAYER_URL, TOURNAMENT_URL, WTA_CAREER_MATCHES_URL, WTA_PLAYER_URL, WTA_RECENT_MATCHES_URL,
+  PlayerIndex, completedResultsState, findMatchArrayString, findPlayerList, findWomenOlderMatches, getBracketInfo, getCompletedMatchList,
+  getContentUsingStartAndEndString, getH2H, getPlayerList, parseBracketPage)
+from tennis_simulation import SIMULATIONS, getWinProbabilities, simulateTournament
+
+# Offline benchmarks of the scraper and bracket functions, run with "python manage.py run_benchmarks"
+# Pages are read from fixtures instead of tennisabstract.com, recorded pages in FIXTURE_DIR are used when they exist,
+# otherwise pages in the same format are generated so the benchmarks always run without network
+
+FIXTURE_DIR=BASE_DIR / "benchmark_fixtures"
+RESULTS_DIR=BASE_DIR / "benchmark_results"
+DRAW_SIZES=[32, 64, 128]
+BENCHMARK_ATP_PLAYER="BenchmarkAtpPlayer"
+BENCHMARK_WTA_PLAYER="BenchmarkWtaPlayer"
+
+FIRST_NAMES=["Alex", "Ben", "Carlos", "Daniil", "Elena", "Felix", "Grigor", "Holger", "Iga", "Jannik", "Karen", "Lorenzo", "Marta", "Novak", "Ons", "Paula", "Quentin", "Rafael", "Stefanos", "Taylor"]
+LAST_NAMES=["Alvarez", "Becker", "Costa", "Dimitrov", "Evans", "Fritz", "Garin", "Hurkacz", "Ivanov", "Jarry", "Khachanov", "Lehecka", "Musetti", "Norrie", "Opelka", "Paul", "Ruud", "Shelton", "Tiafoe", "Zverev"]
+SCORES=["6-3 6-4", "7-6(4) 6-3", "6-4 3-6 6-2", "6-7(5) 7-5 6-3", "6-2 6-1", "4-6 7-6(8) 7-5"]
+SURFACES=["Hard", "Clay", "Grass"]
+ROUNDS=["R128", "R64", "R32", "R16", "QF", "SF", "F"]
+
+# Creates unique player names, up to 400 names
+# Parameter count: amount of names
+# Parameter offset: index of first name, so different lists do not share names
+# Returns list of player names
+def createPlayerNames(count, offset=0):
+  names=[]
+  for i in range(offset, offset+count):
+    names.append(f"{FIRST_NAMES[i%len(FIRST_NAMES)]} {LAST_NAMES[(i//len(FIRST_NAMES))%len(LAST_NAMES)]}")
+  return names
+
+# Gets the name of a round in the completed matches of a tournament page
+# Parameter roundNumber: round number, first round is 1
+# Parameter highestRoundNumber: highest round number in tournament bracket
+# Returns round name (ex. "R1", "QF")
+def getRoundName(roundNumber, highestRoundNumber):
+  roundsLeft=highestRoundNumber-roundNumber
+  if(roundsLeft<=2):
+    return ["F", "SF", "QF"][roundsLeft]
+  return f"R{roundNumber}"
+
+# Creates a tournament page in the format of tennisabstract.com with byes, seeds, qualifiers and results up to the semifinals
+# Parameter drawSize: amount of players in the tournament bracket
+# Returns raw bytes of tournament page
+def createTournamentPage(drawSize):
+  rng=random.Random(drawSize)
+  highestRoundNumber=int(math.log2(drawSize))
+  names=createPlayerNames(drawSize)
+  byes={1, drawSize-2} if drawSize==32 else set() # top seeds of 28 player draws skip the first round
+  # qualifiers are found by their first round opponent, so they do not play each other and lose in the first round
+  qualifiers={position: f"Lucky Qualifier{position}" for position in rng.sample(range(3, drawSize-2, 2), 4)}
+  cells=[]
+  entrants=[]
+  for position in range(drawSize):
+    if(position in byes):
+      cells.append('<td>Bye</td>')
+      entrants.append(None)
+    elif(position in qualifiers):
+      cells.append('<td>Qualifier</td>')
+      entrants.append(qualifiers[position])
+    else:
+      seed=f"({position//(drawSize//8)+1}) " if position%(drawSize//8)==0 else ''
+      cells.append(f'<td>{seed}<a href="https://www.tennisabstract.com/cgi-bin/player.cgi?p={names[position].replace(" ", "")}">{names[position]}</a></td>')
+      entrants.append(names[position])
+  table='<table><tr>'+''.join(cells)+'</tr></table>'
+  rounds=[]
+  for roundNumber in range(1, highestRoundNumber):
+    lines=[]
+    winners=[]
+    for i in range(0, len(entrants), 2):
+      (player1, player2)=(entrants[i], entrants[i+1])
+      if(player1==None or player2==None): # bye
+        winners.append(player1 or player2)
+        continue
+      if(roundNumber==highestRoundNumber-1 and i>0): # second semifinal is not played yet
+        winners.append(None)
+        continue
+      (winner, loser)=(player1, player2) if rng.random()<0.65 or player2 in qualifiers.values() else (player2, player1)
+      winners.append(winner)
+      lines.append(f'{getRoundName(roundNumber, highestRoundNumber)}: <a href="p">{winner}</a> d. <a href="p">{loser}</a> {rng.choice(SCORES)}<br/>')
+    rounds.append(''.join(lines))
+    entrants=winners
+  qualifying=''.join(f'Q{roundNumber}: <a href="p">Qualy Player{i}</a> d. <a href="p">Qualy Opponent{i}</a> 6-4 6-4<br/>' for roundNumber in (2, 1) for i in range(8))
+  results=''.join(reversed(rounds))+qualifying # newest results are listed first
+  script=f"var proj{drawSize} = '{table}';\nvar proj{drawSize//2} = '<table></table>';\nvar projCurrent = '';\nvar completedSingles = '{results}';\nvar completedDoubles = '';"
+  return f'<html><head><title>Tennis Abstract: 2024 ATP Benchmark Open Results and Forecasts</title><script>{script}</script></head><body></body></html>'.encode('utf-8')
+
+# Creates matches of a player in the format of tennisabstract.com match arrays
+# Parameter seed: number used to create the same matches every time
+# Parameter count: amount of matches
+# Parameter startYear: year of first match
+# Returns array of matches, oldest match first
+def createMatchArray(seed, count, startYear):
+  rng=random.Random(seed)
+  opponents=createPlayerNames(60, 200)
+  matches=[]
+  for i in range(count):
+    date=f"{startYear+i//70}{(i%70)//6+1:02d}{i%28+1:02d}"
+    result=rng.choice(["W", "W", "L"])
+    score=rng.choice(SCORES+["W/O"])
+    matches.append([date, f"Tournament {i//5}", rng.choice(SURFACES), "A", result, str(rng.randint(1, 50)), "", "", rng.choice(ROUNDS), score, str(rng.randint(1, 200)), rng.choice(opponents), "", "", "", "", "", "", "", ""])
+  return matches
+
+# Creates an ATP player page in the format of tennisabstract.com
+# Parameter rank: current rank of player
+# Parameter matches: array of matches shown on page
+# Returns raw bytes of player page
+def createAtpPlayerPage(rank, matches):
+  script=f"var currentrank = {rank};\nvar peakrank = 1;\nvar matchmx = {json.dumps(matches)};\n\n\nvar fourspaces = '    ';"
+  return f'<html><head><title>Tennis Abstract: Benchmark Player ATP Match Results, Splits, and Analysis</title><script>{script}</script></head><body></body></html>'.encode('utf-8')
+
+# Creates a WTA player page in the format of tennisabstract.com
+# Parameter rank: current rank of player
+# Returns raw bytes of player page
+def createWtaPlayerPage(rank):
+  script=f"var currentrank = {rank};\nvar peakrank = 1;"
+  return f'<html><head><title>Tennis Abstract: Benchmark Player WTA Match Results, Splits, and Analysis</title><script>{script}</script></head><body></body></html>'.encode('utf-8')
+
+# fixture file names and functions that generate them when they are not recorded
+FIXTURES={
+  "draw32.html": lambda: createTournamentPage(32),
+  "draw64.html": lambda: createTournamentPage(64),
+  "draw128.html": lambda: createTournamentPage(128),
+  "atp_player.html": lambda: createAtpPlayerPage(4, createMatchArray(1, 80, 2023)),
+  "atp_career.html": lambda: createAtpPlayerPage(4, createMatchArray(2, 900, 2010)),
+  "wta_player.html": lambda: createWtaPlayerPage(7),
+  "wta_recent.js": lambda: ('var matchmx = '+json.dumps(createMatchArray(3, 80, 2023))+' ]];').encode('utf-8'),
+  "wta_career.js": lambda: ('var morematchmx = '+json.dumps(createMatchArray(4, 700, 2012))+';').encode('utf-8'),
+}
+
+# Loads a fixture, the recorded file is used if it exists
+# Parameter name: fixture file name
+# Returns tuple of raw bytes of fixture and "recorded" or "generated"
+def loadFixture(name):
+  path=FIXTURE_DIR / name
+  if(path.exists()):
+    return (path.read_bytes(), "recorded")
+  return (FIXTURES[name](), "generated")
+
+# Gets names of the players whose pages were recorded
+# Returns dictionary of ATP and WTA player names (parsed for url search)
+def loadFixturePlayers():
+  path=FIXTURE_DIR / "players.json"
+  if(path.exists()):
+    return json.loads(path.read_text())
+  return {"atp": BENCHMARK_ATP_PLAYER, "wta": BENCHMARK_WTA_PLAYER}
+
+# Downloads pages from tennisabstract.com and saves them as fixtures, needs network
+# Parameter draws: dictionary of draw size to name of tournament page on tennisabstract.com
+# Parameter atpPlayer: name of ATP player (parsed for url search) or None to keep the current fixtures
+# Parameter wtaPlayer: name of WTA player (parsed for url search) or None to keep the current fixtures
+# Returns list of saved fixture file names
+def recordFixtures(draws, atpPlayer, wtaPlayer):
+  from tennis_fetch import fetchPage
+  FIXTURE_DIR.mkdir(exist_ok=True)
+  urls={f"draw{drawSize}.html": TOURNAMENT_URL.format(tournament=tournament) for (drawSize, tournament) in draws.items()}
+  players=loadFixturePlayers()
+  if(atpPlayer!=None):
+    urls["atp_player.html"]=ATP_PLAYER_URL.format(player=atpPlayer)
+    urls["atp_career.html"]=ATP_CAREER_URL.format(player=atpPlayer)
+    players["atp"]=atpPlayer
+  if(wtaPlayer!=None):
+    urls["wta_player.html"]=WTA_PLAYER_URL.format(player=wtaPlayer)
+    urls["wta_recent.js"]=WTA_RECENT_MATCHES_URL.format(player=wtaPlayer)
+    urls["wta_career.js"]=WTA_CAREER_MATCHES_URL.format(player=wtaPlayer)
+    players["wta"]=wtaPlayer
+  for (name, url) in urls.items():
+    (FIXTURE_DIR / name).write_bytes(fetchPage(url))
+  (FIXTURE_DIR / "players.json").write_text(json.dumps(players))
+  return list(urls.keys())
+
+# Gets the most frequent opponent of a player so head to head benchmarks count real matches
+# Parameter careerMatches: array of career matches of player
+# Returns name of opponent
+def findFrequentOpponent(careerMatches):
+  return Counter(match[11] for match in careerMatches).most_common(1)[0][0]
+
+# Times a function
+# Wall and CPU times are measured without tracing, allocations and database queries are measured in one more traced run
+# Parameter function: function to time
+# Parameter setup: function called before each run without being timed, returns tuple of arguments of parameter function
+# Parameter iterations: amount of timed runs
+# Returns dictionary of measurements
+def measure(function, setup, iterations):
+  wallTimes=[]
+  cpuTimes=[]
+  for _ in range(iterations):
+    arguments=setup()
+    wallStart=time.perf_counter()
+    cpuStart=time.process_time()
+    function(*arguments)
+    cpuTimes.append(time.process_time()-cpuStart)
+    wallTimes.append(time.perf_counter()-wallStart)
+  arguments=setup()
+  tracemalloc.start()
+  try:
+    with CaptureQueriesContext(connection) as queries:
+      function(*arguments)
+    (retained, peak)=tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return {
+    "iterations": iterations,
+    "wallMs": {"min": min(wallTimes)*1000, "median": statistics.median(wallTimes)*1000, "mean": statistics.mean(wallTimes)*1000},
+    "cpuMs": {"min": min(cpuTimes)*1000, "median": statistics.median(cpuTimes)*1000, "mean": statistics.mean(cpuTimes)*1000},
+    "peakKB": peak/1024,
+    "retainedKB": retained/1024,
+    "queries": len(queries)
+  }
+
+# Creates bracket data in the format sent by the frontend, where the player with the lower id wins every match
+# Parameter title: title of tournament
+# Parameter roster: list of players from getBracketInfo function
+# Returns bracket data for BracketSerializer
+def createPredictedBracketData(title, roster):
+  entrants=[None if player==None else player['playerId'] for player in roster]
+  matches=[]
+  roundNumber=1
+  while(len(entrants)>1):
+    winners=[]
+    for i in range(0, len(entrants), 2):
+      playerIds=[playerId for playerId in entrants[i:i+2] if playerId!=None]
+      winner=min(playerIds) if playerIds else None
+      players=[]
+      for playerId in entrants[i:i+2]:
+        if(playerId==None):
+          players.append(None)
+        elif(playerId==winner):
+          players.append({"playerId": playerId, "score": 1636, "result": "win"}) # first digit is a placeholder for winning scores
+        else:
+          players.append({"playerId": playerId, "score": 414, "result": None})
+      matches.append({"roundNumber": roundNumber, "matchId": len(matches), "player1": players[0], "player2": players[1]})
+      winners.append(winner)
+    entrants=winners
+    roundNumber+=1
+  return {"title": title, "matches": matches, "roster": [player for player in roster if player!=None]}
+
+# Creates a copy of bracket data where the winner of the final is changed
+# Parameter bracketData: bracket data from createPredictedBracketData function
+# Returns bracket data for BracketSerializer
+def createChangedBracketData(bracketData):
+  changedBracketData=copy.deepcopy(bracketData)
+  match=changedBracketData["matches"][-1]
+  (match["player1"]["score"], match["player2"]["score"])=(match["player2"]["score"], match["player1"]["score"])
+  (match["player1"]["result"], match["player2"]["result"])=(match["player2"]["result"], match["player1"]["result"])
+  return changedBracketData
+
+# Deletes brackets together with the player data of their matches, which is not deleted by cascading from BracketData
+# Parameter bracketSet: QuerySet of BracketData objects
+# Returns void
+def deleteBrackets(bracketSet):
+  from tennis_bracket.models import MatchData, PlayerData
+  playerKeys=[]
+  for (player1Key, player2Key) in MatchData.objects.filter(matches__in=bracketSet).values_list('player1_id', 'player2_id'):
+    playerKeys.extend(key for key in (player1Key, player2Key) if key!=None)
+  bracketSet.delete()
+  PlayerData.objects.filter(pk__in=playerKeys).delete()
+
+# Runs every benchmark, the database has to be a test database since brackets are saved and deleted
+# Parameter iterations: amount of timed runs of each benchmark
+# Parameter drawSizes: list of draw sizes of tournament benchmarks
+# Returns dictionary of benchmark results and information about the run
+def runBenchmarks(iterations, drawSizes=DRAW_SIZES):
+  from tennis_bracket.backend_functions import getPackedPredictionRate, getPredictionRate, getStoredBracket
+  from tennis_bracket.models import BracketData
+  from tennis_bracket.serializers import BracketSerializer
+  fixtures={}
+  fixtureSources={}
+  for name in FIXTURES:
+    (fixtures[name], fixtureSources[name])=loadFixture(name)
+  players=loadFixturePlayers()
+  pages={
+    ATP_PLAYER_URL.format(player=players["atp"]): fixtures["atp_player.html"],
+    ATP_CAREER_URL.format(player=players["atp"]): fixtures["atp_career.html"],
+    WTA_PLAYER_URL.format(player=players["wta"]): fixtures["wta_player.html"],
+    WTA_RECENT_MATCHES_URL.format(player=players["wta"]): fixtures["wta_recent.js"],
+    WTA_CAREER_MATCHES_URL.format(player=players["wta"]): fixtures["wta_career.js"],
+  }
+  for drawSize in drawSizes:
+    pages[TOURNAMENT_URL.format(tournament=f"BenchmarkDraw{drawSize}")]=fixtures[f"draw{drawSize}.html"]
+  results=[]
+  # Adds the measurements of a benchmark to the results
+  def addResult(benchmark, case, function, setup):
+    results.append({"benchmark": benchmark, "case": case, **measure(function, setup, iterations)})
+  with tempfile.TemporaryDirectory() as storeDir, \
+      mock.patch.object(tennis_scraper, "fetchPage", lambda url: pages.get(url, b'')), \
+      mock.patch.object(tennis_scraper, "fetchPages", lambda urls: [pages.get(url, b'') for url in urls]), \
+      mock.patch.object(tennis_scraper, "matchStore", None):
+    for drawSize in drawSizes:
+      case=f"draw{drawSize}"
+      url=TOURNAMENT_URL.format(tournament=f"BenchmarkDraw{drawSize}")
+      page=pages[url]
+      # Removes results parsed by an earlier run so every run parses the whole page
+      def clearParsedResults():
+        completedResultsState.clear()
+        return (url,)
+      addResult("getBracketInfo", case, getBracketInfo, clearParsedResults)
+      playersContent=findHeadScript(page)
+      playersHTML=findPlayerList(playersContent)
+      addResult("getPlayerList", case, getPlayerList, lambda: (BeautifulSoup(playersHTML, "html.parser"),))
+      (title, roster, actualResults)=parseBracketPage(page, None)
+      highestRoundNumber=int(math.ceil(math.log2(len(roster))))
+      resultsHTML=getContentUsingStartAndEndString(playersContent, 'completedSingles', 'completedDoubles', 19, 7)
+      matchContent=BeautifulSoup(resultsHTML, "html.parser").contents
+      addResult("getCompletedMatchList", case, getCompletedMatchList, lambda: (matchContent, PlayerIndex(roster), highestRoundNumber))
+      bracketData=createPredictedBracketData(f"Benchmark Draw {drawSize}", roster)
+      changedBracketData=createChangedBracketData(bracketData)
+      # Creates a validated serializer so only the database work of BracketSerializer.create is timed
+      def createSerializer(data):
+        serializer=BracketSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer
+      # Deletes the stored bracket so every run inserts the whole bracket
+      def createInsertSerializer():
+        deleteBrackets(BracketData.objects.filter(title=bracketData["title"]))
+        return (createSerializer(bracketData),)
+      # Stores the bracket before every run so every run changes one pick
+      def createUpdateSerializer():
+        createSerializer(bracketData).save()
+        return (createSerializer(changedBracketData),)
+      addResult("BracketSerializer.create", case, lambda serializer: serializer.save(), createInsertSerializer)
+      addResult("BracketSerializer.create", f"{case}Update", lambda serializer: serializer.save(), createUpdateSerializer)
+      bracket=createSerializer(bracketData).save()
+      addResult("getStoredBracket", case, getStoredBracket, lambda: (bracket, bracketData["title"]))
+      predictedResults=getStoredBracket(bracket, bracketData["title"])["results"]
+      addResult("getPredictionRate", case, getPredictionRate, lambda: (predictedResults, actualResults))
+      if(bracket.prediction!=None):
+        addResult("getPackedPredictionRate", case, getPackedPredictionRate, lambda: (bytes(bracket.prediction), actualResults))
+      # ranks are the order of players in the draw since player pages are not part of the fixtures
+      ranks=[{"playerId": player['playerId'], "rank": player['playerId']+1} for player in roster if player!=None]
+      probabilities=getWinProbabilities(roster, ranks, [])
+      addResult("simulateTournament", case, simulateTournament, lambda: (roster, actualResults, probabilities, SIMULATIONS, 0))
+    atpOpponent=findFrequentOpponent(json.loads(findMatchArrayString(findHeadScript(fixtures["atp_career.html"]))))
+    wtaOpponent=findFrequentOpponent(json.loads(findWomenOlderMatches(fixtures["wta_career.js"])))
+    for (tour, player, opponent) in (("atp", players["atp"], atpOpponent), ("wta", players["wta"], wtaOpponent)):
+      stores=[]
+      # Uses an empty match store so career matches are stored again
+      def createEmptyStore():
+        store=MatchStore(os.path.join(storeDir, f"cold{len(stores)}.sqlite3"))
+        stores.append(store)
+        tennis_scraper.matchStore=store
+        return (player, opponent, None)
+      addResult("getH2H", f"{tour}Cold", getH2H, createEmptyStore)
+      for store in stores:
+        store.connection.close()
+      tennis_scraper.matchStore=MatchStore(os.path.join(storeDir, f"{tour}.sqlite3"))
+      getH2H(player, opponent, None) # career matches are stored before the timed runs
+      addResult("getH2H", f"{tour}Warm", getH2H, lambda: (player, opponent, None))
+      tennis_scraper.matchStore.connection.close()
+  return {
+    "commit": getCommit(),
+    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "fixtures": fixtureSources,
+    "results": results
+  }
+
+# Gets the git commit that is benchmarked
+# Returns short commit hash or "unknown" if git cannot be used
+def getCommit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown"
+
+# Compares benchmark results with results of an earlier run
+# A benchmark regressed if its median wall time grew by more than the threshold or if it runs more database queries
+# Parameter previous: results from runBenchmarks function of the earlier run
+# Parameter current: results from runBenchmarks function
+# Parameter threshold: allowed growth of median wall time (ex. 0.1 for 10%)
+# Returns tuple of list of report lines and list of regressed benchmarks
+def compareResults(previous, current, threshold):
+  previousResults={(result["benchmark"], result["case"]): result for result in previous["results"]}
+  lines=[]
+  regressions=[]
+  for result in current["results"]:
+    key=(result["benchmark"], result["case"])
+    name=f"{key[0]} [{key[1]}]"
+    if(key not in previousResults):
+      lines.append(f"{name}: new benchmark, {result['wallMs']['median']:.3f} ms")
+      continue
+    before=previousResults[key]
+    change=result["wallMs"]["median"]/before["wallMs"]["median"]-1 if before["wallMs"]["median"]>0 else 0
+    regressed=change>threshold or result["queries"]>before["queries"]
+    if(regressed):
+      regressions.append(name)
+    lines.append(f"{name}: {before['wallMs']['median']:.3f} ms -> {result['wallMs']['median']:.3f} ms ({change:+.1%}), queries {before['queries']} -> {result['queries']}{' REGRESSION' if regressed else ''}")
+  return (lines, regressions)
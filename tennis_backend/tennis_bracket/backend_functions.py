@@ -1,38 +1,180 @@
-from tennis_bracket.models import MatchData, PlayerData, SeedingData
+from datetime import timedelta
+from django.utils import timezone
+from tennis_bracket.models import BracketData, MatchData, PlayerData, QueuedTournament, SeedingData, TournamentSnapshot
+from tennis_bracket.packed_bracket import packActualResults, scorePackedPrediction, unpackPrediction
+from tennis_metrics import timed
 
-# Creates PlayerData object that stores an individual player data from a tennis match
+SCRAPE_MAX_INTERVAL=30*60 # longest wait in seconds of the prefetch_tournaments command between scrapes of a tournament
+SNAPSHOT_MAX_AGE=2*SCRAPE_MAX_INTERVAL # a stored tournament that has not been scraped for this long is queued again by a request
+QUEUE_RECHECK_INTERVAL=10*60 # seconds before a tournament page without a bracket is queued again
+
+# Builds (unsaved) PlayerData object that stores an individual player data from a tennis match
 # Parameter player: player data containing player id, score, and result
-# Returns PlayerData object containing player data
-def createPlayerDataObject(player):
+# Returns PlayerData object containing player data, saved later together with other players using bulk_create
+def buildPlayerDataObject(player):
   score=None
   result=None
   if('score' in player):
     score=player['score']
   if('result' in player):
     result=player['result']
-  return PlayerData.objects.create(playerId=player['playerId'], score=score, result=result)
+  return PlayerData(playerId=player['playerId'], score=score, result=result)
+
+# Get scraped bracket of a tournament that is stored in database
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Returns tuple of tournament title, list of players, and list of match results, or None if tournament is not stored
+@timed("snapshot", countQueries=True)
+def getTournamentSnapshot(tournament):
+  snapshot=TournamentSnapshot.objects.filter(tournament=tournament).values_list("title", "roster", "results").first()
+  if(snapshot==None):
+    return None
+  return tuple(snapshot)
+
+# Get the version of the stored state a bracket response is built from, without loading the bracket
+# Used for the ETag of the bracket endpoint so an unchanged bracket is answered with 304 before it is loaded
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter parsedTournament: parsed version of tournament title
+# Parameter includeBracket: boolean that tells if the response includes the user created bracket
+# Parameter owner: name of user who created the bracket
+# Returns tuple of list of times and versions that change when the response changes, time the tournament was last scraped, and
+# boolean that is true if the tournament has not been scraped for SNAPSHOT_MAX_AGE seconds, or None if tournament is not stored
+@timed("snapshot", countQueries=True)
+def getBracketStateVersion(tournament, parsedTournament, includeBracket, owner=""):
+  snapshotTimes=TournamentSnapshot.objects.filter(tournament=tournament).values_list("changedAt", "scrapedAt").first()
+  if(snapshotTimes==None):
+    return None
+  (changedAt, scrapedAt)=snapshotTimes
+  stateVersion=[changedAt.isoformat()]
+  if(includeBracket):
+    bracketVersion=BracketData.objects.filter(title=parsedTournament, owner=owner).values_list("version", "updatedAt").first()
+    stateVersion.append(None if bracketVersion==None else [bracketVersion[0], bracketVersion[1].isoformat()])
+  outdated=timezone.now()-scrapedAt>=timedelta(seconds=SNAPSHOT_MAX_AGE)
+  return (stateVersion, scrapedAt, outdated)
+
+# Queues a tournament for the prefetch_tournaments command, so requests never wait for it to be scraped
+# Tournaments are queued when they are not stored yet, or when they have not been scraped for SNAPSHOT_MAX_AGE seconds
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Returns boolean: true if the tournament is waiting to be scraped, false if the command recently found no bracket on its page
+@timed("snapshot", countQueries=True)
+def queueTournament(tournament):
+  (queued, created)=QueuedTournament.objects.get_or_create(tournament=tournament)
+  if(created or queued.checkedAt==None):
+    return True
+  if(timezone.now()-queued.checkedAt<timedelta(seconds=QUEUE_RECHECK_INTERVAL)):
+    return False
+  # bracket may have been posted since the page was checked
+  QueuedTournament.objects.filter(pk=queued.pk).update(checkedAt=None)
+  return True
+
+# Get tournaments queued by requests that are waiting to be scraped
+# Returns list of names of tournament pages on tennisabstract.com
+def getQueuedTournaments():
+  return list(QueuedTournament.objects.filter(checkedAt__isnull=True).values_list("tournament", flat=True))
+
+# Removes a tournament from the queue once it has been scraped
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter found: boolean that tells if a bracket was found and stored, if not the tournament stays queued as checked
+# Returns void
+def finishQueuedTournament(tournament, found):
+  queuedSet=QueuedTournament.objects.filter(tournament=tournament)
+  if(found):
+    queuedSet.delete()
+  else:
+    queuedSet.update(checkedAt=timezone.now())
+
+# Store scraped bracket of a tournament in database
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter bracketData: tuple of tournament title, list of players, and list of match results from getBracketInfo function
+# Returns boolean: true if the tournament is new or its roster or results changed, false otherwise
+@timed("snapshot", countQueries=True)
+def saveTournamentSnapshot(tournament, bracketData):
+  (title, roster, results)=bracketData
+  now=timezone.now()
+  snapshot=TournamentSnapshot.objects.filter(tournament=tournament).first()
+  if(snapshot==None):
+    TournamentSnapshot.objects.create(tournament=tournament, title=title, roster=roster, results=results, scrapedAt=now, changedAt=now)
+    return True
+  changed=(snapshot.title!=title or snapshot.roster!=roster or snapshot.results!=results)
+  snapshot.scrapedAt=now
+  if(changed):
+    snapshot.title=title
+    snapshot.roster=roster
+    snapshot.results=results
+    snapshot.changedAt=now
+  snapshot.save()
+  return changed
+
+# Stores the results of a scrape that only added matches to the stored roster and results of a tournament
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter results: list of all completed matches from web scraping
+# Parameter newMatches: matches added since the stored results, from getResultsDelta function
+# Returns boolean: true if the stored tournament was updated, false if the tournament is not stored and has to be saved with saveTournamentSnapshot
+@timed("snapshot", countQueries=True)
+def saveTournamentResults(tournament, results, newMatches):
+  now=timezone.now()
+  snapshots=TournamentSnapshot.objects.filter(tournament=tournament)
+  if(not newMatches): # stored roster and results are still current
+    return snapshots.update(scrapedAt=now)>0
+  return snapshots.update(results=results, scrapedAt=now, changedAt=now)>0
+
+# Get most updated bracket created by a user for a tournament together with the user prediction rate
+# Parameter parsedTournament: parsed version of tournament title
+# Parameter roster: list of players in the tournament from web scraping
+# Parameter results: actual tournament results from web scraping
+# Parameter owner: name of user who created the bracket
+# Returns data related to tournament bracket or None if the user has not created a bracket for the tournament
+@timed("predictedBracket", countQueries=True)
+def getPredictedBracket(parsedTournament, roster, results, owner=""):
+  # each user has one bracket per tournament that is found with the unique index on title and owner
+  bracket=BracketData.objects.filter(title=parsedTournament, owner=owner).first()
+  if(bracket==None):
+    return None
+  # get user created bracket data from database
+  data=getStoredBracket(bracket, parsedTournament)
+  # get user prediction rate for tournament, a packed bracket is scored with bitwise operations on the packed prediction
+  if(bracket.prediction!=None):
+    predictionRateData=getPackedPredictionRate(bytes(bracket.prediction), results)
+  else:
+    predictionRateData=getPredictionRate(data["results"], results)
+  data.update(predictionRateData)
+  # update players in "Qualifier Player" spots on bracket if necessary
+  data.update({"roster": roster})
+  return data
+
+# fields of a match and both of its players, loaded together with one join
+MATCH_FIELDS=("roundNumber", "matchId", "player1_id", "player1__playerId", "player1__score", "player1__result", "player2_id", "player2__playerId", "player2__score", "player2__result")
 
 # Get user created bracket that is stored in database
+# Matches, players and roster are loaded with a constant number of queries no matter the size of the bracket,
+# a packed bracket is decoded from BracketData.prediction so only the roster is queried
 # Parameter bracket: BracketData object representing tournament bracket
 # Parameter parsedTournament: parsed version of tournament title
 # Returns data related to tournament bracket
+@timed("storedBracket", countQueries=True)
 def getStoredBracket(bracket, parsedTournament):
-  matchSet=MatchData.objects.filter(matches=bracket)
-  rosterSet=SeedingData.objects.filter(roster=bracket)
+  if(bracket.prediction!=None):
+    matchRows=getPackedMatchRows(bytes(bracket.prediction))
+  else:
+    matchRows=MatchData.objects.filter(matches=bracket).order_by('matchId').values_list(*MATCH_FIELDS)
+  rosterSet=SeedingData.objects.filter(roster=bracket).order_by('seedId')
   rosterValues=rosterSet.values("playerId", "playerName")
   rosterList=list(rosterValues)
   tournamentMatches=[]
-  for match in matchSet:
+  for (roundNumber, matchId, player1Key, playerId1, score1, result1, player2Key, playerId2, score2, result2) in matchRows:
     matchData={
-      "roundNumber": match.roundNumber,
-      "matchId": match.matchId,
+      "roundNumber": roundNumber,
+      "matchId": matchId,
       "id1": None,
       "id2": None,
       "opponent1": None,
       "opponent2": None
     }
-    player1=match.player1
-    player2=match.player2
+    player1=None
+    player2=None
+    if(player1Key!=None):
+      player1={"playerId": playerId1, "score": score1, "result": result1}
+    if(player2Key!=None):
+      player2={"playerId": playerId2, "score": score2, "result": result2}
     removePlaceholder=detectDifferenceInScores(player1, player2)
     setPlayerMatchData(player1, matchData, 1, removePlaceholder)
     setPlayerMatchData(player2, matchData, 2, removePlaceholder)
@@ -40,21 +182,36 @@ def getStoredBracket(bracket, parsedTournament):
   data={"title": parsedTournament, "roster": rosterList, "results": tournamentMatches, "method": "database"}
   return data
 
+# Decodes a packed bracket into rows with the same fields as MATCH_FIELDS
+# Parameter packed: bytes of packed prediction
+# Returns list of tuples of match fields, player keys are 0 if there is a player and None otherwise
+def getPackedMatchRows(packed):
+  matchRows=[]
+  for match in unpackPrediction(packed):
+    row=[match["roundNumber"], match["matchId"]]
+    for player in (match["player1"], match["player2"]):
+      if(player==None):
+        row.extend((None, None, None, None))
+      else:
+        row.extend((0, player["playerId"], player["score"], player["result"]))
+    matchRows.append(tuple(row))
+  return matchRows
+
 # Sets player data in a match, used for retriving user created bracket from database
-# Parameter player: player data in the match
+# Parameter player: player data in the match (player id, score, and result)
 # Parameter matchData: match data related to player
 # Parameter playerNumber: 1 or 2, which is either player 1 or player 2 in the match respectively
 # Parameter removePlaceholder: boolean that tells if the first digit placeholder should be removed from a winning score
 # Returns void: match data is updated
 def setPlayerMatchData(player, matchData, playerNumber, removePlaceholder):
   if(player!=None):
-    matchData[f'id{playerNumber}']=player.playerId
-    if(player.result=="win" and player.score!=None and removePlaceholder):
-      scoreString=str(player.score)
+    matchData[f'id{playerNumber}']=player['playerId']
+    if(player['result']=="win" and player['score']!=None and removePlaceholder):
+      scoreString=str(player['score'])
       # remove the first digit (used as a placeholder) for winning scores
-      matchData[f'opponent{playerNumber}']={"score": int(scoreString[1:len(scoreString)]), "result": player.result}
+      matchData[f'opponent{playerNumber}']={"score": int(scoreString[1:len(scoreString)]), "result": player['result']}
     else:
-      matchData[f'opponent{playerNumber}']={"score": player.score, "result": player.result}
+      matchData[f'opponent{playerNumber}']={"score": player['score'], "result": player['result']}
 
 # Detect if winning score has a placeholder by checking difference in length of scores between player 1 and player 2
 # Parameter player1: player 1 data
@@ -62,18 +219,54 @@ def setPlayerMatchData(player, matchData, playerNumber, removePlaceholder):
 # Returns boolean: true if there is difference in player score lengths, false otherwise
 def detectDifferenceInScores(player1, player2):
   if(player1!=None and player2!=None):
-    score1=player1.score
-    score2=player2.score
+    score1=player1['score']
+    score2=player2['score']
     scoreString1=str(score1)
     scoreString2=str(score2)
     return len(scoreString1)!=len(scoreString2)
   return False
 
+# Indexes actual tournament results by round number and player id so each predicted match is scored with a lookup
+# Parameter actualResults: actual tournament results
+# Returns dictionary from (roundNumber, playerId) to position of the first actual match in that round with that player
+def indexActualResults(actualResults):
+  actualIndex={}
+  for (position, actualMatch) in enumerate(actualResults):
+    roundNumber=actualMatch["roundNumber"]
+    actualIndex.setdefault((roundNumber, actualMatch["id1"]), position)
+    actualIndex.setdefault((roundNumber, actualMatch["id2"]), position)
+  return actualIndex
+
 # Gets the amount of predictions right by user, only considers matches that have already happened
 # Parameter predictedResults: user predicted tournament reults
 # Parameter actualResults: actual tournament results
 # Returns dictionary containing user prediction rate
+@timed("predictionRate")
 def getPredictionRate(predictedResults, actualResults):
+  return scorePredictions(predictedResults, actualResults, indexActualResults(actualResults))
+
+# Gets the amount of predictions right by user for a packed bracket, same result as getPredictionRate
+# Parameter packed: bytes of packed prediction
+# Parameter actualResults: actual tournament results
+# Returns dictionary containing user prediction rate
+@timed("predictionRate")
+def getPackedPredictionRate(packed, actualResults):
+  return scorePackedPrediction(packed, packActualResults(actualResults))
+
+# Gets the prediction rates of many user created brackets against the same actual results, which are only indexed once
+# Parameter predictedResultsList: list of user predicted tournament results
+# Parameter actualResults: actual tournament results
+# Returns list of dictionaries containing user prediction rate, in the same order as parameter predictedResultsList
+def getPredictionRates(predictedResultsList, actualResults):
+  actualIndex=indexActualResults(actualResults)
+  return [scorePredictions(predictedResults, actualResults, actualIndex) for predictedResults in predictedResultsList]
+
+# Gets the amount of predictions right by user using indexed actual results
+# Parameter predictedResults: user predicted tournament reults
+# Parameter actualResults: actual tournament results
+# Parameter actualIndex: index of actual results created by indexActualResults function
+# Returns dictionary containing user prediction rate
+def scorePredictions(predictedResults, actualResults, actualIndex):
   correctPredictions=0
   totalPredictions=0
   updatePredictionsFrontend=[]
@@ -84,52 +277,33 @@ def getPredictionRate(predictedResults, actualResults):
     id2=predictedMatch["id2"]
     opponent1=predictedMatch["opponent1"]
     opponent2=predictedMatch["opponent2"]
-    if(id1!=None and id2!=None and opponent1 and opponent2):
-      opponent1Result=opponent1["result"]
-      opponent2Result=opponent2["result"]
-      if(opponent1Result or opponent2Result):
-        for actualMatch in actualResults:
-          roundNumberActual=actualMatch["roundNumber"]
-          id1Actual=actualMatch["id1"]
-          id2Actual=actualMatch["id2"]
-          if(roundNumber==roundNumberActual):
-            opponent1Actual=actualMatch["opponent1"]
-            opponent2Actual=actualMatch["opponent2"]
-            if(id1==id1Actual and opponent1Result=="win"):
-              # winner only will contain "result" key in opponent1Actual or opponent2Actual objects
-              if("result" in opponent1Actual):
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "correct", "playerNumber": 1, 'playerId': id1})
-                correctPredictions+=1
-              else: # user incorrectly picked opponent 1 as winner
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "incorrect", "playerNumber": 1, 'playerId': id1})
-              totalPredictions+=1
-              break
-            elif(id2==id2Actual and opponent2Result=="win"):
-              # winner only will contain "result" key in opponent1Actual or opponent2Actual objects
-              if("result" in opponent2Actual):
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "correct", "playerNumber": 2, 'playerId': id2})
-                correctPredictions+=1
-              else: # user incorrectly picked opponent 2 as winner
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "incorrect", "playerNumber": 2, 'playerId': id2})
-              totalPredictions+=1
-              break
-            elif(id1==id2Actual and opponent1Result=="win"):
-              # winner only will contain "result" key in opponent1Actual or opponent2Actual objects
-              if("result" in opponent2Actual):
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "correct", "playerNumber": 1, 'playerId': id1})
-                correctPredictions+=1
-              else: # user incorrectly picked opponent 1 as winner
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "incorrect", "playerNumber": 1, 'playerId': id1})
-              totalPredictions+=1
-              break
-            elif(id2==id1Actual and opponent2Result=="win"):
-              # winner only will contain "result" key in opponent1Actual or opponent2Actual objects
-              if("result" in opponent1Actual):
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "correct", "playerNumber": 2, 'playerId': id2})
-                correctPredictions+=1
-              else: # user incorrectly picked opponent 2 as winner
-                updatePredictionsFrontend.append({"matchId": matchId, "result": "incorrect", "playerNumber": 2, 'playerId': id2})
-              totalPredictions+=1
-              break
+    if(id1==None or id2==None or not opponent1 or not opponent2):
+      continue
+    opponent1Win=opponent1["result"]=="win"
+    opponent2Win=opponent2["result"]=="win"
+    # first actual match of the round that has the predicted winner in it
+    positions=[]
+    if(opponent1Win and (roundNumber, id1) in actualIndex):
+      positions.append(actualIndex[(roundNumber, id1)])
+    if(opponent2Win and (roundNumber, id2) in actualIndex):
+      positions.append(actualIndex[(roundNumber, id2)])
+    if(not positions):
+      continue
+    actualMatch=actualResults[min(positions)]
+    if(opponent1Win and id1 in (actualMatch["id1"], actualMatch["id2"]) and (id1==actualMatch["id1"] or not (opponent2Win and id2==actualMatch["id2"]))):
+      playerNumber=1
+      playerId=id1
+      # winner only will contain "result" key in opponent1Actual or opponent2Actual objects
+      opponentActual=actualMatch["opponent1"] if id1==actualMatch["id1"] else actualMatch["opponent2"]
+    else: # user picked opponent 2 as winner
+      playerNumber=2
+      playerId=id2
+      opponentActual=actualMatch["opponent2"] if id2==actualMatch["id2"] else actualMatch["opponent1"]
+    if("result" in opponentActual):
+      updatePredictionsFrontend.append({"matchId": matchId, "result": "correct", "playerNumber": playerNumber, 'playerId': playerId})
+      correctPredictions+=1
+    else: # user incorrectly picked winner
+      updatePredictionsFrontend.append({"matchId": matchId, "result": "incorrect", "playerNumber": playerNumber, 'playerId': playerId})
+    totalPredictions+=1
   predictionRate={"correctPredictions": correctPredictions, "totalPredictions": totalPredictions}
-  return {"predictionRate": predictionRate, "updatePredictionsFrontend": updatePredictionsFrontend}
\ No newline at end of file
+  return {"predictionRate": predictionRate, "updatePredictionsFrontend": updatePredictionsFrontend}
@@ -0,0 +1,152 @@
+from django.db import transaction
+from django.db.models import F
+from tennis_bracket.models import BracketData, BracketPick, BracketScore, LeaderboardState
+from tennis_bracket.backend_functions import getStoredBracket
+from tennis_metrics import timed
+
+# Every user created bracket has its picks (winner picked in each round) and its score stored
+# A newly completed match only changes the score of brackets that picked one of its two players in its round,
+# which are found with the pick_by_match_slot index and updated with one statement, so brackets are not loaded to be scored
+# A tournament has one bracket per user, picks of a tournament are found through the title of their bracket
+
+# Gets the winners picked by user in a stored bracket, same picks as the ones scored by getPredictionRate
+# Parameter predictedResults: user predicted tournament results from getStoredBracket function
+# Returns list of tuples of round number and player id of picked winner
+def getPicks(predictedResults):
+  picks=[]
+  for predictedMatch in predictedResults:
+    (opponent1, opponent2)=(predictedMatch["opponent1"], predictedMatch["opponent2"])
+    if(predictedMatch["id1"]==None or predictedMatch["id2"]==None or not opponent1 or not opponent2):
+      continue
+    if(opponent1["result"]=="win"):
+      picks.append((predictedMatch["roundNumber"], predictedMatch["id1"]))
+    elif(opponent2["result"]=="win"):
+      picks.append((predictedMatch["roundNumber"], predictedMatch["id2"]))
+  return picks
+
+# Gets the winners picked by user in a bracket sent by the frontend
+# Parameter matches: list of matches sent by the frontend
+# Returns list of tuples of round number and player id of picked winner
+def getMatchPicks(matches):
+  picks=[]
+  for match in matches:
+    (player1, player2)=(match['player1'], match['player2'])
+    if(player1==None or player2==None):
+      continue
+    if(player1.get('result')=="win"):
+      picks.append((match['roundNumber'], player1['playerId']))
+    elif(player2.get('result')=="win"):
+      picks.append((match['roundNumber'], player2['playerId']))
+  return picks
+
+# Gets the round number, winner, and loser of a completed match
+# Parameter actualMatch: completed match from web scraping
+# Returns tuple of round number, player id of winner, and player id of loser
+def getOutcome(actualMatch):
+  if("result" in actualMatch["opponent1"]):
+    return (actualMatch["roundNumber"], actualMatch["id1"], actualMatch["id2"])
+  return (actualMatch["roundNumber"], actualMatch["id2"], actualMatch["id1"])
+
+# Scores picks against completed results
+# Parameter picks: list of tuples of round number and player id of picked winner
+# Parameter results: list of completed matches from web scraping
+# Returns tuple of amount of correct predictions and amount of predictions of matches that have been played
+def scorePicks(picks, results):
+  played=set()
+  won=set()
+  for actualMatch in results:
+    (roundNumber, winnerId, loserId)=getOutcome(actualMatch)
+    played.update(((roundNumber, winnerId), (roundNumber, loserId)))
+    won.add((roundNumber, winnerId))
+  correctPredictions=sum(1 for pick in picks if pick in won)
+  totalPredictions=sum(1 for pick in picks if pick in played)
+  return (correctPredictions, totalPredictions)
+
+# Stores the picks and score of a bracket, called every time the picks of the bracket change
+# Stored picks are updated in place so changing one pick writes one row
+# Parameter bracket: BracketData object of saved bracket
+# Parameter picks: list of tuples of round number and player id of picked winner
+# Returns void
+@timed("leaderboard", countQueries=True)
+def scoreBracket(bracket, picks):
+  storedPicks={}
+  for (key, roundNumber, playerId) in BracketPick.objects.filter(bracket=bracket).values_list("id", "roundNumber", "playerId"):
+    storedPicks.setdefault((roundNumber, playerId), []).append(key)
+  newPicks=[]
+  for pick in picks:
+    if(storedPicks.get(pick)):
+      storedPicks[pick].pop()
+    else:
+      newPicks.append(pick)
+  unusedKeys=[key for keys in storedPicks.values() for key in keys]
+  # rows of picks that are no longer in the bracket are used for new picks
+  changedPicks=[BracketPick(pk=key, roundNumber=roundNumber, playerId=playerId) for (key, (roundNumber, playerId)) in zip(unusedKeys, newPicks)]
+  if(changedPicks):
+    BracketPick.objects.bulk_update(changedPicks, ["roundNumber", "playerId"])
+  if(len(unusedKeys)>len(newPicks)):
+    BracketPick.objects.filter(pk__in=unusedKeys[len(newPicks):]).delete()
+  if(len(newPicks)>len(unusedKeys)):
+    BracketPick.objects.bulk_create([BracketPick(bracket=bracket, roundNumber=roundNumber, playerId=playerId) for (roundNumber, playerId) in newPicks[len(unusedKeys):]])
+  results=LeaderboardState.objects.filter(title=bracket.title).values_list("results", flat=True).first() or []
+  (correctPredictions, totalPredictions)=scorePicks(picks, results)
+  if(not BracketScore.objects.filter(bracket=bracket).update(correctPredictions=correctPredictions, totalPredictions=totalPredictions)):
+    BracketScore.objects.create(bracket=bracket, title=bracket.title, correctPredictions=correctPredictions, totalPredictions=totalPredictions)
+
+# Updates scores of every bracket of a tournament with the latest completed results
+# Only results that are new since the last update are applied, each with two UPDATE statements no matter how many brackets there are
+# Parameter title: title of brackets of the tournament (parsed version of tournament title)
+# Parameter results: list of completed matches from web scraping
+# Parameter newResults: matches added since the last update from getResultsDelta function, None to find them by comparing with the stored results
+# Returns amount of new results applied, or None if every bracket was scored again
+@timed("leaderboard", countQueries=True)
+def updateLeaderboard(title, results, newResults=None):
+  with transaction.atomic():
+    (state, created)=LeaderboardState.objects.select_for_update().get_or_create(title=title, defaults={"results": []})
+    if(created): # brackets saved before the tournament had a leaderboard
+      for bracket in BracketData.objects.filter(title=title, bracketscore__isnull=True):
+        scoreBracket(bracket, getPicks(getStoredBracket(bracket, title)["results"]))
+    if(created or newResults==None or len(state.results)+len(newResults)!=len(results)):
+      scoredOutcomes={getOutcome(actualMatch) for actualMatch in state.results}
+      outcomes=list(dict.fromkeys(getOutcome(actualMatch) for actualMatch in results))
+      newOutcomes=[outcome for outcome in outcomes if outcome not in scoredOutcomes] if scoredOutcomes<=set(outcomes) else None
+    else: # stored results are the results before the new matches, so only the new matches are compared
+      newOutcomes=list(dict.fromkeys(getOutcome(actualMatch) for actualMatch in newResults))
+    if(newOutcomes==None): # a result was corrected or removed
+      rescoreTournament(title, results)
+    else:
+      for (roundNumber, winnerId, loserId) in newOutcomes:
+        picks=BracketPick.objects.filter(bracket__title=title, roundNumber=roundNumber)
+        BracketScore.objects.filter(bracket__in=picks.filter(playerId=winnerId).values('bracket')).update(correctPredictions=F('correctPredictions')+1, totalPredictions=F('totalPredictions')+1)
+        BracketScore.objects.filter(bracket__in=picks.filter(playerId=loserId).values('bracket')).update(totalPredictions=F('totalPredictions')+1)
+    state.results=results
+    state.save()
+  return None if newOutcomes==None else len(newOutcomes)
+
+# Scores every bracket of a tournament again from its stored picks
+# Parameter title: title of brackets of the tournament
+# Parameter results: list of completed matches from web scraping
+# Returns void
+def rescoreTournament(title, results):
+  picksByBracket={}
+  for (bracketKey, roundNumber, playerId) in BracketPick.objects.filter(bracket__title=title).values_list("bracket_id", "roundNumber", "playerId").iterator():
+    picksByBracket.setdefault(bracketKey, []).append((roundNumber, playerId))
+  scores=[]
+  for bracketKey in BracketScore.objects.filter(title=title).values_list("bracket_id", flat=True):
+    (correctPredictions, totalPredictions)=scorePicks(picksByBracket.get(bracketKey, []), results)
+    scores.append(BracketScore(bracket_id=bracketKey, title=title, correctPredictions=correctPredictions, totalPredictions=totalPredictions))
+  BracketScore.objects.bulk_update(scores, ["correctPredictions", "totalPredictions"], batch_size=1000)
+
+# Gets the best scored brackets, ties have the same rank
+# Parameter title: title of brackets of the tournament, None for brackets of every tournament
+# Parameter limit: largest amount of brackets returned
+# Returns list of brackets with rank, title, owner, and score
+def getLeaderboard(title=None, limit=100):
+  scoreSet=BracketScore.objects.all() if title==None else BracketScore.objects.filter(title=title)
+  rows=scoreSet.order_by('-correctPredictions', 'totalPredictions').values_list("bracket_id", "title", "bracket__owner", "correctPredictions", "totalPredictions")[:limit]
+  leaderboard=[]
+  for (position, (bracketKey, bracketTitle, owner, correctPredictions, totalPredictions)) in enumerate(rows, start=1):
+    rank=position
+    if(leaderboard and (leaderboard[-1]["correctPredictions"], leaderboard[-1]["totalPredictions"])==(correctPredictions, totalPredictions)):
+      rank=leaderboard[-1]["rank"]
+    leaderboard.append({"rank": rank, "bracketId": bracketKey, "title": bracketTitle, "owner": owner, "correctPredictions": correctPredictions, "totalPredictions": totalPredictions})
+  return leaderboard
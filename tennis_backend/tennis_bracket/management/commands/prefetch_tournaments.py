@@ -0,0 +1,143 @@
+import logging
+import math
+import time
+from django.core.management.base import BaseCommand
+from tennis_scraper import RANKINGS_RETRY_INTERVAL, RANKINGS_TTL, TOURNAMENT_URL, findAllTournaments, getResultsDelta, getResultsVersion, parseBracketPage, parsedTitle, updateRankings
+from tennis_fetch import fetchPage
+from tennis_bracket.backend_functions import SCRAPE_MAX_INTERVAL, finishQueuedTournament, getQueuedTournaments, saveTournamentResults, saveTournamentSnapshot
+from tennis_bracket.leaderboard import updateLeaderboard
+
+logger=logging.getLogger(__name__)
+
+QUEUE_POLL_INTERVAL=2 # seconds between checks for tournaments queued by the bracket endpoint
+
+# Checks if the final of a tournament has been played
+# Parameter bracketData: tuple of tournament title, list of players, and list of match results from getBracketInfo function
+# Returns boolean
+def isTournamentFinished(bracketData):
+  (title, roster, results)=bracketData
+  highestRoundNumber=int(math.ceil(math.log2(len(roster))))
+  return any(match["roundNumber"]==highestRoundNumber for match in results)
+
+# Gets the amount of time before a tournament is scraped again
+# A tournament with new results is scraped again soon since matches are in progress, each scrape without new results doubles the wait
+# Parameter previousInterval: seconds waited before the last scrape, None if tournament has not been scraped before
+# Parameter changed: boolean that tells if the last scrape found new results
+# Parameter finished: boolean that tells if the final of the tournament has been played
+# Parameter minInterval: shortest wait in seconds
+# Parameter maxInterval: longest wait in seconds
+# Returns seconds before next scrape
+def getNextInterval(previousInterval, changed, finished, minInterval, maxInterval):
+  if(finished):
+    return maxInterval
+  if(changed or previousInterval==None):
+    return minInterval
+  return min(previousInterval*2, maxInterval)
+
+class Command(BaseCommand):
+  help="Scrapes current tournaments from tennisabstract.com in the background and stores their brackets for the bracket endpoint"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.storedVersions={} # tournament name to version of completed results from getResultsVersion function that was last stored
+
+  def add_arguments(self, parser):
+    parser.add_argument("--once", action="store_true", help="scrape every current tournament once and exit")
+    parser.add_argument("--min-interval", type=int, default=60, help="seconds between scrapes of a tournament with matches in progress")
+    parser.add_argument("--max-interval", type=int, default=SCRAPE_MAX_INTERVAL, help="seconds between scrapes of a tournament without new results")
+    parser.add_argument("--discovery-interval", type=int, default=60*60, help="seconds between checks for new tournaments")
+    parser.add_argument("--rankings-interval", type=int, default=RANKINGS_TTL, help="seconds between downloads of the ATP and WTA rankings tables")
+
+  def handle(self, *args, **options):
+    minInterval=options["min_interval"]
+    maxInterval=options["max_interval"]
+    schedule={} # tournament name to {"nextScrape": time, "interval": seconds}
+    forced=set() # queued tournaments already moved to the front of the schedule, so a failing scrape is not tried every poll
+    nextDiscovery=0
+    nextRankings=0
+    while(True):
+      now=time.time()
+      if(now>=nextDiscovery):
+        schedule=self.discoverTournaments(schedule)
+        nextDiscovery=now+options["discovery_interval"]
+      if(now>=nextRankings):
+        updated=self.storeRankings()
+        nextRankings=now+(options["rankings_interval"] if updated else RANKINGS_RETRY_INTERVAL)
+      # requested tournaments that are not stored yet or are outdated are scraped right away, even if they are already scheduled
+      queued=getQueuedTournaments()
+      forced&=set(queued)
+      for tournament in queued:
+        entry=schedule.setdefault(tournament, {"nextScrape": 0, "interval": None})
+        if(tournament not in forced):
+          entry["nextScrape"]=0
+          forced.add(tournament)
+      for (tournament, entry) in schedule.items():
+        if(time.time()<entry["nextScrape"]):
+          continue
+        (changed, finished)=self.scrapeTournament(tournament)
+        entry["interval"]=getNextInterval(entry["interval"], changed, finished, minInterval, maxInterval)
+        entry["nextScrape"]=time.time()+entry["interval"]
+      if(options["once"]):
+        return
+      nextScrape=min([entry["nextScrape"] for entry in schedule.values()]+[nextDiscovery, nextRankings, time.time()+QUEUE_POLL_INTERVAL])
+      time.sleep(max(nextScrape-time.time(), 1))
+
+  # Finds current tournaments, tournaments that are no longer current are not scraped anymore
+  # Parameter schedule: dictionary of tournament names to scrape schedule
+  # Returns updated schedule dictionary
+  def discoverTournaments(self, schedule):
+    try:
+      tournaments=findAllTournaments()
+    except Exception:
+      logger.warning("Could not find current tournaments", exc_info=True)
+      return schedule
+    updatedSchedule={}
+    for tournament in tournaments:
+      name=tournament['url'].replace('.html', '')
+      updatedSchedule[name]=schedule.get(name, {"nextScrape": 0, "interval": None})
+    self.stdout.write(f"Found {len(updatedSchedule)} current tournaments")
+    return updatedSchedule
+
+  # Downloads the ATP and WTA rankings tables and stores them for rank lookups of the web server
+  # Returns boolean: true if the rankings were stored, false if they could not be downloaded
+  def storeRankings(self):
+    try:
+      rankedPlayers=updateRankings()
+    except Exception:
+      logger.warning("Could not update rankings", exc_info=True)
+      return False
+    self.stdout.write("Updated rankings of "+", ".join(f"{count} {tour}" for (tour, count) in rankedPlayers.items())+" players")
+    return True
+
+  # Scrapes a tournament and stores its bracket
+  # When only matches were added since the last stored scrape, just the new matches are applied to the stored results and the leaderboard
+  # Parameter tournament: name of tournament page on tennisabstract.com
+  # Returns tuple of booleans: if the bracket changed and if the final has been played
+  def scrapeTournament(self, tournament):
+    url=TOURNAMENT_URL.format(tournament=tournament)
+    try:
+      bracketData=parseBracketPage(fetchPage(url, revalidate=True), url)
+    except Exception:
+      logger.warning("Could not scrape %s", url, exc_info=True)
+      return (False, False)
+    if(bracketData==None): # bracket is not posted yet
+      finishQueuedTournament(tournament, False)
+      return (False, False)
+    results=bracketData[2]
+    version=getResultsVersion(url)
+    delta=getResultsDelta(url, self.storedVersions.get(tournament, 0))
+    if(delta!=None and saveTournamentResults(tournament, results, delta['matches'])):
+      changed=len(delta['matches'])>0
+    else: # roster changed or results were parsed again, so the whole bracket is compared with the stored one
+      delta=None
+      changed=saveTournamentSnapshot(tournament, bracketData)
+    self.storedVersions[tournament]=version
+    finishQueuedTournament(tournament, True)
+    if(changed):
+      if(delta==None):
+        updateLeaderboard(parsedTitle(tournament), results)
+        self.stdout.write(f"Updated {tournament}")
+      else: # scores of brackets only change for the new results
+        updateLeaderboard(parsedTitle(tournament), results, delta['matches'])
+        self.stdout.write(f"Updated {tournament} with {len(delta['matches'])} new results")
+    return (changed, isTournamentFinished(bracketData))
@@ -0,0 +1,47 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tennis_benchmark import DRAW_SIZES, RESULTS_DIR, compareResults, recordFixtures, runBenchmarks
+
+class Command(BaseCommand):
+  help="Times the scraper and bracket functions offline using recorded or generated tennisabstract.com pages and saves the results as JSON"
+
+  def add_arguments(self, parser):
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs of each benchmark")
+    parser.add_argument("--draw-sizes", type=int, nargs="+", default=DRAW_SIZES, choices=DRAW_SIZES, help="draw sizes of tournament benchmarks")
+    parser.add_argument("--output", help="JSON file for results, default is benchmark_results/<commit>.json")
+    parser.add_argument("--compare", help="JSON file of earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed growth of median wall time before a benchmark counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with an error if a benchmark regressed")
+    parser.add_argument("--record-draw", nargs=2, action="append", default=[], metavar=("DRAW_SIZE", "TOURNAMENT"), help="download a tournament page as fixture, needs network")
+    parser.add_argument("--record-atp", metavar="PLAYER", help="download pages of an ATP player as fixtures, needs network")
+    parser.add_argument("--record-wta", metavar="PLAYER", help="download pages of a WTA player as fixtures, needs network")
+
+  def handle(self, *args, **options):
+    draws={int(drawSize): tournament for (drawSize, tournament) in options["record_draw"]}
+    if(draws or options["record_atp"] or options["record_wta"]):
+      for name in recordFixtures(draws, options["record_atp"], options["record_wta"]):
+        self.stdout.write(f"Recorded {name}")
+    # brackets are saved and deleted by the benchmarks, so they run in a test database
+    oldDatabaseName=connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+      data=runBenchmarks(options["iterations"], options["draw_sizes"])
+    finally:
+      connection.creation.destroy_test_db(oldDatabaseName, verbosity=0)
+    for result in data["results"]:
+      self.stdout.write(f"{result['benchmark']} [{result['case']}]: {result['wallMs']['median']:.3f} ms wall, {result['cpuMs']['median']:.3f} ms cpu, {result['peakKB']:.1f} KB peak, {result['queries']} queries")
+    output=options["output"]
+    if(output==None):
+      RESULTS_DIR.mkdir(exist_ok=True)
+      output=RESULTS_DIR / f"{data['commit']}.json"
+    with open(output, "w") as file:
+      json.dump(data, file, indent=2)
+    self.stdout.write(f"Saved results to {output}")
+    if(options["compare"]):
+      with open(options["compare"]) as file:
+        previous=json.load(file)
+      (lines, regressions)=compareResults(previous, data, options["threshold"])
+      for line in lines:
+        self.stdout.write(line)
+      if(regressions and options["fail_on_regression"]):
+        raise CommandError(f"{len(regressions)} benchmarks regressed")
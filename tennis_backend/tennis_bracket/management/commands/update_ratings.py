@@ -0,0 +1,41 @@
+import logging
+from django.core.management.base import BaseCommand
+from tennis_scraper import findAllTournaments
+from tennis_matchups import createDrawMatchups
+from tennis_ratings import updateRatings
+from tennis_bracket.backend_functions import getTournamentSnapshot
+
+logger=logging.getLogger(__name__)
+
+class Command(BaseCommand):
+  help="Stores match histories of every player in the current tournaments and updates their Elo ratings"
+
+  def add_arguments(self, parser):
+    parser.add_argument("--skip-download", action="store_true", help="only rate matches that are already in the match store")
+
+  def handle(self, *args, **options):
+    if(not options["skip_download"]):
+      self.loadCurrentPlayers()
+    ratedMatches=updateRatings()
+    self.stdout.write(f"Rated {ratedMatches} new matches")
+
+  # Stores matches of every player in the current tournaments in the match store, each player is downloaded once per tournament
+  # Returns void
+  def loadCurrentPlayers(self):
+    try:
+      tournaments=findAllTournaments()
+    except Exception:
+      logger.warning("Could not find current tournaments", exc_info=True)
+      return
+    for tournament in tournaments:
+      name=tournament['url'].replace('.html', '')
+      bracketData=getTournamentSnapshot(name) # draws are read from the tournaments stored by the prefetch_tournaments command
+      if(bracketData==None):
+        self.stdout.write(f"Skipped {name}, it is not stored yet")
+        continue
+      try:
+        data=createDrawMatchups(bracketData) # loads player pages of the draw and stores their matches
+      except Exception:
+        logger.warning("Could not load players of %s", name, exc_info=True)
+        continue
+      self.stdout.write(f"Loaded {len(data['ranks'])} players of {name}")
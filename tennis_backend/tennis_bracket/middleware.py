@@ -0,0 +1,54 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from tennis_metrics import METRICS_ENABLED, finishRequest, startRequest
+
+# Times every request, sends the time of each stage in the Server-Timing header and adds it to the metrics endpoint
+# The middleware removes itself when metrics are off so requests are not slowed down
+class MetricsMiddleware:
+  async_capable=True
+  sync_capable=True
+
+  def __init__(self, get_response):
+    if(not METRICS_ENABLED):
+      raise MiddlewareNotUsed
+    self.get_response=get_response
+    self.isAsync=iscoroutinefunction(get_response)
+    if(self.isAsync):
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if(self.isAsync):
+      return self.asyncCall(request)
+    (timings, token)=startRequest()
+    start=time.perf_counter()
+    try:
+      response=self.get_response(request)
+    finally:
+      totalSeconds=time.perf_counter()-start
+      finishRequest(timings, token, request.path, totalSeconds)
+    return addServerTiming(request, response, timings, totalSeconds)
+
+  async def asyncCall(self, request):
+    (timings, token)=startRequest()
+    start=time.perf_counter()
+    try:
+      response=await self.get_response(request)
+    finally:
+      totalSeconds=time.perf_counter()-start
+      finishRequest(timings, token, request.path, totalSeconds)
+    return addServerTiming(request, response, timings, totalSeconds)
+
+# Adds Server-Timing header to a response, the frontend can only read it if its origin is allowed
+# Parameter request: HttpRequest object
+# Parameter response: HttpResponse object
+# Parameter timings: RequestTimings object of request
+# Parameter totalSeconds: time spent handling the request
+# Returns response
+def addServerTiming(request, response, timings, totalSeconds):
+  response['Server-Timing']=timings.getServerTiming(totalSeconds)
+  origin=request.headers.get('Origin')
+  if(origin in settings.CORS_ORIGIN_WHITELIST):
+    response['Timing-Allow-Origin']=origin
+  return response
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BracketData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=256)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayerData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playerId', models.IntegerField(blank=True, null=True)),
+                ('score', models.IntegerField(blank=True, null=True)),
+                ('result', models.CharField(blank=True, max_length=256, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SeedingData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seedId', models.IntegerField()),
+                ('playerId', models.IntegerField(blank=True, null=True)),
+                ('playerName', models.CharField(blank=True, max_length=256, null=True)),
+                ('roster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tennis_bracket.bracketdata')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MatchData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('roundNumber', models.IntegerField()),
+                ('matchId', models.IntegerField()),
+                ('matches', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tennis_bracket.bracketdata')),
+                ('player1', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='player1', to='tennis_bracket.playerdata')),
+                ('player2', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='player2', to='tennis_bracket.playerdata')),
+            ],
+        ),
+    ]
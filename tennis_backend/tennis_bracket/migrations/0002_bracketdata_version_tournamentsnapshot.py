@@ -0,0 +1,35 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TournamentSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tournament', models.CharField(max_length=256, unique=True)),
+                ('title', models.CharField(max_length=256)),
+                ('roster', models.JSONField()),
+                ('results', models.JSONField()),
+                ('scrapedAt', models.DateTimeField()),
+                ('changedAt', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bracketdata',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='bracketdata',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
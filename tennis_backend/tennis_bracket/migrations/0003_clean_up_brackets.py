@@ -0,0 +1,71 @@
+import os
+import re
+
+from django.db import migrations
+
+
+# Matches and roster spots of a bracket get unique ids in the next migration. Brackets saved before could only have
+# repeated ids if the frontend sent them twice, so nothing is changed unless such rows are found.
+# Repeated rows are only moved if DEDUPLICATE_BRACKETS=1 is set when migrating, nothing is deleted: the rows are moved
+# to a new bracket titled DUPLICATES_TITLE, and are moved back into their bracket if this migration is reversed.
+DUPLICATES_TITLE = "{title} (duplicate rows of bracket {bracketKey})"
+DUPLICATES_TITLE_PATTERN = re.compile(r" \(duplicate rows of bracket (\d+)\)$")
+
+
+# Finds rows that repeat the id of an earlier row of the same bracket
+# Parameter model: MatchData or SeedingData model
+# Parameter bracketField: name of foreign key column to the bracket
+# Parameter idField: name of id that is unique per bracket
+# Returns dictionary from primary key of bracket to list of primary keys of repeated rows
+def findDuplicateRows(model, bracketField, idField):
+    seen = set()
+    duplicateRows = {}
+    for (key, bracketKey, rowId) in model.objects.order_by('id').values_list('id', bracketField, idField):
+        if (bracketKey, rowId) in seen:
+            duplicateRows.setdefault(bracketKey, []).append(key)
+        seen.add((bracketKey, rowId))
+    return duplicateRows
+
+
+def moveDuplicateRows(apps, schema_editor):
+    BracketData = apps.get_model('tennis_bracket', 'BracketData')
+    MatchData = apps.get_model('tennis_bracket', 'MatchData')
+    SeedingData = apps.get_model('tennis_bracket', 'SeedingData')
+    duplicates = [(MatchData, 'matches_id', findDuplicateRows(MatchData, 'matches_id', 'matchId')), (SeedingData, 'roster_id', findDuplicateRows(SeedingData, 'roster_id', 'seedId'))]
+    bracketKeys = sorted({bracketKey for (model, bracketField, duplicateRows) in duplicates for bracketKey in duplicateRows})
+    if not bracketKeys:
+        return
+    if os.environ.get('DEDUPLICATE_BRACKETS') != '1':
+        raise RuntimeError(f"Brackets {bracketKeys} have repeated match or roster ids. Run migrate with DEDUPLICATE_BRACKETS=1 to move the repeated rows to separate brackets (nothing is deleted).")
+    titles = dict(BracketData.objects.filter(pk__in=bracketKeys).values_list('id', 'title'))
+    duplicateBrackets = {}
+    for (model, bracketField, duplicateRows) in duplicates:
+        for (bracketKey, keys) in duplicateRows.items():
+            if bracketKey not in duplicateBrackets:
+                duplicateBrackets[bracketKey] = BracketData.objects.create(title=DUPLICATES_TITLE.format(title=titles[bracketKey], bracketKey=bracketKey))
+            model.objects.filter(pk__in=keys).update(**{bracketField: duplicateBrackets[bracketKey].pk})
+
+
+def restoreDuplicateRows(apps, schema_editor):
+    BracketData = apps.get_model('tennis_bracket', 'BracketData')
+    MatchData = apps.get_model('tennis_bracket', 'MatchData')
+    SeedingData = apps.get_model('tennis_bracket', 'SeedingData')
+    for (duplicatesKey, title) in BracketData.objects.filter(title__contains=' (duplicate rows of bracket ').values_list('id', 'title'):
+        match = DUPLICATES_TITLE_PATTERN.search(title)
+        if match is None:
+            continue
+        bracketKey = int(match.group(1))
+        MatchData.objects.filter(matches_id=duplicatesKey).update(matches_id=bracketKey)
+        SeedingData.objects.filter(roster_id=duplicatesKey).update(roster_id=bracketKey)
+        BracketData.objects.filter(pk=duplicatesKey).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0002_bracketdata_version_tournamentsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(moveDuplicateRows, restoreDuplicateRows),
+    ]
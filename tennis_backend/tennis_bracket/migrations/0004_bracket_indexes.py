@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0003_clean_up_brackets'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='matchdata',
+            constraint=models.UniqueConstraint(fields=('matches', 'matchId'), name='unique_match_per_bracket'),
+        ),
+        migrations.AddConstraint(
+            model_name='seedingdata',
+            constraint=models.UniqueConstraint(fields=('roster', 'seedId'), name='unique_seed_per_bracket'),
+        ),
+    ]
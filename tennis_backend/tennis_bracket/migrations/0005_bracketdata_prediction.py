@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0004_bracket_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bracketdata',
+            name='prediction',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
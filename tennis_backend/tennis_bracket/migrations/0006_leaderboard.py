@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0005_bracketdata_prediction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=256, unique=True)),
+                ('results', models.JSONField()),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BracketScore',
+            fields=[
+                ('bracket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='tennis_bracket.bracketdata')),
+                ('title', models.CharField(max_length=256)),
+                ('correctPredictions', models.IntegerField(default=0)),
+                ('totalPredictions', models.IntegerField(default=0)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['title', '-correctPredictions', 'totalPredictions'], name='leaderboard_by_tournament'), models.Index(fields=['-correctPredictions', 'totalPredictions'], name='leaderboard')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BracketPick',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=256)),
+                ('roundNumber', models.IntegerField()),
+                ('playerId', models.IntegerField()),
+                ('bracket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tennis_bracket.bracketdata')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['title', 'roundNumber', 'playerId'], name='pick_by_match_slot')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Sets the title of picks again from their bracket when this migration is reversed, picks are found by title before it
+def fillPickTitles(apps, schema_editor):
+    BracketData = apps.get_model('tennis_bracket', 'BracketData')
+    BracketPick = apps.get_model('tennis_bracket', 'BracketPick')
+    for (bracketKey, title) in BracketData.objects.values_list('id', 'title'):
+        BracketPick.objects.filter(bracket_id=bracketKey).update(title=title)
+
+
+# Gives every bracket but the newest one of a tournament its own owner, so brackets saved with the same title before
+# brackets had owners are all kept. The newest bracket is the one that was shown, it keeps the empty owner.
+def setDuplicateOwners(apps, schema_editor):
+    BracketData = apps.get_model('tennis_bracket', 'BracketData')
+    newestBrackets = {}
+    olderBracketKeys = []
+    for (bracketKey, title) in BracketData.objects.order_by('-id').values_list('id', 'title'):
+        if title in newestBrackets:
+            olderBracketKeys.append(bracketKey)
+        else:
+            newestBrackets[title] = bracketKey
+    for bracketKey in olderBracketKeys:
+        BracketData.objects.filter(pk=bracketKey).update(owner=f'bracket-{bracketKey}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0006_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, fillPickTitles),
+        migrations.RemoveIndex(
+            model_name='bracketpick',
+            name='pick_by_match_slot',
+        ),
+        migrations.AlterField(
+            model_name='bracketpick',
+            name='title',
+            field=models.CharField(default='', max_length=256),
+        ),
+        migrations.RemoveField(
+            model_name='bracketpick',
+            name='title',
+        ),
+        migrations.AddField(
+            model_name='bracketdata',
+            name='owner',
+            field=models.CharField(blank=True, default='', max_length=256),
+        ),
+        migrations.RunPython(setDuplicateOwners, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bracketpick',
+            name='bracket',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tennis_bracket.bracketdata'),
+        ),
+        migrations.AddIndex(
+            model_name='bracketpick',
+            index=models.Index(fields=['bracket', 'roundNumber', 'playerId'], name='pick_by_match_slot'),
+        ),
+        migrations.AddConstraint(
+            model_name='bracketdata',
+            constraint=models.UniqueConstraint(fields=('title', 'owner'), name='unique_bracket_per_owner'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis_bracket', '0007_bracket_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedTournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tournament', models.CharField(max_length=256, unique=True)),
+                ('queuedAt', models.DateTimeField(auto_now_add=True)),
+                ('checkedAt', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -6,9 +6,17 @@ class PlayerData(models.Model):
   score=models.IntegerField(blank=True, null=True)
   result=models.CharField(max_length=256, blank=True, null=True)
 
-# represents bracket data for a tournament with 'title' name
+# represents bracket data for a tournament with 'title' name created by a user, each user has one bracket per tournament that is updated in place
 class BracketData(models.Model):
   title=models.CharField(max_length=256)
+  owner=models.CharField(max_length=256, blank=True, default="") # name of user who created the bracket, empty if the bracket was saved without one
+  version=models.IntegerField(default=1) # increased every time the bracket is changed
+  updatedAt=models.DateTimeField(auto_now=True)
+  prediction=models.BinaryField(blank=True, null=True) # packed matches (see packed_bracket.py), MatchData rows are used instead if None
+
+  class Meta:
+    # unique index finds the bracket of a user with one seek, and the brackets of a tournament with its title prefix
+    constraints=[models.UniqueConstraint(fields=['title', 'owner'], name='unique_bracket_per_owner')]
 
 # represents list of players in the bracket
 class SeedingData(models.Model):
@@ -17,10 +25,60 @@ class SeedingData(models.Model):
   playerName=models.CharField(max_length=256, blank=True, null=True)
   roster=models.ForeignKey(BracketData, on_delete=models.CASCADE)
 
+  class Meta:
+    constraints=[models.UniqueConstraint(fields=['roster', 'seedId'], name='unique_seed_per_bracket')] # index used to load roster in order
 # represents match data in a bracket
 class MatchData(models.Model):
   roundNumber=models.IntegerField()
   player1=models.OneToOneField(PlayerData, on_delete=models.CASCADE, related_name='player1', blank=True, null=True)
   player2=models.OneToOneField(PlayerData, on_delete=models.CASCADE, related_name='player2', blank=True, null=True)
   matchId=models.IntegerField()
-  matches=models.ForeignKey(BracketData, on_delete=models.CASCADE)
\ No newline at end of file
+  matches=models.ForeignKey(BracketData, on_delete=models.CASCADE)
+
+  class Meta:
+    constraints=[models.UniqueConstraint(fields=['matches', 'matchId'], name='unique_match_per_bracket')] # index used to load and update matches by id
+
+# represents scraped bracket of a current tournament, kept up to date by the prefetch_tournaments management command
+class TournamentSnapshot(models.Model):
+  tournament=models.CharField(max_length=256, unique=True) # name of tournament page on tennisabstract.com
+  title=models.CharField(max_length=256)
+  roster=models.JSONField()
+  results=models.JSONField()
+  scrapedAt=models.DateTimeField() # last time tournament page was scraped
+  changedAt=models.DateTimeField() # last time roster or results changed
+
+# represents a tournament that was requested before it was stored, scraped next by the prefetch_tournaments command
+class QueuedTournament(models.Model):
+  tournament=models.CharField(max_length=256, unique=True) # name of tournament page on tennisabstract.com
+  queuedAt=models.DateTimeField(auto_now_add=True)
+  checkedAt=models.DateTimeField(blank=True, null=True) # set when the command found no bracket on the tournament page
+
+# represents a winner picked in a round of a user created bracket, found by match slot when a match of the tournament is completed
+class BracketPick(models.Model):
+  bracket=models.ForeignKey(BracketData, on_delete=models.CASCADE, db_index=False) # picks of a bracket are found with the pick_by_match_slot index
+  roundNumber=models.IntegerField()
+  playerId=models.IntegerField()
+
+  class Meta:
+    # picks of a match slot are found with one seek per bracket of the tournament, joined through the title index of BracketData
+    indexes=[models.Index(fields=['bracket', 'roundNumber', 'playerId'], name='pick_by_match_slot')]
+
+# represents the score of a user created bracket against the completed results of its tournament, read by the leaderboard
+class BracketScore(models.Model):
+  bracket=models.OneToOneField(BracketData, on_delete=models.CASCADE, primary_key=True)
+  title=models.CharField(max_length=256) # title of bracket, stored here so the leaderboard of a tournament is read in order from an index
+  correctPredictions=models.IntegerField(default=0)
+  totalPredictions=models.IntegerField(default=0)
+  updatedAt=models.DateTimeField(auto_now=True)
+
+  class Meta:
+    indexes=[
+      models.Index(fields=['title', '-correctPredictions', 'totalPredictions'], name='leaderboard_by_tournament'),
+      models.Index(fields=['-correctPredictions', 'totalPredictions'], name='leaderboard'),
+    ]
+
+# represents the completed results of a tournament that every bracket of the tournament has been scored against
+class LeaderboardState(models.Model):
+  title=models.CharField(max_length=256, unique=True)
+  results=models.JSONField()
+  updatedAt=models.DateTimeField(auto_now=True)
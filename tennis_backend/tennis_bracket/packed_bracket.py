@@ -0,0 +1,210 @@
+import struct
+
+# Compact encoding of a user predicted bracket, stored in BracketData.prediction instead of MatchData and PlayerData rows
+# Players of the first round are stored once, every later match is filled in from the winner picks of the two matches before it,
+# so a whole prediction is one winner bit per match plus a bit that tells if the match has a pick, and optional scores
+#
+# Layout (little endian):
+#   header: format version, log2 of draw size, flags (1 byte each)
+#   player ids of the first round: drawSize int16 values, -1 for an empty spot
+#   picked bitset and winner bitset: ceil(matches/8) bytes each, bit m is match id m, winner bit is 1 if player 2 won
+#   scores if FLAG_SCORES is set: int32 score of player 1 and player 2 of every match, -1 for no score
+
+PACKED_FORMAT_VERSION=1
+FLAG_SCORES=1
+NO_VALUE=-1
+MAX_PLAYER_ID=2**15-1
+MAX_SCORE=2**31-1
+
+# Gets the match id of the first match of every round of a bracket
+# Parameter drawSize: amount of spots in the first round of the bracket
+# Returns list of first match id of every round, first round first, with the amount of matches at the end
+def getRoundStarts(drawSize):
+  roundStarts=[0]
+  matchCount=drawSize//2
+  while(matchCount>=1):
+    roundStarts.append(roundStarts[-1]+matchCount)
+    matchCount//=2
+  return roundStarts
+
+# Gets the values of a player in a match
+# Parameter player: player data containing player id, score, and result, or None
+# Returns tuple of player id, score, and result, or None if there is no player
+def getPlayerValues(player):
+  if(player==None):
+    return None
+  return (player['playerId'], player.get('score'), player.get('result'))
+
+# Encodes a user predicted bracket
+# Parameter matches: list of matches sent by the frontend (match id, round number, and both players)
+# Returns bytes of packed prediction, or None if the bracket does not have the layout of a full tournament bracket and cannot be packed
+def packPrediction(matches):
+  matchCount=len(matches)
+  drawSize=matchCount+1
+  if(matchCount==0 or drawSize&matchCount!=0): # draw size is not a power of two
+    return None
+  matches=sorted(matches, key=lambda match: match['matchId'])
+  roundStarts=getRoundStarts(drawSize)
+  entrants=[]
+  picked=0
+  winners=0
+  scores=[]
+  for (roundNumber, (roundStart, roundEnd)) in enumerate(zip(roundStarts, roundStarts[1:]), start=1):
+    for matchId in range(roundStart, roundEnd):
+      match=matches[matchId]
+      if(match['matchId']!=matchId or match['roundNumber']!=roundNumber):
+        return None
+      players=(getPlayerValues(match['player1']), getPlayerValues(match['player2']))
+      for (playerNumber, values) in enumerate(players):
+        if(values==None):
+          scores.append(NO_VALUE)
+          if(roundNumber==1):
+            entrants.append(NO_VALUE)
+          continue
+        (playerId, score, result)=values
+        if(result not in ("win", None) or (score!=None and not 0<=score<=MAX_SCORE)):
+          return None
+        scores.append(NO_VALUE if score==None else score)
+        if(roundNumber==1):
+          if(playerId==None or not 0<=playerId<=MAX_PLAYER_ID):
+            return None
+          entrants.append(playerId)
+        if(result=="win"):
+          if(picked>>matchId&1): # both players won
+            return None
+          picked|=1<<matchId
+          winners|=playerNumber<<matchId
+  flags=FLAG_SCORES if any(score!=NO_VALUE for score in scores) else 0
+  bitsetSize=(matchCount+7)//8
+  packed=struct.pack(f"<BBB{drawSize}h", PACKED_FORMAT_VERSION, drawSize.bit_length()-1, flags, *entrants)
+  packed+=picked.to_bytes(bitsetSize, 'little')+winners.to_bytes(bitsetSize, 'little')
+  if(flags&FLAG_SCORES):
+    packed+=struct.pack(f"<{len(scores)}i", *scores)
+  # later rounds are filled in from the picks, so a bracket where they are different (ex. a pick with no player moving on) is stored as rows
+  if(unpackPrediction(packed)!=[normalizeMatch(match) for match in matches]):
+    return None
+  return packed
+
+# Puts a match sent by the frontend in the form returned by unpackPrediction so they can be compared
+# Parameter match: match sent by the frontend
+# Returns dictionary of match
+def normalizeMatch(match):
+  players=[]
+  for player in (match['player1'], match['player2']):
+    values=getPlayerValues(player)
+    players.append(None if values==None else {"playerId": values[0], "score": values[1], "result": values[2]})
+  return {"roundNumber": match['roundNumber'], "matchId": match['matchId'], "player1": players[0], "player2": players[1]}
+
+# Reads the header and bitsets of a packed prediction
+# Parameter packed: bytes of packed prediction
+# Returns tuple of draw size, list of player ids of the first round, picked bitset, winner bitset, and list of scores or None
+def readPrediction(packed):
+  (formatVersion, drawSizeExponent, flags)=struct.unpack_from("<BBB", packed)
+  if(formatVersion!=PACKED_FORMAT_VERSION):
+    raise ValueError(f"Unknown packed prediction format {formatVersion}")
+  drawSize=1<<drawSizeExponent
+  matchCount=drawSize-1
+  offset=3
+  entrants=list(struct.unpack_from(f"<{drawSize}h", packed, offset))
+  offset+=drawSize*2
+  bitsetSize=(matchCount+7)//8
+  picked=int.from_bytes(packed[offset:offset+bitsetSize], 'little')
+  winners=int.from_bytes(packed[offset+bitsetSize:offset+bitsetSize*2], 'little')
+  offset+=bitsetSize*2
+  scores=None
+  if(flags&FLAG_SCORES):
+    scores=list(struct.unpack_from(f"<{matchCount*2}i", packed, offset))
+  return (drawSize, entrants, picked, winners, scores)
+
+# Finds the players in every match from the first round players and the winner picks
+# Parameter drawSize: amount of spots in the first round of the bracket
+# Parameter entrants: list of player ids of the first round, -1 for an empty spot
+# Parameter picked: bitset of matches that have a winner pick
+# Parameter winners: bitset of matches that player 2 is picked to win
+# Returns list of player ids in both spots of every match (2 per match in order of match ids), -1 for an empty spot
+def getMatchPlayers(drawSize, entrants, picked, winners):
+  slots=list(entrants)
+  for matchId in range(drawSize-1):
+    # winner moves on to the next match, winners of matches 2j and 2j+1 of a round play each other
+    winner=NO_VALUE
+    if(picked>>matchId&1):
+      winner=slots[matchId*2+(winners>>matchId&1)]
+    if(matchId<drawSize-2):
+      slots.append(winner)
+  return slots
+
+# Decodes a packed prediction
+# Parameter packed: bytes of packed prediction
+# Returns list of matches in order of match ids, each with round number, match id, and both players (player id, score, and result)
+def unpackPrediction(packed):
+  (drawSize, entrants, picked, winners, scores)=readPrediction(packed)
+  slots=getMatchPlayers(drawSize, entrants, picked, winners)
+  roundStarts=getRoundStarts(drawSize)
+  matches=[]
+  for (roundNumber, (roundStart, roundEnd)) in enumerate(zip(roundStarts, roundStarts[1:]), start=1):
+    for matchId in range(roundStart, roundEnd):
+      players=[]
+      for playerNumber in range(2):
+        playerId=slots[matchId*2+playerNumber]
+        if(playerId==NO_VALUE):
+          players.append(None)
+          continue
+        score=None
+        if(scores!=None and scores[matchId*2+playerNumber]!=NO_VALUE):
+          score=scores[matchId*2+playerNumber]
+        won=bool(picked>>matchId&1) and (winners>>matchId&1)==playerNumber
+        players.append({"playerId": playerId, "score": score, "result": "win" if won else None})
+      matches.append({"roundNumber": roundNumber, "matchId": matchId, "player1": players[0], "player2": players[1]})
+  return matches
+
+# Encodes actual tournament results as two bitsets of player ids per round, so predictions can be scored with bitwise operations
+# Parameter actualResults: actual tournament results from web scraping
+# Returns dictionary from round number to tuple of bitset of players that played in the round and bitset of players that won
+def packActualResults(actualResults):
+  packedResults={}
+  for actualMatch in actualResults:
+    (played, won)=packedResults.get(actualMatch["roundNumber"], (0, 0))
+    for (playerId, opponent) in ((actualMatch["id1"], actualMatch["opponent1"]), (actualMatch["id2"], actualMatch["opponent2"])):
+      if(playerId==None or playerId<0): # player is not in the tournament draw
+        continue
+      played|=1<<playerId
+      if("result" in opponent):
+        won|=1<<playerId
+    packedResults[actualMatch["roundNumber"]]=(played, won)
+  return packedResults
+
+# Gets the amount of predictions right by user directly from a packed prediction, only considers matches that have already happened
+# A pick is counted if the picked winner played in that round, and is right if they also won
+# Parameter packed: bytes of packed prediction
+# Parameter packedResults: actual results from packActualResults function
+# Returns dictionary containing user prediction rate, same as getPredictionRate in backend_functions.py
+def scorePackedPrediction(packed, packedResults):
+  (drawSize, entrants, picked, winners, scores)=readPrediction(packed)
+  slots=getMatchPlayers(drawSize, entrants, picked, winners)
+  roundStarts=getRoundStarts(drawSize)
+  correctPredictions=0
+  totalPredictions=0
+  updatePredictionsFrontend=[]
+  for (roundNumber, (roundStart, roundEnd)) in enumerate(zip(roundStarts, roundStarts[1:]), start=1):
+    (played, won)=packedResults.get(roundNumber, (0, 0))
+    if(played==0):
+      continue
+    predicted=0
+    pickedMatches=[]
+    for matchId in range(roundStart, roundEnd):
+      if(not picked>>matchId&1 or slots[matchId*2]==NO_VALUE or slots[matchId*2+1]==NO_VALUE):
+        continue
+      playerNumber=winners>>matchId&1
+      playerId=slots[matchId*2+playerNumber]
+      predicted|=1<<playerId
+      pickedMatches.append((matchId, playerNumber, playerId))
+    countedPicks=predicted&played
+    correctPicks=predicted&won
+    totalPredictions+=bin(countedPicks).count("1")
+    correctPredictions+=bin(correctPicks).count("1")
+    for (matchId, playerNumber, playerId) in pickedMatches:
+      if(countedPicks>>playerId&1):
+        result="correct" if correctPicks>>playerId&1 else "incorrect"
+        updatePredictionsFrontend.append({"matchId": matchId, "result": result, "playerNumber": playerNumber+1, 'playerId': playerId})
+  predictionRate={"correctPredictions": correctPredictions, "totalPredictions": totalPredictions}
+  return {"predictionRate": predictionRate, "updatePredictionsFrontend": updatePredictionsFrontend}
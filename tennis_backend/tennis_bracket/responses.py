@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import orjson
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date
+from tennis_metrics import timed
+
+try:
+  import brotli
+except ImportError: # responses are only compressed with gzip
+  brotli=None
+
+COMPRESS_MIN_BYTES=1024 # smaller responses are sent uncompressed since compressing them saves almost nothing
+GZIP_LEVEL=6
+BROTLI_QUALITY=5 # quality above 5 is much slower for little gain on JSON
+CACHE_CONTROL="no-cache" # browsers keep responses but check with the ETag before using them
+
+# Encodes data sent to frontend as JSON
+# Parameter data: data sent to frontend
+# Returns bytes of JSON
+@timed("encode")
+def encodeData(data):
+  return orjson.dumps(data)
+
+# Creates a strong ETag from the state a response is built from
+# Parameter parts: values that change when the response changes (ex. path, query parameters, and version of stored data)
+# Returns ETag string
+def getETag(*parts):
+  return '"'+hashlib.sha1(orjson.dumps(parts, default=str)).hexdigest()+'"'
+
+# Checks if the frontend already has the response with an ETag
+# Parameter request: HttpRequest object
+# Parameter etag: ETag of response (without the encoding added by jsonResponse)
+# Returns boolean
+def isNotModified(request, etag):
+  ifNoneMatch=request.headers.get('If-None-Match')
+  if(ifNoneMatch==None):
+    return False
+  if(ifNoneMatch.strip()=="*"):
+    return True
+  base=etag.strip('"')
+  for tag in ifNoneMatch.split(','):
+    tag=tag.strip()
+    if(tag.startswith("W/")):
+      tag=tag[2:]
+    # compressed responses have the encoding added to their ETag (ex. "<hash>-br"), any encoding of the same data matches
+    if(tag.strip('"').split('-')[0]==base):
+      return True
+  return False
+
+# Creates a 304 response for a frontend that already has the response
+# Parameter etag: ETag of response
+# Returns HttpResponseNotModified object
+def notModifiedResponse(etag):
+  response=HttpResponseNotModified()
+  response['ETag']=etag
+  response['Cache-Control']=CACHE_CONTROL
+  return response
+
+# Finds the best compression accepted by the frontend
+# Parameter request: HttpRequest object
+# Returns "br", "gzip", or None
+def getAcceptedEncoding(request):
+  accepted=set()
+  for encoding in request.headers.get('Accept-Encoding', '').split(','):
+    (name, _, parameters)=encoding.strip().partition(';')
+    if(parameters.replace(' ', '') in ("q=0", "q=0.0", "q=0.00", "q=0.000")): # encoding is refused
+      continue
+    accepted.add(name.strip().lower())
+  if("br" in accepted and brotli!=None):
+    return "br"
+  if("gzip" in accepted):
+    return "gzip"
+  return None
+
+# Creates a JSON response that is compressed if it is large and has an ETag, 304 is sent if the frontend already has it
+# Parameter request: HttpRequest object
+# Parameter data: data sent to frontend
+# Parameter etag: ETag from getETag of the state the data was built from, None to use a hash of the JSON
+# Returns HttpResponse object
+def jsonResponse(request, data, etag=None):
+  content=encodeData(data)
+  if(etag==None):
+    etag='"'+hashlib.sha1(content).hexdigest()+'"'
+  if(isNotModified(request, etag)):
+    return notModifiedResponse(etag)
+  encoding=getAcceptedEncoding(request) if len(content)>=COMPRESS_MIN_BYTES else None
+  if(encoding=="br"):
+    content=brotli.compress(content, quality=BROTLI_QUALITY)
+  elif(encoding=="gzip"):
+    content=gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+  response=HttpResponse(content, content_type="application/json")
+  if(encoding!=None):
+    response['Content-Encoding']=encoding
+    etag=etag[:-1]+'-'+encoding+'"' # each encoding is a different representation so it has its own strong ETag
+  response['ETag']=etag
+  response['Cache-Control']=CACHE_CONTROL
+  response['Vary']="Accept-Encoding"
+  return response
+
+# Creates a 202 response for a request that is waiting on background work, the frontend asks again after a while
+# Parameter retryAfter: seconds before the frontend asks again
+# Returns HttpResponse object
+def queuedResponse(retryAfter):
+  response=HttpResponse(encodeData({"status": "queued"}), status=202, content_type="application/json")
+  response['Retry-After']=str(retryAfter)
+  response['Cache-Control']="no-store"
+  return response
+
+# Adds the time the stored tournament a response is built from was scraped, so the frontend can tell how old a bracket is
+# Parameter response: HttpResponse object
+# Parameter scrapedAt: datetime of last scrape of the tournament
+# Returns HttpResponse object
+def addScrapedAt(response, scrapedAt):
+  response['X-Scraped-At']=http_date(scrapedAt.timestamp())
+  return response
+
+# Encodes data sent to frontend as one line of newline delimited JSON
+# Parameter data: data sent to frontend
+# Returns bytes of JSON ending with a newline
+def encodeLine(data):
+  return orjson.dumps(data)+b"\n"
+
+# Creates a response of newline delimited JSON that is sent line by line as the lines are created
+# Streamed responses are not compressed since compressing holds back lines until enough data is collected
+# Parameter lines: async generator of lines from encodeLine
+# Parameter etag: ETag from getETag of the state the lines are built from, None if not known
+# Returns StreamingHttpResponse object
+def streamResponse(lines, etag=None):
+  response=StreamingHttpResponse(lines, content_type="application/x-ndjson")
+  if(etag!=None):
+    response['ETag']=etag
+    response['Cache-Control']=CACHE_CONTROL
+  response['X-Accel-Buffering']="no" # proxies such as nginx send each line right away
+  return response
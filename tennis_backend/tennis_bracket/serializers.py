@@ -1,7 +1,13 @@
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 
 from tennis_bracket.models import BracketData, MatchData, PlayerData, SeedingData
-from tennis_bracket.backend_functions import createPlayerDataObject
+from tennis_bracket.backend_functions import buildPlayerDataObject
+from tennis_bracket.leaderboard import getMatchPicks, scoreBracket
+from tennis_bracket.packed_bracket import getPlayerValues, packPrediction
+from tennis_metrics import timed
 
 # serializer for PlayerData objects
 class PlayerSerializer(serializers.ModelSerializer):
@@ -30,35 +36,202 @@ class BracketSerializer(serializers.ModelSerializer):
     class Meta:
       model = BracketData
       fields = "__all__"
+      read_only_fields = ('version', 'updatedAt')
+      validators = [] # saving a bracket that the user has saved for the tournament already updates it
+
+    # Check that every match in the bracket has a different id, since matches are updated by id
+    # Parameter matches: list of matches in the bracket
+    # Returns matches
+    def validate_matches(self, matches):
+      matchIds=[match['matchId'] for match in matches]
+      if(len(set(matchIds))!=len(matchIds)):
+        raise serializers.ValidationError("Match ids must be unique")
+      return matches
 
     # store bracket information in database with use of models in models.py
+    # Matches of a full tournament bracket are packed into BracketData.prediction (see packed_bracket.py), other brackets
+    # are stored as MatchData and PlayerData rows
+    # A new bracket is inserted with one bulk_create per model, a bracket that the user has already saved for the tournament
+    # is updated in place so only changed matches, players and roster spots are written
     # Parameter validated_data: bracket data that is stored using models from models.py
+    @timed("save", countQueries=True)
     def create(self, validated_data):
       title=validated_data['title']
+      owner=validated_data.get('owner', "")
       matches=validated_data['matches']
       roster=validated_data['roster']
-      bracketSet=BracketData.objects.filter(title=title)
-      if(bracketSet): # outdated brackets
-        bracketSet.delete()
-      bracket=BracketData.objects.create(title=title)
-      for match in matches:
-        roundNumber=match['roundNumber']
-        player1=match['player1']
-        player2=match['player2']
-        player1Object=None
-        player2Object=None
-        if(player1!=None):
-          player1Object=createPlayerDataObject(player1)
-        if(player2!=None):
-          player2Object=createPlayerDataObject(player2)
-        MatchData.objects.create(matches=bracket, matchId=match['matchId'], player1=player1Object, player2=player2Object, roundNumber=roundNumber)
-      seedId=0
-      for player in roster:
-        playerId=None
-        playerName=None
-        if(player!=None):
-          playerId=player['playerId']
-          playerName=player['playerName']
-        SeedingData.objects.create(seedId=seedId, playerId=playerId, playerName=playerName, roster=bracket)
-        seedId+=1
-      return bracket
\ No newline at end of file
+      prediction=packPrediction(matches)
+      with transaction.atomic():
+        (bracket, created)=BracketData.objects.select_for_update().get_or_create(title=title, owner=owner, defaults={'prediction': prediction})
+        if(created):
+          if(prediction==None):
+            insertMatches(bracket, matches)
+          insertRoster(bracket, list(enumerate(roster)))
+          scoreBracket(bracket, getMatchPicks(matches))
+        else:
+          matchesChanged=updatePrediction(bracket, matches, prediction)
+          rosterChanged=updateRoster(bracket, roster)
+          if(matchesChanged or rosterChanged):
+            # version is increased by the database so a save running at the same time cannot overwrite it with a stale value
+            BracketData.objects.filter(pk=bracket.pk).update(version=F('version')+1, updatedAt=timezone.now(), prediction=bracket.prediction)
+            bracket.refresh_from_db(fields=['version', 'updatedAt', 'prediction'])
+          if(matchesChanged): # picks are only stored again if they changed
+            scoreBracket(bracket, getMatchPicks(matches))
+      return bracket
+
+# Inserts matches of a bracket and the players in them
+# Parameter bracket: BracketData object
+# Parameter matches: list of matches sent by the frontend
+# Returns void
+def insertMatches(bracket, matches):
+  playerObjects=[]
+  matchObjects=[]
+  for match in matches:
+    player1=match['player1']
+    player2=match['player2']
+    player1Object=None
+    player2Object=None
+    if(player1!=None):
+      player1Object=buildPlayerDataObject(player1)
+      playerObjects.append(player1Object)
+    if(player2!=None):
+      player2Object=buildPlayerDataObject(player2)
+      playerObjects.append(player2Object)
+    matchObjects.append(MatchData(matches=bracket, matchId=match['matchId'], player1=player1Object, player2=player2Object, roundNumber=match['roundNumber']))
+  savePlayerDataObjects(playerObjects)
+  MatchData.objects.bulk_create(matchObjects)
+
+# Inserts roster spots of a bracket
+# Parameter bracket: BracketData object
+# Parameter seeds: list of tuples of seed id and player in the roster (player id and name, or None for an empty spot)
+# Returns void
+def insertRoster(bracket, seeds):
+  seedingObjects=[]
+  for (seedId, player) in seeds:
+    playerId=None
+    playerName=None
+    if(player!=None):
+      playerId=player['playerId']
+      playerName=player['playerName']
+    seedingObjects.append(SeedingData(seedId=seedId, playerId=playerId, playerName=playerName, roster=bracket))
+  SeedingData.objects.bulk_create(seedingObjects)
+
+# Updates stored matches of a bracket to the packed prediction, or to MatchData rows if the bracket cannot be packed
+# Parameter bracket: BracketData object of stored bracket, its prediction field is set but not saved
+# Parameter matches: list of matches sent by the frontend
+# Parameter prediction: packed matches from packPrediction function, or None
+# Returns boolean: true if any match changed, false otherwise
+def updatePrediction(bracket, matches, prediction):
+  storedPrediction=None if bracket.prediction==None else bytes(bracket.prediction)
+  bracket.prediction=prediction
+  if(storedPrediction!=None):
+    if(prediction==None): # bracket was packed before and has no rows
+      insertMatches(bracket, matches)
+    return prediction!=storedPrediction
+  if(prediction==None):
+    return updateMatches(bracket, matches)
+  # bracket saved as rows before (ex. before predictions were packed) is packed now
+  deleteMatches(bracket)
+  return True
+
+# Updates stored matches of a bracket to the matches sent by the frontend, matches that have not changed are not written
+# Parameter bracket: BracketData object of stored bracket
+# Parameter matches: list of matches sent by the frontend
+# Returns boolean: true if any match changed, false otherwise
+def updateMatches(bracket, matches):
+  storedMatches={}
+  for (key, matchId, roundNumber, player1Key, playerId1, score1, result1, player2Key, playerId2, score2, result2) in MatchData.objects.filter(matches=bracket).values_list("id", "matchId", "roundNumber", "player1_id", "player1__playerId", "player1__score", "player1__result", "player2_id", "player2__playerId", "player2__score", "player2__result"):
+    player1=None if player1Key==None else (playerId1, score1, result1)
+    player2=None if player2Key==None else (playerId2, score2, result2)
+    storedMatches[matchId]=(key, roundNumber, (player1Key, player1), (player2Key, player2))
+  newMatches=[]
+  changedMatches=[]
+  newPlayers=[] # tuples of MatchData object, field name, and unsaved PlayerData object
+  changedPlayers=[]
+  removedPlayerKeys=[]
+  for match in matches:
+    storedMatch=storedMatches.pop(match['matchId'], None)
+    if(storedMatch==None):
+      newMatches.append(match)
+      continue
+    (key, roundNumber, storedPlayer1, storedPlayer2)=storedMatch
+    matchObject=MatchData(pk=key, matches=bracket, matchId=match['matchId'], roundNumber=match['roundNumber'], player1_id=storedPlayer1[0], player2_id=storedPlayer2[0])
+    matchChanged=roundNumber!=match['roundNumber']
+    for (field, player, (playerKey, storedValues)) in (('player1', match['player1'], storedPlayer1), ('player2', match['player2'], storedPlayer2)):
+      values=getPlayerValues(player)
+      if(values==storedValues):
+        continue
+      if(values==None): # player was removed from match
+        removedPlayerKeys.append(playerKey)
+        setattr(matchObject, f'{field}_id', None)
+        matchChanged=True
+      elif(storedValues==None): # player was added to match
+        playerObject=buildPlayerDataObject(player)
+        newPlayers.append((matchObject, field, playerObject))
+        matchChanged=True
+      else:
+        changedPlayers.append(PlayerData(pk=playerKey, playerId=values[0], score=values[1], result=values[2]))
+    if(matchChanged):
+      changedMatches.append(matchObject)
+  removedMatchKeys=[storedMatch[0] for storedMatch in storedMatches.values()] # matches that are no longer in the bracket
+  for (key, roundNumber, storedPlayer1, storedPlayer2) in storedMatches.values():
+    removedPlayerKeys.extend(playerKey for (playerKey, storedValues) in (storedPlayer1, storedPlayer2) if playerKey!=None)
+  if(removedMatchKeys):
+    MatchData.objects.filter(pk__in=removedMatchKeys).delete()
+  if(newPlayers):
+    savePlayerDataObjects([playerObject for (matchObject, field, playerObject) in newPlayers])
+    for (matchObject, field, playerObject) in newPlayers:
+      setattr(matchObject, field, playerObject)
+  if(changedMatches):
+    MatchData.objects.bulk_update(changedMatches, ['roundNumber', 'player1', 'player2'])
+  if(changedPlayers):
+    PlayerData.objects.bulk_update(changedPlayers, ['playerId', 'score', 'result'])
+  if(removedPlayerKeys):
+    PlayerData.objects.filter(pk__in=removedPlayerKeys).delete()
+  if(newMatches):
+    insertMatches(bracket, newMatches)
+  return bool(newMatches or changedMatches or changedPlayers or removedMatchKeys)
+
+# Updates stored roster of a bracket to the roster sent by the frontend, roster spots that have not changed are not written
+# Parameter bracket: BracketData object of stored bracket
+# Parameter roster: list of players in the roster sent by the frontend
+# Returns boolean: true if the roster changed, false otherwise
+def updateRoster(bracket, roster):
+  storedSeeds={seedId: (key, (playerId, playerName)) for (key, seedId, playerId, playerName) in SeedingData.objects.filter(roster=bracket).values_list("id", "seedId", "playerId", "playerName")}
+  newSeeds=[]
+  changedSeeds=[]
+  for (seedId, player) in enumerate(roster):
+    values=(None, None) if player==None else (player['playerId'], player['playerName'])
+    storedSeed=storedSeeds.pop(seedId, None)
+    if(storedSeed==None):
+      newSeeds.append((seedId, player))
+    elif(storedSeed[1]!=values):
+      changedSeeds.append(SeedingData(pk=storedSeed[0], seedId=seedId, playerId=values[0], playerName=values[1], roster=bracket))
+  if(storedSeeds): # roster is shorter than before
+    SeedingData.objects.filter(pk__in=[key for (key, values) in storedSeeds.values()]).delete()
+  if(changedSeeds):
+    SeedingData.objects.bulk_update(changedSeeds, ['playerId', 'playerName'])
+  if(newSeeds):
+    insertRoster(bracket, newSeeds)
+  return bool(newSeeds or changedSeeds or storedSeeds)
+
+# Deletes the matches of a bracket together with their player data
+# Parameter bracket: BracketData object
+# Returns void
+def deleteMatches(bracket):
+  matchSet=MatchData.objects.filter(matches=bracket)
+  playerKeys=[]
+  for (player1Key, player2Key) in matchSet.values_list('player1_id', 'player2_id'):
+    playerKeys.extend(key for key in (player1Key, player2Key) if key!=None)
+  matchSet.delete()
+  PlayerData.objects.filter(pk__in=playerKeys).delete()
+
+# Saves PlayerData objects so their primary keys can be used by MatchData objects
+# Parameter playerObjects: list of unsaved PlayerData objects
+# Returns void
+def savePlayerDataObjects(playerObjects):
+  if(connection.features.can_return_rows_from_bulk_insert):
+    PlayerData.objects.bulk_create(playerObjects)
+  else: # database cannot send back primary keys of rows inserted with bulk_create
+    for playerObject in playerObjects:
+      playerObject.save()
@@ -1,3 +1,1072 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import IsolatedAsyncioTestCase, mock
+import httpx
+import urllib3
+from asgiref.sync import sync_to_async
+from bs4 import BeautifulSoup
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
 
-# Create your tests here.
+from tennis_bracket.models import BracketData, LeaderboardState, MatchData, PlayerData, QueuedTournament, SeedingData, TournamentSnapshot
+from tennis_bracket.serializers import BracketSerializer
+from tennis_bracket.backend_functions import QUEUE_RECHECK_INTERVAL, SCRAPE_MAX_INTERVAL, SNAPSHOT_MAX_AGE, getPredictedBracket, getPredictionRate, getPredictionRates, getQueuedTournaments, getStoredBracket, getTournamentSnapshot, saveTournamentSnapshot
+from tennis_bracket.leaderboard import getLeaderboard, updateLeaderboard
+from tennis_bracket.management.commands.prefetch_tournaments import Command
+from tennis_bracket.middleware import MetricsMiddleware
+import tennis_bracket.middleware as tennis_middleware
+from tennis_bracket.packed_bracket import packActualResults, packPrediction, scorePackedPrediction
+from tennis_benchmark import compareResults, createChangedBracketData, createPredictedBracketData, runBenchmarks
+from tennis_scraper import PlayerIndex, completedResultsState, getResultsDelta, getResultsVersion, parseBracketPage, parsedTitle
+from tennis_simulation import getWinProbabilities, simulateTournament
+from tennis_matches import MatchStore
+import tennis_matchups
+import tennis_ratings
+import tennis_simulation
+import tennis_scraper
+import tennis_scraper_async
+import tennis_fetch
+from tennis_extract import findHeadScript, findTitle
+from tennis_cache import CACHE_MAX_BYTES, DEFAULT_TTL, LEASE_SECONDS, PageCache, getTimeToLive
+from tennis_singleflight import AsyncSingleFlight, SingleFlight
+import tennis_metrics
+from tennis_metrics import MetricsRegistry, bindContext, timed
+
+# Creates bracket data for a tournament in the format sent by the frontend when a bracket is saved
+# Parameter title: title of tournament
+# Parameter drawSize: amount of players in the tournament bracket
+# Returns bracket data for a bracket where player 1 wins every match of the first round
+def createBracketData(title, drawSize):
+  roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(drawSize)]
+  matches=[]
+  for matchId in range(drawSize-1):
+    if(matchId<drawSize//2):
+      player1={"playerId": matchId*2, "score": 1636, "result": "win"}
+      player2={"playerId": matchId*2+1, "score": 414, "result": None}
+      matches.append({"roundNumber": 1, "matchId": matchId, "player1": player1, "player2": player2})
+    else: # later rounds are not predicted yet
+      matches.append({"roundNumber": 2, "matchId": matchId, "player1": None, "player2": None})
+  return {"title": title, "matches": matches, "roster": roster}
+
+# Creates a tournament page in the format of tennisabstract.com
+# Parameter playerNames: names of players in the draw
+# Parameter results: list of tuples of round name, winner, loser, and score, in the order they are listed on the page
+# Returns raw bytes of tournament page
+def createTournamentPage(playerNames, results):
+  cells=''.join(f'<td><a href="p">{playerName}</a></td>' for playerName in playerNames)
+  resultsHTML=''.join(f'{roundName}: <a href="p">{winner}</a> d. <a href="p">{loser}</a> {score}<br/>' for (roundName, winner, loser, score) in results)
+  script=f"var proj{len(playerNames)} = '<table><tr>{cells}</tr></table>';\nvar projCurrent = '';\nvar completedSingles = '{resultsHTML}';\nvar completedDoubles = '';"
+  return f'<html><head><title>Tennis Abstract: 2024 Test Open Results and Forecasts</title><script>{script}</script></head></html>'.encode()
+
+class StoredBracketTests(TestCase):
+  # Saves a bracket using BracketSerializer
+  # Parameter drawSize: amount of players in the tournament bracket
+  # Returns BracketData object of saved bracket
+  def saveBracket(self, drawSize):
+    serializer=BracketSerializer(data=createBracketData("2024 Test Open", drawSize))
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+  def test_stored_bracket_query_count_does_not_grow_with_draw_size(self):
+    for drawSize in (8, 128):
+      bracket=self.saveBracket(drawSize)
+      with self.assertNumQueries(2): # one query for matches with their players, one for the roster
+        data=getStoredBracket(bracket, "2024 Test Open")
+      self.assertEqual(len(data["results"]), drawSize-1)
+      self.assertEqual(len(data["roster"]), drawSize)
+
+  def test_stored_bracket_results(self):
+    bracket=self.saveBracket(8)
+    data=getStoredBracket(bracket, "2024 Test Open")
+    self.assertEqual(data["title"], "2024 Test Open")
+    self.assertEqual(data["method"], "database")
+    self.assertEqual(data["roster"][3], {"playerId": 3, "playerName": "Player 3"})
+    # placeholder digit is removed from winning score since scores have different lengths
+    self.assertEqual(data["results"][0], {"roundNumber": 1, "matchId": 0, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414, "result": None}})
+    self.assertEqual(data["results"][4], {"roundNumber": 2, "matchId": 4, "id1": None, "id2": None, "opponent1": None, "opponent2": None})
+    self.assertEqual(BracketData.objects.count(), 1)
+
+  def test_save_bracket_uses_bulk_statements(self):
+    self.saveBracket(128)
+    with CaptureQueriesContext(connection) as queries:
+      self.saveBracket(128)
+    self.assertLessEqual(len(queries), 20) # used to be more than 500 queries, one insert per player, match and roster spot
+    self.assertEqual(BracketData.objects.count(), 1)
+    self.assertEqual(MatchData.objects.count(), 127)
+    self.assertEqual(PlayerData.objects.count(), 128) # bracket is updated in place so players are not stored twice
+    self.assertEqual(SeedingData.objects.count(), 128)
+
+  def test_save_bracket_updates_changed_matches_only(self):
+    bracket=self.saveBracket(128)
+    data=createBracketData("2024 Test Open", 128)
+    data["matches"][0]["player1"].update({"score": 414, "result": None}) # user picks player 2 instead
+    data["matches"][0]["player2"].update({"score": 1636, "result": "win"})
+    serializer=BracketSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    with CaptureQueriesContext(connection) as queries:
+      updatedBracket=serializer.save()
+    self.assertLessEqual(len(queries), 14) # 4 of them update the changed pick and the score of the bracket on the leaderboard
+    self.assertFalse(any(query["sql"].startswith("DELETE") or query["sql"].startswith("INSERT") for query in queries))
+    self.assertEqual(updatedBracket.pk, bracket.pk)
+    self.assertEqual(updatedBracket.version, 2)
+    self.assertEqual(PlayerData.objects.count(), 128)
+    results=getStoredBracket(updatedBracket, "2024 Test Open")["results"]
+    self.assertEqual(results[0]["opponent2"], {"score": 636, "result": "win"})
+    self.assertEqual(results[1]["opponent1"], {"score": 636, "result": "win"})
+
+class PackedBracketTests(TestCase):
+  # Saves a full bracket using BracketSerializer
+  # Parameter bracketData: bracket data from createPredictedBracketData function
+  # Returns BracketData object of saved bracket
+  def saveBracket(self, bracketData):
+    serializer=BracketSerializer(data=bracketData)
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+  def test_full_bracket_is_packed(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(128)]
+    roster[5]=None # empty spot in the draw
+    bracketData=createPredictedBracketData("2024 Test Open", roster)
+    bracket=self.saveBracket(bracketData)
+    self.assertLess(len(bracket.prediction), 1400) # 2 bytes per player, 2 bits and 8 bytes of scores per match
+    self.assertEqual(MatchData.objects.count(), 0)
+    self.assertEqual(PlayerData.objects.count(), 0)
+    with self.assertNumQueries(1): # only the roster is queried
+      packedResults=getStoredBracket(bracket, "2024 Test Open")["results"]
+    bracket.delete()
+    bracketData["matches"].append({"roundNumber": 8, "matchId": 127, "player1": None, "player2": None}) # not a full bracket
+    self.assertIsNone(packPrediction(bracketData["matches"]))
+    bracket=self.saveBracket(bracketData)
+    self.assertIsNone(bracket.prediction)
+    self.assertEqual(getStoredBracket(bracket, "2024 Test Open")["results"][:127], packedResults)
+
+  def test_packed_bracket_update_and_score(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(8)]
+    bracketData=createPredictedBracketData("2024 Test Open", roster)
+    bracket=self.saveBracket(bracketData)
+    self.saveBracket(bracketData)
+    self.assertEqual(BracketData.objects.get().version, 1) # same picks do not change the bracket
+    bracketData=createChangedBracketData(bracketData) # player 4 is picked to win the final instead
+    bracket=self.saveBracket(bracketData)
+    self.assertEqual(bracket.version, 2)
+    predictedResults=getStoredBracket(bracket, "2024 Test Open")["results"]
+    self.assertEqual((predictedResults[6]["id2"], predictedResults[6]["opponent2"]["result"]), (4, "win"))
+    invalidBracketData=createChangedBracketData(bracketData)
+    invalidBracketData["matches"][0]["player2"]["result"]="win" # both players win so bracket is stored as rows
+    bracket=self.saveBracket(invalidBracketData)
+    self.assertIsNone(bracket.prediction)
+    self.assertEqual(MatchData.objects.count(), 7)
+    self.assertEqual(bracket.version, 3)
+    bracket=self.saveBracket(bracketData)
+    self.assertEqual(MatchData.objects.count(), 0)
+    self.assertEqual(PlayerData.objects.count(), 0)
+    actualResults=[
+      {"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}},
+      {"roundNumber": 1, "id1": 2, "id2": 3, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}},
+      {"roundNumber": 2, "id1": 0, "id2": 2, "opponent1": {"score": 414}, "opponent2": {"score": 636, "result": "win"}},
+    ]
+    predictionRate=scorePackedPrediction(bytes(bracket.prediction), packActualResults(actualResults))
+    self.assertEqual(predictionRate, getPredictionRate(predictedResults, actualResults))
+    self.assertEqual(predictionRate["predictionRate"], {"correctPredictions": 2, "totalPredictions": 3})
+
+class LeaderboardTests(TestCase):
+  # Checks that the stored score of a bracket is the same as its prediction rate
+  # Parameter bracket: BracketData object
+  # Parameter actualResults: actual tournament results
+  # Parameter owner: name of user who created the bracket
+  # Returns void
+  def assertScoreMatchesPredictionRate(self, bracket, actualResults, owner=""):
+    predictionRate=getPredictionRate(getStoredBracket(bracket, bracket.title)["results"], actualResults)["predictionRate"]
+    entry=next(entry for entry in getLeaderboard(bracket.title) if entry["owner"]==owner)
+    self.assertEqual((entry["correctPredictions"], entry["totalPredictions"]), (predictionRate["correctPredictions"], predictionRate["totalPredictions"]))
+
+  def test_leaderboard_applies_new_results_only(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(8)]
+    serializer=BracketSerializer(data=createPredictedBracketData("2024 Test Open", roster))
+    serializer.is_valid(raise_exception=True)
+    bracket=serializer.save()
+    results=[
+      {"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}},
+      {"roundNumber": 1, "id1": 2, "id2": 3, "opponent1": {"score": 414}, "opponent2": {"score": 636, "result": "win"}},
+    ]
+    self.assertEqual(updateLeaderboard("2024 Test Open", results), 2)
+    self.assertScoreMatchesPredictionRate(bracket, results)
+    results.insert(0, {"roundNumber": 2, "id1": 0, "id2": 3, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}})
+    with self.assertNumQueries(6): # state, two score updates for the new result, and saving state in a transaction
+      self.assertEqual(updateLeaderboard("2024 Test Open", results), 1)
+    self.assertScoreMatchesPredictionRate(bracket, results)
+    results[2]["opponent1"]["result"]="win" # result is corrected so every bracket is scored again
+    del results[2]["opponent2"]["result"]
+    self.assertIsNone(updateLeaderboard("2024 Test Open", results))
+    self.assertScoreMatchesPredictionRate(bracket, results)
+    self.assertEqual(getLeaderboard(), [{"rank": 1, "bracketId": bracket.pk, "title": "2024 Test Open", "owner": "", "correctPredictions": 3, "totalPredictions": 3}])
+
+  def test_brackets_of_same_tournament_are_scored_separately(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(8)]
+    brackets={}
+    for owner in ("alice", "bob", "carol"):
+      data=createPredictedBracketData("2024 Test Open", roster)
+      data["owner"]=owner
+      if(owner=="bob"): # bob picks player 1 in the first match
+        (data["matches"][0]["player1"], data["matches"][0]["player2"])=({"playerId": 0, "score": 414, "result": None}, {"playerId": 1, "score": 1636, "result": "win"})
+      serializer=BracketSerializer(data=data)
+      serializer.is_valid(raise_exception=True)
+      brackets[owner]=serializer.save()
+    results=[{"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}}]
+    self.assertEqual(updateLeaderboard("2024 Test Open", results), 1)
+    leaderboard=getLeaderboard("2024 Test Open")
+    self.assertEqual([(entry["rank"], entry["owner"], entry["correctPredictions"], entry["totalPredictions"]) for entry in leaderboard], [(1, "alice", 1, 1), (1, "carol", 1, 1), (3, "bob", 0, 1)])
+    for (owner, bracket) in brackets.items():
+      self.assertScoreMatchesPredictionRate(bracket, results, owner)
+    # saving a bracket again updates the bracket of its owner only
+    data=createPredictedBracketData("2024 Test Open", roster)
+    data["owner"]="bob"
+    serializer=BracketSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    self.assertEqual(serializer.save().pk, brackets["bob"].pk)
+    self.assertEqual(BracketData.objects.filter(title="2024 Test Open").count(), 3)
+    self.assertEqual([entry["correctPredictions"] for entry in getLeaderboard("2024 Test Open")], [1, 1, 1])
+    self.assertEqual(getPredictedBracket("2024 Test Open", roster, results, "bob")["predictionRate"]["correctPredictions"], 1)
+    self.assertIsNone(getPredictedBracket("2024 Test Open", roster, results, "dave"))
+
+  def test_leaderboard_limit_is_checked(self):
+    client=Client()
+    self.assertEqual(client.get("/leaderboard", {"limit": "abc"}).status_code, 400)
+    response=client.get("/leaderboard", {"limit": "0"}) # limit is raised to 1
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(json.loads(response.content), {"title": None, "leaderboard": []})
+
+class TournamentSnapshotTests(TestCase):
+  def test_snapshot_only_changes_with_new_results(self):
+    roster=[{"playerId": 0, "playerName": "Player 0"}, {"playerId": 1, "playerName": "Player 1"}]
+    self.assertIsNone(getTournamentSnapshot("2024ATPTestOpen"))
+    self.assertTrue(saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, [])))
+    changedAt=TournamentSnapshot.objects.get().changedAt
+    self.assertFalse(saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, [])))
+    self.assertEqual(TournamentSnapshot.objects.get().changedAt, changedAt)
+    results=[{"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}}]
+    self.assertTrue(saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, results)))
+    self.assertEqual(getTournamentSnapshot("2024ATPTestOpen"), ("2024 ATP Test Open", roster, results))
+
+class ResponseTests(TestCase):
+  def test_bracket_is_compressed_and_not_sent_again(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(64)]
+    saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, []))
+    client=Client()
+    response=client.get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"}, HTTP_ACCEPT_ENCODING="gzip")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["Content-Encoding"], "gzip")
+    self.assertEqual(json.loads(gzip.decompress(response.content))["roster"], roster)
+    # stored tournament has not changed so it is not loaded or scraped again
+    with mock.patch("tennis_scraper_async.fetchPage", side_effect=AssertionError), self.assertNumQueries(1):
+      notModified=client.get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"}, HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(notModified.status_code, 304)
+    results=[{"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 636, "result": "win"}, "opponent2": {"score": 414}}]
+    saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, results))
+    changed=client.get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"}, HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(changed.status_code, 200)
+    self.assertEqual(json.loads(changed.content)["results"], results)
+
+  async def test_streamed_bracket_sends_roster_first(self):
+    playerNames=["Player A", "Player B", "Player C", "Player D"]
+    roster=[{"playerId": playerId, "playerName": playerName} for (playerId, playerName) in enumerate(playerNames)]
+    results=[{"roundNumber": 1, "id1": 3, "id2": 2, "opponent1": {"score": 761, "result": "win"}, "opponent2": {"score": 651}},
+      {"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 66, "result": "win"}, "opponent2": {"score": 34}}]
+    await sync_to_async(saveTournamentSnapshot)("2024ATPTestOpen", ("2024 ATP Test Open", roster, results))
+    parameters={"tournament": "2024ATPTestOpen", "type": "webscrape", "stream": "ndjson"}
+    with mock.patch("tennis_scraper_async.fetchPage", side_effect=AssertionError): # stored bracket is streamed without a scrape
+      response=await AsyncClient().get("/bracket", parameters)
+    self.assertEqual(response["Content-Type"], "application/x-ndjson")
+    chunks=[chunk async for chunk in response.streaming_content]
+    self.assertEqual([chunk.count(b"\n") for chunk in chunks], [1]*4) # every line is sent on its own
+    lines=[json.loads(chunk) for chunk in chunks]
+    self.assertEqual([line["event"] for line in lines], ["roster", "match", "match", "complete"])
+    self.assertEqual([player["playerName"] for player in lines[0]["roster"]], playerNames)
+    self.assertEqual(lines[3]["method"], "webscrape")
+    self.assertEqual(results, [line["match"] for line in lines[1:3]])
+
+# Stores a tournament without results that has not been scraped for longer than SNAPSHOT_MAX_AGE
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter playerNames: names of players in the draw
+# Returns void
+def saveOutdatedSnapshot(tournament, playerNames):
+  roster=[{"playerId": playerId, "playerName": playerName} for (playerId, playerName) in enumerate(playerNames)]
+  saveTournamentSnapshot(tournament, ("2024 ATP Test Open", roster, []))
+  TournamentSnapshot.objects.filter(tournament=tournament).update(scrapedAt=timezone.now()-timedelta(seconds=SNAPSHOT_MAX_AGE+1))
+
+class SnapshotRequestTests(TestCase):
+  def test_unstored_tournament_is_queued_for_the_command(self):
+    parameters={"tournament": "2024ATPTestOpen", "type": "webscrape"}
+    with mock.patch("tennis_scraper_async.fetchPage", side_effect=AssertionError): # request never scrapes
+      queued=Client().get("/bracket", parameters)
+    self.assertEqual(queued.status_code, 202)
+    self.assertEqual(queued["Retry-After"], "2")
+    self.assertEqual(getQueuedTournaments(), ["2024ATPTestOpen"])
+    page=createTournamentPage(["Player A", "Player B"], [("F", "Player A", "Player B", "6-3 6-4")])
+    with mock.patch("tennis_bracket.management.commands.prefetch_tournaments.fetchPage", return_value=page):
+      Command(stdout=io.StringIO()).scrapeTournament("2024ATPTestOpen")
+    self.assertEqual(getQueuedTournaments(), [])
+    response=Client().get("/bracket", parameters)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(len(json.loads(response.content)["results"]), 1)
+
+  def test_tournament_without_bracket_is_not_found(self):
+    Client().get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"})
+    with mock.patch("tennis_bracket.management.commands.prefetch_tournaments.fetchPage", return_value=b"<html><head><title>Tennis Abstract: 2024 Test Open Results and Forecasts</title></head></html>"):
+      Command(stdout=io.StringIO()).scrapeTournament("2024ATPTestOpen")
+    self.assertEqual(getQueuedTournaments(), []) # checked tournament is not scraped again until QUEUE_RECHECK_INTERVAL has passed
+    self.assertEqual(Client().get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"}).status_code, 404)
+    QueuedTournament.objects.update(checkedAt=timezone.now()-timedelta(seconds=QUEUE_RECHECK_INTERVAL))
+    self.assertEqual(Client().get("/bracket", {"tournament": "2024ATPTestOpen", "type": "webscrape"}).status_code, 202)
+
+  def test_outdated_snapshot_is_sent_and_queued_for_the_command(self):
+    saveOutdatedSnapshot("2024ATPTestOpen", ["Player A", "Player B"])
+    parameters={"tournament": "2024ATPTestOpen", "type": "webscrape"}
+    with mock.patch("tennis_scraper_async.fetchPage", side_effect=AssertionError): # request never scrapes
+      response=Client().get("/bracket", parameters)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(json.loads(response.content)["results"], []) # stored bracket is sent
+    scrapedAt=TournamentSnapshot.objects.get(tournament="2024ATPTestOpen").scrapedAt
+    self.assertEqual(response["X-Scraped-At"], http_date(scrapedAt.timestamp()))
+    self.assertEqual(getQueuedTournaments(), ["2024ATPTestOpen"])
+    # tournament is already scheduled for later, the command scrapes it right away since it is queued
+    schedule={"2024ATPTestOpen": {"nextScrape": time.time()+SCRAPE_MAX_INTERVAL, "interval": SCRAPE_MAX_INTERVAL}}
+    scraped=[]
+    with mock.patch.object(Command, "discoverTournaments", return_value=schedule), mock.patch.object(Command, "storeRankings", return_value=True), \
+        mock.patch.object(Command, "scrapeTournament", lambda command, tournament: scraped.append(tournament) or (False, False)):
+      call_command("prefetch_tournaments", "--once", stdout=io.StringIO())
+    self.assertEqual(scraped, ["2024ATPTestOpen"])
+
+class SingleFlightTests(TestCase):
+  def test_concurrent_callers_share_one_call(self):
+    calls=[]
+    def download(url):
+      calls.append(url)
+      time.sleep(0.2)
+      return url.upper()
+    flights=SingleFlight()
+    results=[]
+    threads=[threading.Thread(target=lambda: results.append(flights.do("page", download, "page"))) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual((calls, results), (["page"], ["PAGE"]*8))
+    async def downloadAsync(url):
+      calls.append(url)
+      await asyncio.sleep(0.05)
+      return url.upper()
+    async def requestPages():
+      asyncFlights=AsyncSingleFlight()
+      return await asyncio.gather(*[asyncFlights.do("page", downloadAsync, "page") for _ in range(8)])
+    self.assertEqual(asyncio.run(requestPages()), ["PAGE"]*8)
+    self.assertEqual(len(calls), 2)
+
+  def test_only_one_process_holds_download_lease(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path=os.path.join(directory, "cache.sqlite3")
+      (cache, otherProcessCache)=(PageCache(path), PageCache(path))
+      owner=cache.acquireLease("page")
+      self.assertIsNotNone(owner)
+      self.assertIsNone(otherProcessCache.acquireLease("page"))
+      cache.releaseLease("page", owner)
+      self.assertIsNotNone(otherProcessCache.acquireLease("page"))
+      cache.connection.close()
+      otherProcessCache.connection.close()
+
+class CompletedResultsTests(TestCase):
+  def test_new_results_are_parsed_incrementally(self):
+    url="https://www.tennisabstract.com/current/2024ATPTestOpen.html"
+    completedResultsState.pop(url, None)
+    playerNames=["Player A", "Player B", "Player C", "Player D"]
+    results=[("R1", "Player A", "Player B", "6-3 6-4")]
+    parseBracketPage(createTournamentPage(playerNames, results), url)
+    version=getResultsVersion(url)
+    for newResults in ([("R1", "Player D", "Player C", "7-6(5) 6-1")], [("F", "Player A", "Player D", "6-2 6-2")]):
+      results=newResults+results # newest results are listed first
+      matchList=parseBracketPage(createTournamentPage(playerNames, results), url)[2]
+      self.assertEqual(matchList, parseBracketPage(createTournamentPage(playerNames, results), None)[2]) # same as parsing the whole page
+    delta=getResultsDelta(url, version)
+    self.assertEqual(delta["version"], version+2)
+    self.assertEqual([(match["roundNumber"], match["id1"], match["id2"]) for match in delta["matches"]], [(1, 2, 3), (2, 0, 3)])
+    self.assertIsNone(getResultsDelta(url, version-1)) # first results were a full parse
+
+  def test_command_stores_only_new_results(self):
+    completedResultsState.pop("https://www.tennisabstract.com/current/2024ATPTestOpen.html", None)
+    playerNames=["Player A", "Player B", "Player C", "Player D"]
+    results=[("R1", "Player A", "Player B", "6-3 6-4")]
+    command=Command(stdout=io.StringIO())
+    with mock.patch("tennis_bracket.management.commands.prefetch_tournaments.fetchPage", return_value=createTournamentPage(playerNames, results)):
+      self.assertEqual(command.scrapeTournament("2024ATPTestOpen"), (True, False))
+    results=[("R1", "Player D", "Player C", "7-6(5) 6-1")]+results
+    with mock.patch("tennis_bracket.management.commands.prefetch_tournaments.fetchPage", return_value=createTournamentPage(playerNames, results)), \
+        mock.patch("tennis_bracket.management.commands.prefetch_tournaments.saveTournamentSnapshot", side_effect=AssertionError): # stored roster is not compared again
+      self.assertEqual(command.scrapeTournament("2024ATPTestOpen"), (True, False))
+      self.assertEqual(command.scrapeTournament("2024ATPTestOpen"), (False, False))
+    self.assertIn("Updated 2024ATPTestOpen with 1 new results", command.stdout.getvalue())
+    self.assertEqual(len(getTournamentSnapshot("2024ATPTestOpen")[2]), 2)
+    self.assertEqual(LeaderboardState.objects.get(title=parsedTitle("2024ATPTestOpen")).results, getTournamentSnapshot("2024ATPTestOpen")[2])
+
+class MatchupTests(TestCase):
+  def test_matchups_are_created_from_stored_tournament(self):
+    roster=[{"playerId": playerId, "playerName": playerName} for (playerId, playerName) in enumerate(["Player A", "Player B", "Player C", "Player D"])]
+    saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, []))
+    loaded=[]
+    # Gets a player profile without downloading player pages
+    def loadPlayerProfile(player):
+      loaded.append(player)
+      return {"rank": "ABCD".index(player[-1])+1, "tourType": "ATP"}
+    store=mock.Mock()
+    store.getH2HRecords.side_effect=lambda player: {"Player B": {"wins": 2, "losses": 1}} if player=="PlayerA" else {}
+    with mock.patch("tennis_scraper.fetchPage", side_effect=AssertionError), mock.patch.object(tennis_matchups, "loadPlayerProfile", loadPlayerProfile), \
+        mock.patch.object(tennis_matchups, "matchStore", store), mock.patch.dict(tennis_matchups.matchupCache, clear=True):
+      matchups=json.loads(Client().get("/matchups", {"tournament": "2024ATPTestOpen"}).content)
+      with self.assertNumQueries(1): # cached matchups are sent without loading the stored tournament
+        self.assertEqual(json.loads(Client().get("/matchups", {"tournament": "2024ATPTestOpen"}).content), matchups)
+      self.assertEqual(len(loaded), 4)
+      results=[{"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 66, "result": "win"}, "opponent2": {"score": 34}}]
+      saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, results))
+      Client().get("/matchups", {"tournament": "2024ATPTestOpen"})
+      self.assertEqual(len(loaded), 8)
+      self.assertEqual(Client().get("/matchups", {"tournament": "2024WTATestCup"}).status_code, 404) # tournament is not stored
+    self.assertEqual(matchups["title"], "2024 ATP Test Open")
+    self.assertEqual([rank["rank"] for rank in matchups["ranks"]], [1, 2, 3, 4])
+    self.assertEqual(matchups["h2h"], [{"id1": 0, "id2": 1, "roundNumber": 1, "wins": 2, "losses": 1}])
+
+class SimulationTests(TestCase):
+  def test_simulation_keeps_completed_results(self):
+    roster=[{"playerId": playerId, "playerName": f"Player {playerId}"} for playerId in range(7)]
+    roster.insert(1, None) # player 0 has a bye
+    ranks=[{"playerId": playerId, "rank": playerId+1} for playerId in range(7)]
+    h2h=[{"id1": 1, "id2": 2, "roundNumber": 1, "wins": 0, "losses": 40}]
+    probabilities=getWinProbabilities(roster, ranks, h2h)
+    self.assertLess(probabilities[2, 3], 0.2) # head to head record outweighs better rank
+    results=[{"roundNumber": 1, "id1": 3, "id2": 4, "opponent1": {"score": 46}, "opponent2": {"score": 1636, "result": "win"}}]
+    roundProbabilities=simulateTournament(roster, results, probabilities, 20000, seed=0)
+    self.assertEqual(roundProbabilities.shape, (8, 4))
+    self.assertEqual(roundProbabilities[0, 1], 1) # bye
+    self.assertEqual(roundProbabilities[4, 1], 0) # player 3 lost in the first round
+    self.assertEqual(roundProbabilities[5, 1], 1)
+    self.assertTrue(all(abs(total-players)<1e-9 for (total, players) in zip(roundProbabilities.sum(axis=0), (7, 4, 2, 1))))
+    self.assertGreater(roundProbabilities[0, 3], roundProbabilities[7, 3]) # best rank wins most often
+
+  def test_simulation_reads_stored_data_only(self):
+    roster=[{"playerId": playerId, "playerName": playerName} for (playerId, playerName) in enumerate(["Player A", "Player B", "Player C", "Player D"])]
+    saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, []))
+    parameters={"tournament": "2024ATPTestOpen", "simulations": 1000}
+    rankings={"PlayerA": {"rank": 1}, "PlayerB": {"rank": 80}, "PlayerC": {"rank": 20}}
+    store=mock.Mock()
+    store.getH2HRecords.return_value={}
+    with mock.patch("tennis_scraper.fetchPage", side_effect=AssertionError), mock.patch("tennis_scraper.fetchPages", side_effect=AssertionError), \
+        mock.patch.object(tennis_simulation, "getRanking", rankings.get), mock.patch.object(tennis_matchups, "matchStore", store), \
+        mock.patch.object(tennis_simulation, "getDrawRatings", lambda roster: (None, tennis_simulation.np.full(len(roster), tennis_simulation.np.nan))), \
+        mock.patch.dict(tennis_simulation.simulationCache, clear=True):
+      simulation=json.loads(Client().get("/simulation", parameters).content)
+      with self.assertNumQueries(1): # cached simulation is sent without loading the stored tournament
+        self.assertEqual(json.loads(Client().get("/simulation", parameters).content), simulation)
+      results=[{"roundNumber": 1, "id1": 0, "id2": 1, "opponent1": {"score": 46}, "opponent2": {"score": 1636, "result": "win"}}]
+      saveTournamentSnapshot("2024ATPTestOpen", ("2024 ATP Test Open", roster, results))
+      upset=json.loads(Client().get("/simulation", parameters).content)
+    self.assertGreater(simulation["players"][0]["roundProbabilities"][1], 0.9) # best ranked player from the stored rankings
+    self.assertEqual(upset["players"][0]["roundProbabilities"][1], 0) # player 0 lost in the first round
+    self.assertEqual(upset["players"][1]["roundProbabilities"][1], 1)
+
+class RankingsTests(TestCase):
+  # Creates a rankings table in the format of tennisabstract.com
+  # Parameter playerPage: name of player page script (ex. "player.cgi")
+  # Parameter names: names of ranked players, best rank first
+  # Returns raw bytes of rankings page
+  def createRankingsPage(self, playerPage, names):
+    rows=''.join(f'<tr><td align="right">{rank}</td><td><a href="https://www.tennisabstract.com/cgi-bin/{playerPage}?p={name.replace(" ", "")}">{name.replace(" ", "&nbsp;")}</a></td><td>ITA</td></tr>' for (rank, name) in enumerate(names, start=1))
+    return f'<html><body><table id="reportable"><tr><th>Rank</th><th>Player</th><th>Country</th></tr>{rows}</table></body></html>'.encode()
+
+  def test_ranks_are_read_from_rankings_tables(self):
+    pages={
+      tennis_scraper.RANKINGS_URLS["ATP"]: self.createRankingsPage("player.cgi", ["Jannik Sinner", "Carlos Alcaraz"]),
+      tennis_scraper.RANKINGS_URLS["WTA"]: self.createRankingsPage("wplayer.cgi", ["Aryna Sabalenka", "Iga Swiatek"]),
+      tennis_scraper.WTA_RECENT_MATCHES_URL.format(player="IgaSwiatek"): b'var matchmx = [] ]];',
+      tennis_scraper.ATP_PLAYER_URL.format(player="CarlosAlcaraz"): b'<html><head><script>var currentrank = 3;\nvar peakrank = 1;</script></head></html>',
+    }
+    downloads=[]
+    # Gets fixture pages and records which were downloaded
+    def fetchPages(urls):
+      downloads.extend(urls)
+      return [pages.get(url, b'') for url in urls]
+    with tempfile.TemporaryDirectory() as storeDir:
+      store=MatchStore(os.path.join(storeDir, "rankings.sqlite3"))
+      store.storeCareerMatches("IgaSwiatek", "WTA", [])
+      with mock.patch.object(tennis_scraper, "matchStore", store), mock.patch.object(tennis_scraper, "fetchPages", fetchPages), \
+          mock.patch.object(tennis_scraper, "fetchPage", lambda url: fetchPages([url])[0]), \
+          mock.patch.object(tennis_scraper, "rankingsIndex", {"players": None, "loadedAt": 0, "refreshing": False}):
+        # rankings are not stored yet, they are not downloaded by a request and the player page is used instead
+        self.assertIsNone(tennis_scraper.getRanking("CarlosAlcaraz"))
+        self.assertEqual(downloads, [])
+        self.assertEqual(tennis_scraper.getPlayerRank("CarlosAlcaraz"), 3)
+        self.assertEqual(downloads, [tennis_scraper.ATP_PLAYER_URL.format(player="CarlosAlcaraz")])
+        self.assertEqual(tennis_scraper.updateRankings(), {"ATP": 2, "WTA": 2}) # done by the prefetch_tournaments command
+        self.assertEqual(tennis_scraper.getRanking("CarlosAlcaraz"), {"rank": 2, "tourType": "ATP"})
+        self.assertEqual(tennis_scraper.getRanking("(1) Aryna Sabalenka"), {"rank": 1, "tourType": "WTA"})
+        self.assertIsNone(tennis_scraper.getRanking("UnknownPlayer"))
+        downloads.clear()
+        profile=tennis_scraper.getPlayerProfiles("IgaSwiatek", "Aryna Sabalenka", "ArynaSabalenka")
+        # WTA player is known from the rankings so only her recent matches are downloaded
+        self.assertEqual(downloads, [tennis_scraper.WTA_RECENT_MATCHES_URL.format(player="IgaSwiatek")])
+        self.assertEqual((profile["playerRank"], profile["opponentRank"], profile["tourType"]), (2, 1, "WTA"))
+      store.connection.close()
+
+class MatchStoreTests(TestCase):
+  def test_h2h_skips_withdraws_and_unplayed_matches_only(self):
+    matches=[
+      ["20230101", "Tournament", "Clay", "A", "W", "", "", "", "F", "6-4 6-4", "", "Player B"],
+      ["20230201", "Tournament", "Hard", "A", "L", "", "", "", "SF", None, "", "Player B"], # score not known
+      ["20230301", "Tournament", "Hard", "A", "W", "", "", "", "QF", "W/O", "", "Player B"],
+      ["20230401", "Tournament", "Grass", "A", "W", "", "", "", "R16", "", "", "Player B"],
+    ]
+    with tempfile.TemporaryDirectory() as storeDir:
+      store=MatchStore(os.path.join(storeDir, "h2h.sqlite3"))
+      store.storeCareerMatches("PlayerA", "ATP", matches)
+      self.assertEqual(store.getH2H("PlayerA", "Player B"), {"wins": 1, "losses": 1})
+      self.assertEqual(store.getH2HRecords("PlayerA"), {"Player B": {"wins": 1, "losses": 1}})
+      self.assertEqual(len(store.getPlayedMatches()), 2)
+      store.connection.close()
+
+class RatingsTests(TestCase):
+  # Creates a match in the format of tennisabstract.com match arrays
+  # Parameter date: date tournament started
+  # Parameter surface: surface of match
+  # Parameter result: "W" or "L"
+  # Parameter roundName: round of match (ex. "QF")
+  # Parameter opponent: name of opponent
+  # Returns array of match
+  def createMatch(self, date, surface, result, roundName, opponent):
+    return [date, f"Tournament {date}", surface, "A", result, "", "", "", roundName, "6-4 6-4", "", opponent]
+
+  def test_ratings_update_incrementally(self):
+    with tempfile.TemporaryDirectory() as storeDir:
+      store=MatchStore(os.path.join(storeDir, "ratings.sqlite3"))
+      with mock.patch.object(tennis_ratings, "matchStore", store):
+        tennis_ratings.ratingsCache["ratings"]=None
+        store.storeCareerMatches("PlayerA", "ATP", [self.createMatch("20230101", "Clay", "W", "F", "Player B"), self.createMatch("20230201", "Hard", "L", "SF", "Player C")])
+        # same final is in the matches of player B so it is only rated once
+        store.storeCareerMatches("PlayerB", "ATP", [self.createMatch("20230101", "Clay", "L", "F", "Player A")])
+        self.assertEqual(tennis_ratings.updateRatings(), 2)
+        self.assertEqual(tennis_ratings.updateRatings(), 0)
+        self.assertGreater(tennis_ratings.getPlayerRating("PlayerA", "Clay"), tennis_ratings.getPlayerRating("PlayerA", "Hard"))
+        self.assertGreater(tennis_ratings.getWinProbability("PlayerC", "PlayerB"), 0.5)
+        self.assertIsNone(tennis_ratings.getWinProbability("PlayerA", "PlayerD"))
+        # newer matches are added on top of stored ratings
+        store.storeRecentMatches("PlayerA", "ATP", json.dumps([self.createMatch("20240101", "Grass", "W", "R32", "Player D")]))
+        self.assertEqual(tennis_ratings.updateRatings(), 1)
+        incrementalRatings=store.getRatings()
+        # older matches make every match be rated again in order, which gives the same ratings as rating everything at once
+        store.storeCareerMatches("PlayerD", "ATP", [self.createMatch("20220101", "Hard", "W", "R16", "Player E")])
+        self.assertEqual(tennis_ratings.updateRatings(), 1)
+        self.assertEqual(len(store.getRatedMatches()), 4)
+        self.assertNotEqual(store.getRatings()[("PlayerD", "All")], incrementalRatings[("PlayerD", "All")])
+        self.assertAlmostEqual(store.getRatings()[("PlayerA", "Clay")][0], incrementalRatings[("PlayerA", "Clay")][0])
+      tennis_ratings.ratingsCache["ratings"]=None
+
+class BenchmarkTests(TestCase):
+  def test_benchmarks_run_offline(self):
+    data=runBenchmarks(1, [32])
+    benchmarks={result["benchmark"] for result in data["results"]}
+    self.assertEqual(benchmarks, {"getBracketInfo", "getPlayerList", "getCompletedMatchList", "BracketSerializer.create", "getStoredBracket", "getPredictionRate", "getPackedPredictionRate", "simulateTournament", "getH2H"})
+    storedBracket=next(result for result in data["results"] if result["benchmark"]=="getStoredBracket")
+    self.assertEqual(storedBracket["queries"], 1) # benchmark bracket is packed so only the roster is queried
+    (lines, regressions)=compareResults(data, data, 0.1)
+    self.assertEqual(len(lines), len(data["results"]))
+    self.assertEqual(regressions, [])
+
+# Gets the prediction rate the way getPredictionRate did before actual results were indexed, by comparing every predicted
+# match with every actual match of its round
+# Parameter predictedResults: user predicted tournament results
+# Parameter actualResults: actual tournament results
+# Returns dictionary containing user prediction rate
+def getPredictionRateNestedLoop(predictedResults, actualResults):
+  correctPredictions=0
+  totalPredictions=0
+  updatePredictionsFrontend=[]
+  for predictedMatch in predictedResults:
+    (id1, id2, opponent1, opponent2)=(predictedMatch["id1"], predictedMatch["id2"], predictedMatch["opponent1"], predictedMatch["opponent2"])
+    if(id1==None or id2==None or not opponent1 or not opponent2 or not (opponent1["result"] or opponent2["result"])):
+      continue
+    for actualMatch in actualResults:
+      if(predictedMatch["roundNumber"]!=actualMatch["roundNumber"]):
+        continue
+      # same order of checks as before: picked player as player 1 and as player 2 of the actual match
+      if(id1==actualMatch["id1"] and opponent1["result"]=="win"):
+        (playerNumber, playerId, opponentActual)=(1, id1, actualMatch["opponent1"])
+      elif(id2==actualMatch["id2"] and opponent2["result"]=="win"):
+        (playerNumber, playerId, opponentActual)=(2, id2, actualMatch["opponent2"])
+      elif(id1==actualMatch["id2"] and opponent1["result"]=="win"):
+        (playerNumber, playerId, opponentActual)=(1, id1, actualMatch["opponent2"])
+      elif(id2==actualMatch["id1"] and opponent2["result"]=="win"):
+        (playerNumber, playerId, opponentActual)=(2, id2, actualMatch["opponent1"])
+      else:
+        continue
+      result="correct" if "result" in opponentActual else "incorrect"
+      correctPredictions+=result=="correct"
+      totalPredictions+=1
+      updatePredictionsFrontend.append({"matchId": predictedMatch["matchId"], "result": result, "playerNumber": playerNumber, 'playerId': playerId})
+      break
+  predictionRate={"correctPredictions": correctPredictions, "totalPredictions": totalPredictions}
+  return {"predictionRate": predictionRate, "updatePredictionsFrontend": updatePredictionsFrontend}
+
+# Creates random predicted or actual results of a small draw, so the same players often appear in many matches of a round
+# Parameter generator: random.Random object
+# Parameter actual: boolean that tells if actual results are created
+# Returns list of results in the format of getStoredBracket or getBracketInfo
+def createRandomResults(generator, actual):
+  playerIds=[None, 0, 1, 2, 3, 4, 5] # None is a bye
+  results=[]
+  for matchId in range(generator.randrange(12)):
+    match={"roundNumber": generator.randint(1, 3), "matchId": matchId, "id1": generator.choice(playerIds), "id2": generator.choice(playerIds)}
+    if(actual):
+      walkover=generator.random()<0.2
+      (winnerScore, loserScore)=("W", "") if walkover else (636, 414)
+      winner=generator.choice([1, 2, None]) # None is a match without a winner
+      match["opponent1"]={"score": winnerScore if winner==1 else loserScore}
+      match["opponent2"]={"score": winnerScore if winner==2 else loserScore}
+      if(winner!=None):
+        match["opponent"+str(winner)]["result"]="win"
+    else:
+      match["opponent1"]=generator.choice([None, {}, {"score": 636, "result": generator.choice([None, "win", "loss"])}])
+      match["opponent2"]=generator.choice([None, {}, {"score": 414, "result": generator.choice([None, "win", "loss"])}])
+    results.append(match)
+  return results
+
+class PredictionRateTests(TestCase):
+  def test_indexed_scoring_matches_nested_loop(self):
+    generator=random.Random(2024)
+    for _ in range(2000):
+      actualResults=createRandomResults(generator, True)
+      predictedResultsList=[createRandomResults(generator, False) for _ in range(3)]
+      expected=[getPredictionRateNestedLoop(predictedResults, actualResults) for predictedResults in predictedResultsList]
+      self.assertEqual([getPredictionRate(predictedResults, actualResults) for predictedResults in predictedResultsList], expected)
+      self.assertEqual(getPredictionRates(predictedResultsList, actualResults), expected)
+
+# Creates a replacement for the request sent by urllib3, so downloads go through the pooled sessions and retries of tennis_fetch.py
+# without the network
+# Parameter responses: dictionary from URL path to list of (status, body, headers) tuples sent one after another for that path
+# Returns tuple of function used to patch HTTPConnectionPool._make_request and list of (path, headers, timeout) of every request sent
+def createUpstream(responses):
+  sentRequests=[]
+  def makeRequest(pool, connection, method, url, timeout=None, headers=None, **kwargs):
+    sentRequests.append((url, dict(headers), (timeout.connect_timeout, timeout.read_timeout)))
+    (status, body, responseHeaders)=responses[url].pop(0)
+    if(callable(body)): # body is created when the request is sent (ex. after a delay)
+      body=body()
+    return urllib3.HTTPResponse(body=io.BytesIO(body), status=status, headers=responseHeaders, preload_content=False, decode_content=False, request_method=method, request_url=url, retries=kwargs.get("retries"), connection=connection)
+  return (makeRequest, sentRequests)
+
+# Patches the network of tennis_fetch.py with createUpstream, new sessions are created so they use the patched backoff
+# Parameter responses: dictionary from URL path to list of (status, body, headers) tuples
+# Parameter cache: PageCache object used by fetchPage, None to download without the cache
+# Returns tuple of context manager of the patches and list of requests sent
+def patchUpstream(responses, cache):
+  (makeRequest, sentRequests)=createUpstream(responses)
+  patches=contextlib.ExitStack()
+  patches.enter_context(mock.patch.object(urllib3.connectionpool.HTTPConnectionPool, "_make_request", autospec=True, side_effect=makeRequest))
+  patches.enter_context(mock.patch("tennis_fetch.pageCache", cache))
+  patches.enter_context(mock.patch("tennis_fetch.BACKOFF_FACTOR", 0)) # retries are not waited for
+  patches.enter_context(mock.patch.dict(tennis_fetch.sessions, clear=True))
+  return (patches, sentRequests)
+
+class PageCacheTests(TestCase):
+  def setUp(self):
+    self.directory=tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+    self.path=os.path.join(self.directory.name, "cache.sqlite3")
+
+  # Creates a page cache stored in the temporary directory of the test, closed when the test ends
+  # Parameter maxBytes: size limit of cache
+  # Returns PageCache object
+  def createCache(self, maxBytes=CACHE_MAX_BYTES):
+    cache=PageCache(self.path, maxBytes)
+    self.addCleanup(lambda: cache.connection!=None and cache.connection.close())
+    return cache
+
+  def test_pages_stay_fresh_for_the_time_to_live_of_their_url(self):
+    tournamentUrl="https://www.tennisabstract.com/current/2024ATPTestOpen.html"
+    playerUrl="https://www.tennisabstract.com/cgi-bin/player.cgi?p=PlayerA"
+    self.assertEqual(getTimeToLive(tournamentUrl), 2*60)
+    self.assertEqual(getTimeToLive(playerUrl), 60*60)
+    self.assertEqual(getTimeToLive("https://www.minorleaguesplits.com/tennisabstract/cgi-bin/jsmatches/PlayerACareer.js"), 7*24*60*60)
+    self.assertEqual(getTimeToLive("https://www.tennisabstract.com/"), 30*60)
+    self.assertEqual(getTimeToLive("https://www.tennisabstract.com/reports/atpRankings.html"), DEFAULT_TTL)
+    cache=self.createCache()
+    with mock.patch("tennis_cache.time") as clock:
+      clock.time.return_value=1000
+      cache.store(tournamentUrl, b"draw", None, None)
+      cache.store(playerUrl, b"player", None, None)
+      clock.time.return_value=1000+3*60
+      self.assertFalse(cache.lookup(tournamentUrl).fresh)
+      self.assertTrue(cache.lookup(playerUrl).fresh)
+
+  def test_stale_page_is_refreshed_by_not_modified_response(self):
+    cache=self.createCache()
+    url="https://www.tennisabstract.com/current/2024ATPTestOpen.html"
+    cache.store(url, b"draw", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+    cache.getConnection().execute("UPDATE pages SET fetchedAt=fetchedAt-?", (getTimeToLive(url),)) # page is stale
+    (patches, sentRequests)=patchUpstream({"/current/2024ATPTestOpen.html": [(304, b"", {})]}, cache)
+    with patches:
+      self.assertEqual(tennis_fetch.fetchPage(url), b"draw")
+      self.assertEqual(tennis_fetch.fetchPage(url), b"draw") # page is fresh again so it is not requested
+    self.assertEqual(len(sentRequests), 1)
+    self.assertEqual(sentRequests[0][1]["If-None-Match"], '"v1"')
+    self.assertEqual(sentRequests[0][1]["If-Modified-Since"], "Mon, 01 Jan 2024 00:00:00 GMT")
+    self.assertTrue(cache.lookup(url).fresh)
+    self.assertEqual((cache.getStats()["revalidated"], cache.getStats()["hits"]), (1, 1))
+
+  def test_least_recently_used_pages_are_evicted_at_size_limit(self):
+    cache=self.createCache(maxBytes=10)
+    with mock.patch("tennis_cache.time") as clock:
+      for (accessedAt, url) in enumerate(["a", "b", "c"]):
+        clock.time.return_value=accessedAt
+        cache.store(url, b"1234", None, None)
+        if(url=="b"):
+          clock.time.return_value=accessedAt+0.5
+          cache.lookup("a") # a is used after b was stored
+    self.assertIsNone(cache.lookup("b"))
+    self.assertEqual((cache.lookup("a").content, cache.lookup("c").content), (b"1234", b"1234"))
+    self.assertEqual(cache.getStats()["evictions"], 1)
+    cache.store("d", b"12345678901", None, None) # page larger than the cache is not kept
+    self.assertEqual(cache.getConnection().execute("SELECT COUNT(*) FROM pages").fetchone()[0], 0)
+
+  def test_lease_of_stopped_process_is_taken_over(self):
+    (stoppedCache, cache)=(self.createCache(), self.createCache())
+    with mock.patch("tennis_cache.time") as clock:
+      clock.time.return_value=1000
+      stoppedOwner=stoppedCache.acquireLease("page")
+      clock.time.return_value=1000+LEASE_SECONDS-1
+      self.assertIsNone(cache.acquireLease("page"))
+      clock.time.return_value=1000+LEASE_SECONDS
+      owner=cache.acquireLease("page")
+      self.assertIsNotNone(owner)
+      stoppedCache.releaseLease("page", stoppedOwner) # stopped process can not release the lease it lost
+      self.assertIsNone(stoppedCache.acquireLease("page"))
+      cache.releaseLease("page", owner)
+      self.assertIsNotNone(stoppedCache.acquireLease("page"))
+
+class FetchTests(TestCase):
+  def test_server_errors_are_retried_with_timeouts(self):
+    responses={"/current/2024ATPTestOpen.html": [(503, b"", {}), (502, b"", {}), (200, b"draw", {})], "/missing.html": [(404, b"not found", {})]}
+    (patches, sentRequests)=patchUpstream(responses, None)
+    with patches:
+      self.assertEqual(tennis_fetch.fetchPage("https://www.tennisabstract.com/current/2024ATPTestOpen.html"), b"draw")
+      self.assertEqual(tennis_fetch.fetchPage("https://www.tennisabstract.com/missing.html"), b"not found") # client errors are not retried
+    self.assertEqual([url for (url, headers, timeout) in sentRequests], ["/current/2024ATPTestOpen.html"]*3+["/missing.html"])
+    self.assertEqual({timeout for (url, headers, timeout) in sentRequests}, {(tennis_fetch.CONNECT_TIMEOUT, tennis_fetch.READ_TIMEOUT)})
+    responses={"/current/2024ATPTestOpen.html": [(503, b"", {})]*(tennis_fetch.RETRIES+1)}
+    (patches, sentRequests)=patchUpstream(responses, None)
+    with patches:
+      self.assertEqual(tennis_fetch.fetchPage("https://www.tennisabstract.com/current/2024ATPTestOpen.html"), b"") # last error is returned
+    self.assertEqual(len(sentRequests), tennis_fetch.RETRIES+1)
+
+  def test_fetched_pages_keep_order_of_urls(self):
+    # Creates a page body that is sent later the earlier its URL is in the list, so downloads finish in reverse order
+    # Parameter position: position of URL in list
+    # Returns function that creates the body
+    def createSlowBody(position):
+      def createBody():
+        time.sleep(0.02*(4-position))
+        return f"page {position}".encode()
+      return createBody
+    responses={f"/page{position}.html": [(200, createSlowBody(position), {})] for position in range(5)}
+    (patches, sentRequests)=patchUpstream(responses, None)
+    with patches:
+      pages=tennis_fetch.fetchPages([f"https://www.tennisabstract.com/page{position}.html" for position in range(5)])
+    self.assertEqual(pages, [f"page {position}".encode() for position in range(5)])
+    self.assertEqual(len(sentRequests), 5)
+
+class PlayerIndexTests(TestCase):
+  def setUp(self):
+    playerNames=["(1) Novak Djokovic", "(Q) Stan Wawrinka", "(LL) Ga\u00ebl Monfils", "Qualifer Player 1", None, "Jan-Lennard Struff", "Qualifer Player 2", "(WC) Carlos Alcaraz"]
+    playerList=[]
+    for playerName in playerNames:
+      playerList.append(None if playerName==None else {"playerId": len([item for item in playerList if item!=None]), "playerName": playerName})
+    self.playerIndex=PlayerIndex(playerList) # bye at position 4, so ids after it are one less than their position
+
+  def test_names_are_found_regardless_of_seed_accents_and_case(self):
+    self.assertEqual(self.playerIndex.search("Novak Djokovic"), 0)
+    self.assertEqual(self.playerIndex.search("  novak   DJOKOVIC "), 0)
+    self.assertEqual(self.playerIndex.search("Stan Wawrinka"), 1) # qualifier marker is not part of the name
+    self.assertEqual(self.playerIndex.search("Gael Monfils"), 2) # lucky loser marker and accent
+    self.assertEqual(self.playerIndex.search("(LL) Ga\u00ebl Monfils"), 2)
+    self.assertEqual(self.playerIndex.search("Jan Lennard Struff"), 4)
+    self.assertEqual(self.playerIndex.search("Carlos Alcaraz"), 6)
+    self.assertEqual(self.playerIndex.search("Qualifier Name"), -1)
+
+  def test_qualifiers_take_the_spot_next_to_their_opponent(self):
+    self.assertEqual(self.playerIndex.searchQualifier("Arthur Fils", 2), 3)
+    self.assertEqual(self.playerIndex.search("arthur fils"), 3) # found by name in later rounds
+    self.assertEqual(self.playerIndex.searchQualifier("Other Player", 0), -1) # spot next to opponent is not a qualifier spot
+    self.assertEqual(self.playerIndex.searchQualifier("Other Player", 4), -1) # spot next to opponent is a bye
+    self.assertEqual(self.playerIndex.searchQualifier("Other Player", 99), -1)
+    self.assertEqual(self.playerIndex.searchMatch("Carlos Alcaraz", "Lucky Qualifier"), (6, 5))
+    self.assertEqual(self.playerIndex.searchMatch("Lucky Qualifier", "Jan Lennard Struff"), (5, 4)) # later round, found by name
+    self.assertEqual(self.playerIndex.unmatched, [])
+
+  def test_unmatched_names_are_collected_once(self):
+    with self.assertLogs("tennis_scraper", "WARNING") as logs:
+      self.assertEqual(self.playerIndex.searchMatch("Unknown One", "Unknown Two"), (-1, -1))
+      self.assertEqual(self.playerIndex.searchMatch("Novak Djokovic", "Unknown Two"), (0, -1))
+      self.assertEqual(self.playerIndex.searchMatch("Unknown One", "Stan Wawrinka"), (-1, 1))
+    self.assertEqual(self.playerIndex.unmatched, ["Unknown One", "Unknown Two"])
+    self.assertEqual(len(logs.records), 2)
+
+# home page of tennisabstract.com with links to current tournaments written in different ways, and links that are not tournaments
+HOME_PAGE=b"""<html><head><title>Tennis Abstract</title></head><body>
+<a href="http://www.tennisabstract.com/current/2024ATPTestOpen.html">Results and Forecasts</a>
+<A HREF='https://www.tennisabstract.com/current/2024WTATestCup.html' target="_blank">
+  Results and Forecasts
+</A>
+<a class="link" href=/current/2024WTAItalianOpen.html>Results and Forecasts</a>
+<a href="http://www.tennisabstract.com/current/2024ATPOtherOpen.html">Draw</a>
+<a href="http://www.tennisabstract.com/reports/atpRankings.html">Results and Forecasts</a>
+</body></html>"""
+
+# tournament page with scripts before, inside and after the head, the last script of the head has the bracket
+BRACKET_PAGE="""<!DOCTYPE html><HTML><HEAD><title>Tennis Abstract: 2024 Test Open Results &amp; Forecasts</title>
+<script src="jquery.js"></script>
+<SCRIPT type="text/javascript">var proj4 = '<table><tr><td><a href="p">Ga\u00ebl Monfils</a></td></tr></table>';
+var note = '<b>draw</b> of 2024';</SCRIPT>
+</HEAD><body><script>var other = 1;</script></body></HTML>"""
+
+class ExtractTests(TestCase):
+  def test_current_tournaments_are_found_on_home_page(self):
+    with mock.patch("tennis_scraper.fetchPage", return_value=HOME_PAGE):
+      tournaments=tennis_scraper.findAllTournaments()
+    self.assertEqual(tournaments, [
+      {"title": "2024 ATP Test Open", "url": "2024ATPTestOpen.html"},
+      {"title": "2024 WTA Test Cup", "url": "2024WTATestCup.html"},
+      {"title": "2024 WTA Italian Open", "url": "2024WTAItalianOpen.html"},
+    ])
+    homePageWithoutTournaments=b"<html><body><a href='/reports/atpRankings.html'>Rankings</a></body></html>"
+    with mock.patch("tennis_scraper.fetchPage", return_value=homePageWithoutTournaments), mock.patch("tennis_scraper.USE_BROWSER_FALLBACK", False):
+      self.assertEqual(tennis_scraper.findAllTournaments(), [])
+
+  def test_last_head_script_is_extracted_like_the_parsed_page(self):
+    for encoding in ("utf-8", "cp1252"): # pages that are not UTF-8 are decoded as Windows-1252
+      page=BRACKET_PAGE.encode(encoding)
+      soup=BeautifulSoup(page.decode(encoding), "html.parser")
+      self.assertEqual(findHeadScript(page), str(soup.head.find_all('script')[-1].contents[0]))
+      self.assertEqual(findTitle(page), soup.title.text)
+    self.assertEqual(findTitle(BRACKET_PAGE.encode()), "Tennis Abstract: 2024 Test Open Results & Forecasts")
+    self.assertEqual(findHeadScript(b"<html><head><script>var a = 1;</script></head></html>"), "var a = 1;") # single script
+    self.assertEqual(findHeadScript(b"<html><head><script>var a = '</head>'"), "var a = '</head>'") # unclosed script runs to end of page
+
+  def test_page_without_bracket_script_has_no_match(self):
+    self.assertIsNone(findHeadScript(b"<html><head><title>Tennis Abstract</title></head><body><script>var a = 1;</script></body></html>"))
+    self.assertIsNone(findHeadScript(b"<html><body><script>var a = 1;</script></body></html>")) # no head
+    self.assertIsNone(findHeadScript(b""))
+    self.assertIsNone(findTitle(b"<html><head></head></html>"))
+    self.assertIsNone(tennis_scraper.parseBracketRoster(b"<html><head><title>Tennis Abstract: 2024 Test Open Results and Forecasts</title></head></html>"))
+
+# Creates matches of a player in the format of tennisabstract.com match arrays
+# Parameter opponents: names of opponents, one match is played against each
+# Parameter startYear: year of first match
+# Returns array of matches
+def createPlayerMatches(opponents, startYear):
+  matches=[]
+  for (i, opponent) in enumerate(opponents):
+    score="W/O" if i%7==6 else "6-4 3-6 7-5"
+    matches.append([f"{startYear+i//12}{i%12+1:02d}{i%28+1:02d}", f"Tournament {i//4}", ["Hard", "Clay", "Grass"][i%3], "A", "L" if i%3==2 else "W", str(i+1), "", "", "R32", score, str(i*5+1), opponent, "", "", "", "", "", "", "", ""])
+  return matches
+
+# Creates a player page in the format of tennisabstract.com, ATP player pages also list the matches of the player
+# Parameter rank: current rank of player
+# Parameter matches: array of matches shown on page, None for a WTA player page
+# Returns raw bytes of player page
+def createPlayerPage(rank, matches):
+  script=f"var currentrank = {rank};\nvar peakrank = 1;"
+  if(matches!=None):
+    script+=f"\nvar matchmx = {json.dumps(matches)};\n\n\nvar fourspaces = '    ';"
+  return f'<html><head><title>Tennis Abstract: Test Player Match Results, Splits, and Analysis</title><script>{script}</script></head><body></body></html>'.encode()
+
+# pages of a tournament, two ATP players and two WTA players in the format of tennisabstract.com, other URLs are not found
+TOURNAMENT_URL="https://www.tennisabstract.com/current/2024ATPTestOpen.html"
+TOURNAMENT_PAGE=b"""<html><head><title>Tennis Abstract: 2024 Test Open Results and Forecasts</title><script>var proj4 = '<table><tr><td><a href="p">Player A</a></td><td><a href="p">Player B</a></td><td><a href="p">Player C</a></td><td><a href="p">Player D</a></td></tr></table>';
+var projCurrent = '';
+var completedSingles = 'R1: <a href="p">Player D</a> d. <a href="p">Player C</a> 7-6(5) 6-1<br/>R1: <a href="p">Player A</a> d. <a href="p">Player B</a> 6-3 6-4<br/>';
+var completedDoubles = '';</script></head></html>"""
+ATP_MATCHES=createPlayerMatches(["Player B", "Player E", "Player F", "Player B", "Player G"]*6, 2023)
+WTA_MATCHES=createPlayerMatches(["Player D", "Player G", "Player H"]*10, 2023)
+SITE_PAGES={
+  TOURNAMENT_URL: TOURNAMENT_PAGE,
+  tennis_scraper.ATP_PLAYER_URL.format(player="PlayerA"): createPlayerPage(4, ATP_MATCHES),
+  tennis_scraper.ATP_CAREER_URL.format(player="PlayerA"): createPlayerPage(4, createPlayerMatches(["Player B", "Player H", "Player E"]*30, 2010)),
+  tennis_scraper.ATP_PLAYER_URL.format(player="PlayerB"): createPlayerPage(9, []),
+  tennis_scraper.WTA_PLAYER_URL.format(player="PlayerC"): createPlayerPage(7, None),
+  tennis_scraper.WTA_RECENT_MATCHES_URL.format(player="PlayerC"): ('var matchmx = '+json.dumps(WTA_MATCHES)+' ]];').encode(),
+  tennis_scraper.WTA_CAREER_MATCHES_URL.format(player="PlayerC"): ('var morematchmx = '+json.dumps(createPlayerMatches(["Player D", "Player I"]*40, 2012))+';').encode(),
+  tennis_scraper.WTA_PLAYER_URL.format(player="PlayerD"): createPlayerPage(12, None),
+}
+
+class AsyncScraperTests(IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.directory=self.enterContext(tempfile.TemporaryDirectory())
+    self.cache=PageCache(os.path.join(self.directory, "cache.sqlite3"))
+    self.addCleanup(lambda: self.cache.connection!=None and self.cache.connection.close())
+    self.enterContext(mock.patch.object(tennis_scraper_async, "pageCache", self.cache))
+    # sync scraper gets the same pages without the cache
+    self.enterContext(mock.patch.object(tennis_scraper, "fetchPage", lambda url: SITE_PAGES.get(url, b"")))
+    self.enterContext(mock.patch.object(tennis_scraper, "fetchPages", lambda urls: [SITE_PAGES.get(url, b"") for url in urls]))
+    self.requestedUrls=[]
+    self.responseDelay=0
+    self.matchStores=0
+    client=httpx.AsyncClient(transport=httpx.MockTransport(self.respond), headers=tennis_fetch.HEADERS)
+    tennis_scraper_async.clients[asyncio.get_running_loop()]=client
+    self.addAsyncCleanup(client.aclose)
+    self.useNewMatchStore()
+
+  # Answers a request of the async scraper with a page of SITE_PAGES, pages that have not changed are answered with 304
+  # Parameter request: httpx Request object
+  # Returns httpx Response object
+  async def respond(self, request):
+    url=str(request.url)
+    self.requestedUrls.append(url)
+    await asyncio.sleep(self.responseDelay)
+    if(url not in SITE_PAGES):
+      return httpx.Response(404, content=b"")
+    etag='"'+hashlib.sha1(SITE_PAGES[url]).hexdigest()+'"'
+    if(request.headers.get("If-None-Match")==etag):
+      return httpx.Response(304)
+    return httpx.Response(200, content=SITE_PAGES[url], headers={"ETag": etag})
+
+  # Stores matches and rankings in a new empty match store, so sync and async scrapers both start without stored matches
+  # Returns void
+  def useNewMatchStore(self):
+    self.matchStores+=1
+    store=MatchStore(os.path.join(self.directory, f"matches{self.matchStores}.sqlite3"))
+    self.addCleanup(lambda: store.connection!=None and store.connection.close())
+    self.enterContext(mock.patch.object(tennis_scraper, "matchStore", store))
+    self.enterContext(mock.patch.object(tennis_scraper_async, "matchStore", store))
+    self.enterContext(mock.patch.object(tennis_scraper, "rankingsIndex", {"players": None, "loadedAt": 0, "refreshing": False}))
+
+  async def test_async_results_match_sync_results(self):
+    opponent=ATP_MATCHES[0][11]
+    calls=[
+      ("getBracketInfo", (TOURNAMENT_URL,)),
+      ("getH2H", ("PlayerA", opponent, opponent.replace(" ", ""))),
+      ("getH2H", ("PlayerC", WTA_MATCHES[0][11], WTA_MATCHES[0][11].replace(" ", ""))),
+      ("getPlayerProfiles", ("PlayerA", "Player B", "PlayerB")),
+      ("getPlayerProfiles", ("PlayerC", "Player D", "PlayerD")),
+      ("getPlayerRank", ("PlayerA",)),
+      ("getPlayerRank", ("PlayerC",)),
+    ]
+    for (name, args) in calls:
+      self.useNewMatchStore()
+      expected=await asyncio.to_thread(getattr(tennis_scraper, name), *args)
+      self.useNewMatchStore()
+      self.assertEqual(await getattr(tennis_scraper_async, name)(*args), expected, name)
+    profiles=await tennis_scraper_async.getPlayerProfiles("PlayerA", "Player B", "PlayerB")
+    self.assertEqual((profiles["playerRank"], profiles["opponentRank"], profiles["tourType"]), (4, 9, "ATP"))
+    (h2hData, tour)=await tennis_scraper_async.getH2H("PlayerA", opponent, opponent.replace(" ", ""))
+    self.assertEqual(tour, "ATP")
+    self.assertGreater(h2hData["wins"]+h2hData["losses"], 0)
+    self.assertEqual(await tennis_scraper_async.getPlayerRank("PlayerC"), 7)
+    found=[url for url in self.requestedUrls if url in SITE_PAGES]
+    self.assertEqual(len(found), len(set(found))) # every page is downloaded once and then served from the page cache
+
+  async def test_concurrent_calls_share_downloads(self):
+    self.responseDelay=0.05 # other calls arrive while the first download is in progress
+    parsed=[]
+    # Parses the tournament page and records that it was parsed
+    def parseBracketPage(page, url):
+      parsed.append(url)
+      return tennis_scraper.parseBracketPage(page, url)
+    playerUrl=tennis_scraper.ATP_PLAYER_URL.format(player="PlayerA")
+    with mock.patch.object(tennis_scraper_async, "parseBracketPage", parseBracketPage):
+      results=await asyncio.gather(*[tennis_scraper_async.getBracketInfo(TOURNAMENT_URL) for _ in range(5)], *[tennis_scraper_async.fetchPage(playerUrl) for _ in range(5)])
+    self.assertEqual(results[:5], [tennis_scraper.parseBracketPage(SITE_PAGES[TOURNAMENT_URL], TOURNAMENT_URL)]*5)
+    self.assertEqual(results[5:], [SITE_PAGES[playerUrl]]*5)
+    self.assertEqual(sorted(self.requestedUrls), sorted([TOURNAMENT_URL, playerUrl]))
+    self.assertEqual(parsed, [TOURNAMENT_URL])
+
+  async def test_pages_are_cached_and_revalidated(self):
+    await tennis_scraper_async.fetchPage(TOURNAMENT_URL)
+    self.assertEqual(await tennis_scraper_async.fetchPage(TOURNAMENT_URL), SITE_PAGES[TOURNAMENT_URL])
+    self.assertEqual(self.requestedUrls, [TOURNAMENT_URL]) # fresh page is not requested again
+    self.cache.getConnection().execute("UPDATE pages SET fetchedAt=fetchedAt-?", (getTimeToLive(TOURNAMENT_URL),))
+    self.assertEqual(await tennis_scraper_async.fetchPage(TOURNAMENT_URL), SITE_PAGES[TOURNAMENT_URL])
+    self.assertEqual(self.requestedUrls, [TOURNAMENT_URL]*2)
+    self.assertEqual(self.cache.getStats()["revalidated"], 1) # stale page was answered with 304
+    self.assertTrue(self.cache.lookup(TOURNAMENT_URL).fresh)
+
+  async def test_page_downloaded_by_lease_holder_is_used(self):
+    otherProcessCache=PageCache(self.cache.path)
+    self.addCleanup(lambda: otherProcessCache.connection.close())
+    url=tennis_scraper.ATP_PLAYER_URL.format(player="PlayerA")
+    owner=otherProcessCache.acquireLease(url)
+    download=asyncio.ensure_future(tennis_scraper_async.fetchPage(url))
+    await asyncio.sleep(0.1)
+    self.assertFalse(download.done()) # waits for the lease instead of downloading the page
+    otherProcessCache.store(url, b"page stored by other process", None, None)
+    otherProcessCache.releaseLease(url, owner)
+    self.assertEqual(await download, b"page stored by other process")
+    self.assertEqual(self.requestedUrls, [])
+
+class MetricsTests(TestCase):
+  def test_timed_returns_function_unchanged_when_metrics_are_off(self):
+    def work():
+      return 1
+    async def asyncWork():
+      return 1
+    with mock.patch.object(tennis_metrics, "METRICS_ENABLED", False):
+      self.assertIs(timed("work")(work), work)
+      self.assertIs(timed("work", countQueries=True)(asyncWork), asyncWork)
+      self.assertIs(bindContext(work), work)
+    with mock.patch.object(tennis_metrics, "METRICS_ENABLED", True):
+      self.assertIsNot(timed("work")(work), work)
+      self.assertEqual(asyncio.run(timed("work")(asyncWork)()), 1)
+
+  def test_middleware_is_removed_when_metrics_are_off(self):
+    with mock.patch.object(tennis_middleware, "METRICS_ENABLED", False):
+      with self.assertRaises(MiddlewareNotUsed):
+        MetricsMiddleware(lambda request: HttpResponse())
+      response=Client().get("/metrics")
+    self.assertNotIn("Server-Timing", response)
+
+  def test_server_timing_is_sent_when_metrics_are_on(self):
+    registry=MetricsRegistry()
+    with mock.patch.object(tennis_metrics, "METRICS_ENABLED", True), mock.patch.object(tennis_middleware, "METRICS_ENABLED", True), \
+        mock.patch.object(tennis_metrics, "metrics", registry), mock.patch("tennis_bracket.views.METRICS_ENABLED", True):
+      # Gets a stored tournament, timed as a stage of the request
+      @timed("snapshot", countQueries=True)
+      def loadSnapshot(request):
+        getTournamentSnapshot("2024ATPTestOpen")
+        return HttpResponse()
+      async def loadSnapshotAsync(request):
+        return await sync_to_async(loadSnapshot)(request)
+      request=RequestFactory().get("/bracket", HTTP_ORIGIN="http://localhost:4200")
+      response=MetricsMiddleware(loadSnapshot)(request)
+      asyncResponse=asyncio.run(MetricsMiddleware(loadSnapshotAsync)(request))
+      # whole stack, the metrics view was not timed when it was imported with metrics off
+      clientResponse=Client().get("/metrics")
+    for serverTiming in (response["Server-Timing"], asyncResponse["Server-Timing"]):
+      self.assertRegex(serverTiming, r'^snapshot;dur=[0-9.]+;desc="1 calls", total;dur=[0-9.]+$')
+    self.assertEqual(response["Timing-Allow-Origin"], "http://localhost:4200")
+    self.assertRegex(clientResponse["Server-Timing"], r"total;dur=[0-9.]+$")
+    collected=registry.getMetrics()
+    self.assertEqual(collected["counters"]["requests"], 3)
+    self.assertEqual(collected["counters"]["queries"], 2)
+    self.assertEqual(collected["histograms"]["stage.snapshot"]["count"], 2)
+    self.assertEqual(collected["histograms"]["request./bracket"]["count"], 2)
+    self.assertEqual(collected["histograms"]["request./metrics"]["count"], 1)
@@ -1,64 +1,166 @@
-import json
-from rest_framework.views import APIView
+from adrf.views import APIView
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse, Http404
-from django.shortcuts import render
-from tennis_scraper import getAllTournaments, getBracketInfo, getH2H, getPlayerRank, parsedTitle
+from rest_framework.exceptions import ParseError
+from tennis_scraper import getAllTournaments, parsedTitle
+from tennis_scraper_async import getPlayerProfiles
+from tennis_matchups import getCachedMatchups, getDrawMatchups
+from tennis_ratings import getWinProbability
+from tennis_simulation import MAX_SIMULATIONS, SIMULATIONS, getCachedSimulation, getTournamentSimulation
+from tennis_metrics import METRICS_ENABLED, metrics
+from tennis_cache import pageCache
 from tennis_bracket.serializers import BracketSerializer
-from tennis_bracket.models import BracketData
-from tennis_bracket.backend_functions import getStoredBracket, getPredictionRate
+from tennis_bracket.backend_functions import getBracketStateVersion, getPredictedBracket, getTournamentSnapshot, queueTournament
+from tennis_bracket.leaderboard import getLeaderboard
+from tennis_bracket.responses import addScrapedAt, encodeLine, getETag, isNotModified, jsonResponse, notModifiedResponse, queuedResponse, streamResponse
+
+QUEUED_RETRY_AFTER=2 # seconds before the frontend asks again for a tournament queued for the prefetch_tournaments command
+
+# Reads an integer query parameter, kept between 1 and a maximum
+# Parameter request: HttpRequest object
+# Parameter name: name of query parameter
+# Parameter default: value used if the query parameter is not given
+# Parameter maximum: largest value allowed
+# Returns integer, ParseError (400 response) is raised if the query parameter is not an integer
+def getIntegerParameter(request, name, default, maximum):
+  value=request.GET.get(name, default)
+  try:
+    value=int(value)
+  except (TypeError, ValueError):
+    raise ParseError(f"{name} must be an integer")
+  return min(max(value, 1), maximum)
 
 # Create your views here.
+# Views are async so waiting for tennisabstract.com does not block a worker, database work runs with sync_to_async
 class BracketInformation(APIView):
-  # Send all matches results of bracket to frontend
-  def get(self, request):
+  # Send all matches results of bracket to frontend, with stream=ndjson the bracket is sent in parts (see createBracketLines)
+  async def get(self, request):
     tournament=request.GET['tournament']
     type=request.GET['type']
+    stream=request.GET.get('stream')
+    owner=request.GET.get('owner', "") # user who created the bracket that is sent with type=predict
     parsedTournament=parsedTitle(tournament)
-    # get bracket data from web scraping
-    bracketData=getBracketInfo(f"https://www.tennisabstract.com/current/{tournament}.html")
-    if(bracketData==None):
-      raise Http404
+    # ETag comes from the versions of the stored tournament and bracket, so an unchanged bracket is answered before it is loaded
+    snapshotState=await sync_to_async(getBracketStateVersion)(tournament, parsedTournament, type=="predict", owner)
+    if(snapshotState==None): # tournament is scraped by the prefetch_tournaments command, never while the client waits
+      if(not await sync_to_async(queueTournament)(tournament)):
+        raise Http404
+      return queuedResponse(QUEUED_RETRY_AFTER)
+    (stateVersion, scrapedAt, outdated)=snapshotState
+    # the prefetch_tournaments command has not scraped the tournament for too long, it is queued again and the stored bracket is sent
+    if(outdated):
+      await sync_to_async(queueTournament)(tournament)
+    etag=getETag("bracket", tournament, type, owner, stream, stateVersion)
+    if(isNotModified(request, etag)):
+      return addScrapedAt(notModifiedResponse(etag), scrapedAt)
+    bracketData=await sync_to_async(getTournamentSnapshot)(tournament)
+    if(stream=="ndjson"):
+      return addScrapedAt(streamResponse(self.createBracketLines(type, owner, parsedTournament, bracketData), etag), scrapedAt)
     title=bracketData[0]
     roster=bracketData[1]
     results=bracketData[2]
     if(type=="predict"):
-      bracketSet=BracketData.objects.filter(title=parsedTournament)
-      if(bracketSet):
-        # get most updated bracket of tournament
-        bracket=bracketSet.last()
-        # get user created bracket data from database
-        data=getStoredBracket(bracket, parsedTournament)
-        # get user prediction rate for tournament
-        predictionRateData=getPredictionRate(data["results"], results)
-        data.update(predictionRateData)
-        # update players in "Qualifier Player" spots on bracket if necessary
-        data.update({"roster": roster})
-        return HttpResponse(json.dumps(data))
+      # get user created bracket data from database with user prediction rate for tournament
+      data=await sync_to_async(getPredictedBracket)(parsedTournament, roster, results, owner)
+      if(data!=None):
+        return addScrapedAt(jsonResponse(request, data, etag), scrapedAt)
     data={"title": title, "roster": roster, "results": results, "method": "webscrape", "predictionRate": None, "updatePredictionsFrontend": None}
-    return HttpResponse(json.dumps(data))
+    return addScrapedAt(jsonResponse(request, data, etag), scrapedAt)
   
+  # Creates the lines of a bracket sent as newline delimited JSON (stream=ndjson) from the stored tournament, so the frontend can
+  # show the roster and each completed match before the user created bracket is loaded and scored
+  # Lines are {"event": "roster", "title", "roster"}, then {"event": "match", "match"} for each completed match, each sent on its own,
+  # then {"event": "complete"} with the other fields of the non-streamed response (predicted "results" if there is a user created bracket)
+  # Parameter type: "predict" to also send the user created bracket
+  # Parameter owner: name of user who created the bracket
+  # Parameter parsedTournament: parsed version of tournament title
+  # Parameter bracketData: tuple of tournament title, list of players, and list of match results
+  # Returns async generator of lines
+  async def createBracketLines(self, type, owner, parsedTournament, bracketData):
+    (title, roster, results)=bracketData
+    yield encodeLine({"event": "roster", "title": title, "roster": roster})
+    for match in results:
+      yield encodeLine({"event": "match", "match": match})
+    data=None
+    if(type=="predict"):
+      data=await sync_to_async(getPredictedBracket)(parsedTournament, roster, results, owner)
+    if(data==None):
+      data={"method": "webscrape", "predictionRate": None, "updatePredictionsFrontend": None}
+    yield encodeLine({"event": "complete", **{key: value for (key, value) in data.items() if key not in ("title", "roster")}})
+
   # Save information from user created bracket
-  def post(self, request):
+  async def post(self, request):
     serializer=BracketSerializer(data=request.data)
     if serializer.is_valid(raise_exception=True):
-      serializer.save()
+      await sync_to_async(serializer.save)()
     return HttpResponse()
   
+class MatchupData(APIView):
+  # Send current ranks of all players in tournament and head to head records of players that can meet in the bracket
+  async def get(self, request):
+    tournament=request.GET['tournament']
+    # draw is the tournament stored by the prefetch_tournaments command, it is only loaded if its matchups are not cached
+    snapshotState=await sync_to_async(getBracketStateVersion)(tournament, parsedTitle(tournament), False)
+    if(snapshotState==None):
+      raise Http404
+    stateVersion=snapshotState[0]
+    data=getCachedMatchups(tournament, stateVersion)
+    if(data==None):
+      bracketData=await sync_to_async(getTournamentSnapshot)(tournament)
+      # player pages are downloaded in a thread of its own so other requests are not held
+      data=await sync_to_async(getDrawMatchups, thread_sensitive=False)(tournament, stateVersion, bracketData)
+    return jsonResponse(request, data)
+
+class LeaderboardData(APIView):
+  # Send best scored user created brackets of a tournament, or of every tournament if no tournament is given
+  async def get(self, request):
+    tournament=request.GET.get('tournament')
+    title=None if tournament==None else parsedTitle(tournament)
+    limit=getIntegerParameter(request, 'limit', 100, 1000)
+    leaderboard=await sync_to_async(getLeaderboard)(title, limit)
+    return jsonResponse(request, {"title": title, "leaderboard": leaderboard})
+
+class SimulationData(APIView):
+  # Send probability of every player in tournament reaching each round, from simulated completions of the draw
+  async def get(self, request):
+    tournament=request.GET['tournament']
+    simulations=getIntegerParameter(request, 'simulations', SIMULATIONS, MAX_SIMULATIONS)
+    # draw is the tournament stored by the prefetch_tournaments command, it is only loaded if its simulation is not cached
+    snapshotState=await sync_to_async(getBracketStateVersion)(tournament, parsedTitle(tournament), False)
+    if(snapshotState==None):
+      raise Http404
+    stateVersion=snapshotState[0]
+    data=getCachedSimulation(tournament, stateVersion, simulations)
+    if(data==None):
+      bracketData=await sync_to_async(getTournamentSnapshot)(tournament)
+      # simulations run in a thread of their own so other requests are not held
+      data=await sync_to_async(getTournamentSimulation, thread_sensitive=False)(tournament, stateVersion, bracketData, simulations)
+    return jsonResponse(request, data)
+
 class TournamentsData(APIView):
   # Send all tournaments that can be viewed by user from tennisabstract.com
-  def get(self, request):
-    allTournaments=getAllTournaments()
+  async def get(self, request):
+    allTournaments=await sync_to_async(getAllTournaments, thread_sensitive=False)()
     data={"tournaments": allTournaments}
-    return HttpResponse(json.dumps(data))
+    return jsonResponse(request, data)
   
 class PlayerData(APIView):
   # Send match information, wihch includes current ranks of both players and head to head record
-  def get(self, request):
+  async def get(self, request):
     player=request.GET['player']
     opponent=request.GET['opponent']
     opponentParsed=request.GET['opponentParsed']
-    (h2hData, tourType)=getH2H(player, opponent, opponentParsed)
-    playerRank=getPlayerRank(player)
-    opponentRank=getPlayerRank(opponentParsed)
-    playerData={"h2hData": h2hData, "playerRank": playerRank, "opponentRank": opponentRank, "tourType": tourType}
-    return HttpResponse(json.dumps(playerData))
\ No newline at end of file
+    playerData=await getPlayerProfiles(player, opponent, opponentParsed)
+    # Elo win probability of player from ratings stored by the update_ratings command, None if a player is not rated
+    playerData["winProbability"]=await sync_to_async(getWinProbability)(player, opponentParsed)
+    return jsonResponse(request, playerData)
+
+class MetricsData(APIView):
+  # Send timing histograms and counters of all requests, only available if metrics are on in config.ini
+  async def get(self, request):
+    if(not METRICS_ENABLED):
+      raise Http404
+    data=metrics.getMetrics()
+    if(pageCache!=None):
+      data["pageCache"]=pageCache.getStats()
+    return jsonResponse(request, data)
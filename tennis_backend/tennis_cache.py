@@ -0,0 +1,155 @@
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from configparser import ConfigParser
+from pathlib import Path
+
+BASE_DIR=Path(__file__).resolve().parent
+
+# optional [Scraper] section of config.ini (see config.ini.example), defaults are used if missing
+CONFIG=ConfigParser()
+CONFIG.read(BASE_DIR / "config.ini")
+
+CACHE_ENABLED=CONFIG.getboolean("Scraper", "Cache_Enabled", fallback=True)
+CACHE_PATH=CONFIG.get("Scraper", "Cache_Path", fallback=str(BASE_DIR / "page_cache.sqlite3"))
+CACHE_MAX_BYTES=CONFIG.getint("Scraper", "Cache_Max_MB", fallback=256)*1024*1024
+
+# seconds a page is served from the cache without asking the upstream site, first matching pattern wins
+TTL_RULES=[
+  (re.compile(r"Career\.js$"), 7*24*60*60), # older career matches rarely change
+  (re.compile(r"/jsmatches/[^/]+\.js$"), 6*60*60), # recent matches of a player
+  (re.compile(r"/current/[^/]+\.html$"), 2*60), # tournament draws change when a match finishes
+  (re.compile(r"/cgi-bin/w?player(-classic)?\.cgi"), 60*60), # player pages (ranks and match history)
+  (re.compile(r"^https?://(www\.)?tennisabstract\.com/?$"), 30*60), # home page that lists current tournaments
+]
+DEFAULT_TTL=10*60
+# longest time a process holds the lease to download a page, a lease of a process that stopped expires after this
+LEASE_SECONDS=(CONFIG.getfloat("Scraper", "Connect_Timeout", fallback=3.05)+CONFIG.getfloat("Scraper", "Read_Timeout", fallback=15))*(CONFIG.getint("Scraper", "Retries", fallback=3)+1)
+LEASE_POLL_INTERVAL=0.05 # seconds between checks for a lease held by another process
+
+# Gets the amount of seconds a page can be served from the cache before it is revalidated
+# Parameter url: URL of page
+# Returns time to live of page in seconds
+def getTimeToLive(url):
+  for (pattern, ttl) in TTL_RULES:
+    if(pattern.search(url)):
+      return ttl
+  return DEFAULT_TTL
+
+# represents a page stored in the cache
+class CachedPage:
+  def __init__(self, content, etag, lastModified, fresh, fetchedAt):
+    self.content=content
+    self.etag=etag
+    self.lastModified=lastModified
+    self.fresh=fresh
+    self.fetchedAt=fetchedAt # time the page was downloaded or last revalidated
+
+# on-disk cache of downloaded pages keyed by URL, least recently used pages are evicted once the cache is full
+# The cache is shared by every worker process, so it also holds leases that let one process download a page while others wait for it
+class PageCache:
+  def __init__(self, path=CACHE_PATH, maxBytes=CACHE_MAX_BYTES):
+    self.path=path
+    self.maxBytes=maxBytes
+    self.connection=None
+    self.lock=threading.Lock()
+    self.stats={"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+
+  # Opens the SQLite database on first use
+  # Returns sqlite3 Connection object
+  def getConnection(self):
+    if(self.connection==None):
+      self.connection=sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content BLOB, etag TEXT, lastModified TEXT, fetchedAt REAL, accessedAt REAL, size INTEGER)")
+      self.connection.execute("CREATE INDEX IF NOT EXISTS pages_accessedAt ON pages (accessedAt)")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS leases (url TEXT PRIMARY KEY, owner TEXT, expiresAt REAL)")
+    return self.connection
+
+  # Gets a page from the cache
+  # Parameter url: URL of page
+  # Returns CachedPage object or None if the page is not in the cache
+  def lookup(self, url):
+    now=time.time()
+    with self.lock:
+      connection=self.getConnection()
+      row=connection.execute("SELECT content, etag, lastModified, fetchedAt FROM pages WHERE url=?", (url,)).fetchone()
+      if(row==None):
+        return None
+      connection.execute("UPDATE pages SET accessedAt=? WHERE url=?", (now, url))
+    (content, etag, lastModified, fetchedAt)=row
+    return CachedPage(content, etag, lastModified, now-fetchedAt<getTimeToLive(url), fetchedAt)
+
+  # Stores a downloaded page in the cache and evicts old pages if the cache is full
+  # Parameter url: URL of page
+  # Parameter content: raw bytes of page
+  # Parameter etag: ETag header sent with the page, can be None
+  # Parameter lastModified: Last-Modified header sent with the page, can be None
+  # Returns void
+  def store(self, url, content, etag, lastModified):
+    now=time.time()
+    with self.lock:
+      connection=self.getConnection()
+      connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)", (url, content, etag, lastModified, now, now, len(content)))
+      self.evict(connection)
+
+  # Marks a cached page as fresh again after the upstream site confirmed it has not changed
+  # Parameter url: URL of page
+  # Returns void
+  def refresh(self, url):
+    with self.lock:
+      self.getConnection().execute("UPDATE pages SET fetchedAt=? WHERE url=?", (time.time(), url))
+
+  # Takes the lease to download a page if no other process holds it
+  # Parameter url: URL of page
+  # Returns owner string of lease used to release it, or None if another process is downloading the page
+  def acquireLease(self, url):
+    now=time.time()
+    owner=uuid.uuid4().hex
+    with self.lock:
+      connection=self.getConnection()
+      connection.execute("DELETE FROM leases WHERE url=? AND expiresAt<=?", (url, now))
+      if(connection.execute("INSERT OR IGNORE INTO leases VALUES (?, ?, ?)", (url, owner, now+LEASE_SECONDS)).rowcount==0):
+        return None
+    return owner
+
+  # Releases the lease to download a page once the page is stored
+  # Parameter url: URL of page
+  # Parameter owner: owner string from acquireLease
+  # Returns void
+  def releaseLease(self, url, owner):
+    with self.lock:
+      self.getConnection().execute("DELETE FROM leases WHERE url=? AND owner=?", (url, owner))
+
+  # Deletes least recently used pages until the cache is within its size limit, caller holds the lock
+  # Parameter connection: sqlite3 Connection object
+  # Returns void
+  def evict(self, connection):
+    totalSize=connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+    if(totalSize<=self.maxBytes):
+      return
+    evictedUrls=[]
+    for (url, size) in connection.execute("SELECT url, size FROM pages ORDER BY accessedAt"):
+      if(totalSize<=self.maxBytes):
+        break
+      evictedUrls.append((url,))
+      totalSize-=size
+    connection.executemany("DELETE FROM pages WHERE url=?", evictedUrls)
+    self.stats["evictions"]+=len(evictedUrls)
+
+  # Adds one to a hit/miss counter
+  # Parameter name: name of counter
+  # Returns void
+  def count(self, name):
+    with self.lock:
+      self.stats[name]+=1
+
+  # Gets the hit/miss counters of the cache
+  # Returns dictionary of counters
+  def getStats(self):
+    with self.lock:
+      return dict(self.stats)
+
+pageCache=PageCache() if CACHE_ENABLED else None
@@ -0,0 +1,51 @@
+import html
+import re
+
+# patterns are matched on raw page bytes so only the parts of a page that are needed get decoded
+HEAD_START_PATTERN=re.compile(rb'<head[\s>]', re.IGNORECASE)
+HEAD_END_PATTERN=re.compile(rb'</head\s*>|<body[\s>]', re.IGNORECASE)
+SCRIPT_START_PATTERN=re.compile(rb'<script\b[^>]*>', re.IGNORECASE)
+SCRIPT_END_PATTERN=re.compile(rb'</script\s*>', re.IGNORECASE)
+TITLE_PATTERN=re.compile(rb'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+
+# Decodes part of a downloaded page into a string
+# Parameter content: raw bytes of page (or part of page)
+# Returns decoded string, pages that are not UTF-8 are decoded as Windows-1252
+def decodePage(content):
+  try:
+    return content.decode('utf-8')
+  except UnicodeDecodeError:
+    return content.decode('cp1252', errors='replace')
+
+# Finds the contents of the last script tag in the head of a page without parsing the whole page
+# Parameter content: raw bytes of page
+# Returns decoded contents of the script tag or None if the page has no head or no script in its head
+def findHeadScript(content):
+  headStart=HEAD_START_PATTERN.search(content)
+  if(headStart==None):
+    return None
+  index=headStart.end()
+  lastScript=None
+  while(True):
+    scriptStart=SCRIPT_START_PATTERN.search(content, index)
+    headEnd=HEAD_END_PATTERN.search(content, index)
+    if(scriptStart==None or (headEnd!=None and headEnd.start()<scriptStart.start())):
+      break
+    scriptEnd=SCRIPT_END_PATTERN.search(content, scriptStart.end())
+    if(scriptEnd==None): # unclosed script tag runs until end of page
+      lastScript=content[scriptStart.end():]
+      break
+    lastScript=content[scriptStart.end():scriptEnd.start()]
+    index=scriptEnd.end() # skip script contents so nothing inside it is mistaken for a tag
+  if(lastScript==None):
+    return None
+  return decodePage(lastScript)
+
+# Finds the title of a page without parsing the whole page
+# Parameter content: raw bytes of page
+# Returns decoded title of page or None if the page has no title
+def findTitle(content):
+  title=TITLE_PATTERN.search(content)
+  if(title==None):
+    return None
+  return html.unescape(decodePage(title.group(1)))
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from pathlib import Path
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tennis_cache import LEASE_POLL_INTERVAL, pageCache
+from tennis_metrics import METRICS_ENABLED, bindContext, count, timed
+from tennis_singleflight import SingleFlight
+
+# optional [Scraper] section of config.ini (see config.ini.example), defaults are used if missing
+CONFIG=ConfigParser()
+CONFIG.read(Path(__file__).resolve().parent / "config.ini")
+
+HEADERS={'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+CONNECT_TIMEOUT=CONFIG.getfloat("Scraper", "Connect_Timeout", fallback=3.05)
+READ_TIMEOUT=CONFIG.getfloat("Scraper", "Read_Timeout", fallback=15)
+RETRIES=CONFIG.getint("Scraper", "Retries", fallback=3)
+BACKOFF_FACTOR=CONFIG.getfloat("Scraper", "Backoff_Factor", fallback=0.5)
+POOL_SIZE=CONFIG.getint("Scraper", "Pool_Size", fallback=10)
+MAX_WORKERS=CONFIG.getint("Scraper", "Max_Workers", fallback=8)
+RETRY_STATUSES=(429, 500, 502, 503, 504)
+
+sessions={} # one pooled session per host, reused across requests
+sessionsLock=threading.Lock()
+executor=None
+executorLock=threading.Lock()
+pageFlights=SingleFlight() # threads downloading the same page wait for one download
+
+# Creates a session that keeps connections to one host alive and retries failed requests with backoff
+# Returns requests Session object
+def createSession():
+  retry=Retry(total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(['GET']), raise_on_status=False)
+  adapter=HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+  session=requests.Session()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  session.headers.update(HEADERS)
+  return session
+
+# Gets the pooled session for the host of a URL, creating it on first use
+# Parameter url: URL that will be requested
+# Returns requests Session object for the host of the URL
+def getSession(url):
+  host=urlsplit(url).netloc
+  with sessionsLock:
+    session=sessions.get(host)
+    if(session==None):
+      session=createSession()
+      sessions[host]=session
+  return session
+
+# Gets the thread pool used to fetch several URLs at once, creating it on first use
+# Returns ThreadPoolExecutor object
+def getExecutor():
+  global executor
+  with executorLock:
+    if(executor==None):
+      executor=ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tennis-fetch")
+  return executor
+
+# Downloads the page at the URL using the pooled session of its host
+# Fresh pages in the page cache skip the network, stale pages are revalidated with a conditional GET
+# Threads and processes asking for a page that is already being downloaded wait for that download instead of sending another request
+# Parameter url: URL of page to download
+# Parameter revalidate: if true, a fresh cached page is also revalidated (used by the prefetch worker to see new results right away)
+# Returns raw bytes of the page
+@timed("fetch")
+def fetchPage(url, revalidate=False):
+  return pageFlights.do((url, revalidate), downloadPage, url, revalidate)
+
+# Downloads the page at the URL, called by one thread at a time for each URL (see fetchPage)
+# Parameter url: URL of page to download
+# Parameter revalidate: if true, a fresh cached page is also revalidated
+# Returns raw bytes of the page
+def downloadPage(url, revalidate):
+  if(pageCache==None):
+    page=getSession(url).get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    if(METRICS_ENABLED):
+      countUpstream(page)
+    return page.content
+  cachedPage=pageCache.lookup(url)
+  if(cachedPage!=None and cachedPage.fresh and not revalidate):
+    pageCache.count("hits")
+    count("cacheHits")
+    return cachedPage.content
+  owner=pageCache.acquireLease(url)
+  if(owner==None): # another process is downloading the page
+    while(owner==None):
+      time.sleep(LEASE_POLL_INTERVAL)
+      owner=pageCache.acquireLease(url)
+    latestPage=pageCache.lookup(url)
+    if(isDownloadedSince(latestPage, cachedPage)):
+      pageCache.releaseLease(url, owner)
+      count("coalesced")
+      return latestPage.content
+  try:
+    headers={}
+    if(cachedPage!=None):
+      if(cachedPage.etag):
+        headers['If-None-Match']=cachedPage.etag
+      if(cachedPage.lastModified):
+        headers['If-Modified-Since']=cachedPage.lastModified
+    page=getSession(url).get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    if(METRICS_ENABLED):
+      countUpstream(page)
+    if(page.status_code==304 and cachedPage!=None): # page has not changed since it was cached
+      pageCache.count("revalidated")
+      pageCache.refresh(url)
+      return cachedPage.content
+    pageCache.count("misses")
+    count("cacheMisses")
+    if(page.status_code==200):
+      pageCache.store(url, page.content, page.headers.get('ETag'), page.headers.get('Last-Modified'))
+    return page.content
+  finally:
+    pageCache.releaseLease(url, owner)
+
+# Checks if another process downloaded a page while this process waited for the lease to download it
+# Parameter latestPage: CachedPage object looked up after the lease was taken, can be None
+# Parameter cachedPage: CachedPage object looked up before waiting, None if page was not cached
+# Returns boolean
+def isDownloadedSince(latestPage, cachedPage):
+  return latestPage!=None and (cachedPage==None or latestPage.fetchedAt>cachedPage.fetchedAt)
+
+# Downloads several pages concurrently
+# Parameter urls: list of URLs of pages to download
+# Returns list of raw bytes of the pages, in the same order as parameter urls
+def fetchPages(urls):
+  if(len(urls)<=1):
+    return [fetchPage(url) for url in urls]
+  return list(getExecutor().map(bindContext(fetchPage), urls))
+
+# Counts a download from tennisabstract.com for the metrics endpoint
+# Parameter page: response of the download (requests Response or httpx Response object)
+# Returns void
+def countUpstream(page):
+  count("upstreamRequests")
+  count("upstreamBytes", len(page.content))
+  if(page.status_code==304):
+    count("cacheRevalidated")
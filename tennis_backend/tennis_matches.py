@@ -0,0 +1,206 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from tennis_cache import BASE_DIR, CONFIG
+
+MATCH_STORE_PATH=CONFIG.get("Scraper", "Match_Store_Path", fallback=str(BASE_DIR / "match_store.sqlite3"))
+
+# Creates key that identifies a match of a player, the same match in the career and recent match files has the same key
+# Parameter match: array of match data from tennisabstract.com (date, tournament, surface, ..., round, score, ..., opponent, ...)
+# Returns string key of match
+def getMatchKey(match):
+  return json.dumps([match[0], match[1], match[8], match[11]]) # date, tournament, round, and opponent
+
+# Creates fingerprint of match data so unchanged match files are not stored again
+# Parameter matchArrayString: string of match array
+# Returns fingerprint string
+def getFingerprint(matchArrayString):
+  return hashlib.sha1(matchArrayString.encode('utf-8')).hexdigest()
+
+# local store of match histories keyed by tennisabstract.com player name (parsed for url search)
+# Career matches are stored once and recent matches are added on top, h2h records are found with the opponent index
+class MatchStore:
+  def __init__(self, path=MATCH_STORE_PATH):
+    self.path=path
+    self.connection=None
+    self.lock=threading.Lock()
+
+  # Opens the SQLite database on first use
+  # Returns sqlite3 Connection object
+  def getConnection(self):
+    if(self.connection==None):
+      self.connection=sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS players (player TEXT PRIMARY KEY, tour TEXT, careerLoaded INTEGER, recentFingerprint TEXT, updatedAt REAL)")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS matches (player TEXT, matchKey TEXT, opponent TEXT, result TEXT, score TEXT, date TEXT, surface TEXT, data TEXT, PRIMARY KEY (player, matchKey))")
+      self.connection.execute("CREATE INDEX IF NOT EXISTS matches_opponent ON matches (player, opponent)")
+      # Elo ratings computed from the stored matches by tennis_ratings.py, ratedMatches holds every match already counted
+      self.connection.execute("CREATE TABLE IF NOT EXISTS ratings (player TEXT, surface TEXT, rating REAL, matches INTEGER, PRIMARY KEY (player, surface))")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS ratedMatches (ratingKey TEXT PRIMARY KEY, date TEXT)")
+      # current ATP and WTA rankings tables downloaded by updateRankings in tennis_scraper.py
+      self.connection.execute("CREATE TABLE IF NOT EXISTS rankings (tour TEXT, player TEXT, name TEXT, rank INTEGER, updatedAt REAL, PRIMARY KEY (tour, player))")
+    return self.connection
+
+  # Checks if the career matches of a player are already stored
+  # Parameter player: name of player (parsed for url search)
+  # Returns boolean
+  def isCareerLoaded(self, player):
+    with self.lock:
+      row=self.getConnection().execute("SELECT careerLoaded FROM players WHERE player=?", (player,)).fetchone()
+    return row!=None and bool(row[0])
+
+  # Stores the career matches of a player
+  # Parameter player: name of player (parsed for url search)
+  # Parameter tour: "ATP" or "WTA"
+  # Parameter matchArray: array of career matches of player
+  # Returns void
+  def storeCareerMatches(self, player, tour, matchArray):
+    with self.lock:
+      connection=self.getConnection()
+      with connection: # commits or rolls back the transaction
+        connection.execute("BEGIN")
+        self.insertMatches(connection, player, matchArray)
+        connection.execute("INSERT INTO players VALUES (?, ?, 1, NULL, ?) ON CONFLICT (player) DO UPDATE SET tour=excluded.tour, careerLoaded=1, updatedAt=excluded.updatedAt", (player, tour, time.time()))
+
+  # Stores the recent matches of a player, skipped if the recent matches have not changed since they were last stored
+  # Parameter player: name of player (parsed for url search)
+  # Parameter tour: "ATP" or "WTA"
+  # Parameter matchArrayString: string of array of recent matches of player
+  # Returns void
+  def storeRecentMatches(self, player, tour, matchArrayString):
+    fingerprint=getFingerprint(matchArrayString)
+    with self.lock:
+      connection=self.getConnection()
+      row=connection.execute("SELECT recentFingerprint FROM players WHERE player=?", (player,)).fetchone()
+      if(row!=None and row[0]==fingerprint):
+        return
+      with connection: # commits or rolls back the transaction
+        connection.execute("BEGIN")
+        self.insertMatches(connection, player, json.loads(matchArrayString))
+        connection.execute("INSERT INTO players VALUES (?, ?, 0, ?, ?) ON CONFLICT (player) DO UPDATE SET tour=excluded.tour, recentFingerprint=excluded.recentFingerprint, updatedAt=excluded.updatedAt", (player, tour, fingerprint, time.time()))
+
+  # Inserts matches of a player, a match that is already stored is replaced (ex. score added once match is played), caller holds the lock
+  # Parameter connection: sqlite3 Connection object
+  # Parameter player: name of player (parsed for url search)
+  # Parameter matchArray: array of matches of player
+  # Returns void
+  def insertMatches(self, connection, player, matchArray):
+    rows=[(player, getMatchKey(match), match[11], match[4], match[9], match[0], match[2], json.dumps(match)) for match in matchArray]
+    connection.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+  # Gets head to head record of a player against an opponent
+  # Parameter player: name of player (parsed for url search)
+  # Parameter opponent: name of opponent
+  # Returns head to head record from perspective of player
+  def getH2H(self, player, opponent):
+    wins=0
+    losses=0
+    with self.lock:
+      # withdraws and matches that hasn't happened do not count towards H2H, matches stored without a score (null) still count
+      rows=self.getConnection().execute("SELECT result, COUNT(*) FROM matches WHERE player=? AND opponent=? AND (score IS NULL OR score NOT IN ('W/O', '')) GROUP BY result", (player, opponent)).fetchall()
+    for (result, count) in rows:
+      if(result=="W"):
+        wins+=count
+      else: # result=="L"
+        losses+=count
+    return {"wins": wins, "losses": losses}
+
+  # Gets head to head records of a player against every opponent they have played
+  # Parameter player: name of player (parsed for url search)
+  # Returns dictionary from name of opponent to head to head record from perspective of player
+  def getH2HRecords(self, player):
+    records={}
+    with self.lock:
+      # withdraws and matches that hasn't happened do not count towards H2H
+      rows=self.getConnection().execute("SELECT opponent, result, COUNT(*) FROM matches WHERE player=? AND (score IS NULL OR score NOT IN ('W/O', '')) GROUP BY opponent, result", (player,)).fetchall()
+    for (opponent, result, count) in rows:
+      record=records.setdefault(opponent, {"wins": 0, "losses": 0})
+      if(result=="W"):
+        record["wins"]+=count
+      else: # result=="L"
+        record["losses"]+=count
+    return records
+
+  # Gets all stored matches of a player
+  # Parameter player: name of player (parsed for url search)
+  # Returns array of matches of player, oldest match first
+  def getMatches(self, player):
+    with self.lock:
+      rows=self.getConnection().execute("SELECT data FROM matches WHERE player=? ORDER BY date", (player,)).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+  # Gets every stored match that was played (no withdraws or matches that haven't happened), used to compute ratings
+  # Returns list of tuples of player, opponent, result, date, surface, and match data
+  def getPlayedMatches(self):
+    with self.lock:
+      rows=self.getConnection().execute("SELECT player, opponent, result, date, surface, data FROM matches WHERE (score IS NULL OR score NOT IN ('W/O', ''))").fetchall()
+    return [(player, opponent, result, date, surface, json.loads(data)) for (player, opponent, result, date, surface, data) in rows]
+
+  # Gets the surface of the most recent stored match of each player
+  # Parameter players: list of names of players (parsed for url search)
+  # Returns dictionary from name of player to surface, players without stored matches are left out
+  def getLatestSurfaces(self, players):
+    surfaces={}
+    with self.lock:
+      connection=self.getConnection()
+      for player in players:
+        row=connection.execute("SELECT surface FROM matches WHERE player=? ORDER BY date DESC LIMIT 1", (player,)).fetchone()
+        if(row!=None):
+          surfaces[player]=row[0]
+    return surfaces
+
+  # Gets the matches that are already counted in the stored ratings
+  # Returns dictionary from rating key of match to date of match
+  def getRatedMatches(self):
+    with self.lock:
+      rows=self.getConnection().execute("SELECT ratingKey, date FROM ratedMatches").fetchall()
+    return dict(rows)
+
+  # Gets all stored ratings
+  # Returns dictionary from (player, surface) to tuple of rating and amount of rated matches
+  def getRatings(self):
+    with self.lock:
+      rows=self.getConnection().execute("SELECT player, surface, rating, matches FROM ratings").fetchall()
+    return {(player, surface): (rating, matches) for (player, surface, rating, matches) in rows}
+
+  # Stores ratings together with the matches counted in them, in one transaction
+  # Parameter ratings: list of tuples of player, surface, rating, and amount of rated matches
+  # Parameter ratedMatches: list of tuples of rating key and date of matches counted in the ratings
+  # Parameter replace: if true, all stored ratings and rated matches are replaced (ratings were computed from every match again)
+  # Returns void
+  def storeRatings(self, ratings, ratedMatches, replace=False):
+    with self.lock:
+      connection=self.getConnection()
+      with connection: # commits or rolls back the transaction
+        connection.execute("BEGIN")
+        if(replace):
+          connection.execute("DELETE FROM ratings")
+          connection.execute("DELETE FROM ratedMatches")
+        connection.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?)", ratings)
+        connection.executemany("INSERT OR REPLACE INTO ratedMatches VALUES (?, ?)", ratedMatches)
+
+  # Gets the stored rankings of every tour
+  # Returns tuple of list of tuples of tour, player, name, and rank, and time the oldest stored tour was downloaded (0 if none stored)
+  def getRankings(self):
+    with self.lock:
+      connection=self.getConnection()
+      rows=connection.execute("SELECT tour, player, name, rank FROM rankings").fetchall()
+      updatedAt=connection.execute("SELECT MIN(updatedAt) FROM (SELECT MAX(updatedAt) AS updatedAt FROM rankings GROUP BY tour)").fetchone()[0]
+    return (rows, updatedAt or 0)
+
+  # Replaces the stored rankings of a tour, in one transaction
+  # Parameter tour: "ATP" or "WTA"
+  # Parameter rankings: list of tuples of player (parsed for url search), name, and rank
+  # Returns void
+  def storeRankings(self, tour, rankings):
+    now=time.time()
+    with self.lock:
+      connection=self.getConnection()
+      with connection: # commits or rolls back the transaction
+        connection.execute("BEGIN")
+        connection.execute("DELETE FROM rankings WHERE tour=?", (tour,))
+        connection.executemany("INSERT OR REPLACE INTO rankings VALUES (?, ?, ?, ?, ?)", [(tour, player, name, rank, now) for (player, name, rank) in rankings])
+
+matchStore=MatchStore()
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tennis_fetch import CONFIG, MAX_WORKERS
+from tennis_matches import matchStore
+from tennis_metrics import bindContext
+from tennis_scraper import PlayerIndex, loadPlayerProfile, parsePlayerName
+
+logger=logging.getLogger(__name__)
+
+MATCHUPS_TTL=CONFIG.getint("Scraper", "Matchups_TTL", fallback=60*60) # seconds before ranks of a draw are downloaded again
+
+# matchups of each tournament, kept with the version of the stored tournament they were created from
+matchupCache={}
+matchupCacheLock=threading.Lock()
+profileExecutor=None
+profileExecutorLock=threading.Lock()
+
+# Gets the thread pool used to load the player pages of a draw, creating it on first use so every request shares it
+# It is not the pool of tennis_fetch.py since loading a player also downloads pages with that pool
+# Returns ThreadPoolExecutor object
+def getProfileExecutor():
+  global profileExecutor
+  with profileExecutorLock:
+    if(profileExecutor==None):
+      profileExecutor=ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tennis-matchups")
+  return profileExecutor
+
+# Gets cached matchups of a tournament if they were created from the same version of the stored tournament
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter stateVersion: version of the stored tournament from getBracketStateVersion function
+# Returns dictionary of tournament title, ranks of players, and head to head records, or None if they are not cached
+def getCachedMatchups(tournament, stateVersion):
+  with matchupCacheLock:
+    cachedMatchups=matchupCache.get(tournament)
+  if(cachedMatchups!=None and cachedMatchups["version"]==stateVersion and time.time()-cachedMatchups["updatedAt"]<MATCHUPS_TTL):
+    return cachedMatchups["data"]
+  return None
+
+# Gets current ranks of every player in a tournament and head to head records of every pair of players that can meet in the draw
+# The draw is the tournament stored by the prefetch_tournaments command, so the tournament page is never downloaded here
+# Each player is downloaded once (not once per pair) and the result is cached until the stored tournament changes
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter stateVersion: version of the stored tournament from getBracketStateVersion function
+# Parameter bracketData: tuple of tournament title, list of players, and list of match results from getTournamentSnapshot function
+# Returns dictionary of tournament title, ranks of players, and head to head records
+def getDrawMatchups(tournament, stateVersion, bracketData):
+  data=getCachedMatchups(tournament, stateVersion)
+  if(data!=None):
+    return data
+  data=createDrawMatchups(bracketData)
+  with matchupCacheLock:
+    matchupCache[tournament]={"version": stateVersion, "data": data, "updatedAt": time.time()}
+  return data
+
+# Creates ranks and head to head records for the players of a tournament
+# Parameter bracketData: tuple of tournament title, list of players, and list of match results from getTournamentSnapshot function
+# Returns dictionary of tournament title, ranks of players, and head to head records
+def createDrawMatchups(bracketData):
+  (title, playerList, matchList)=bracketData
+  (players, parsedNames)=getDrawPlayers(playerList)
+  # loading a player also stores the matches of the player, so head to head records are read after every player is loaded
+  profiles=list(getProfileExecutor().map(bindContext(loadPlayerProfileSafely), parsedNames))
+  ranks=[{"playerId": player['playerId'], "rank": profile["rank"], "tourType": profile["tourType"]} for (player, profile) in zip(players, profiles)]
+  return {"title": title, "ranks": ranks, "h2h": getDrawH2H(playerList)}
+
+# Gets the players of a draw that are known, qualifiers that have not been drawn yet are left out
+# Parameter playerList: list of players in the tournament
+# Returns tuple of list of players and list of their names (parsed for url search)
+def getDrawPlayers(playerList):
+  players=[player for player in playerList if player!=None and not player['playerName'].startswith("Qualifer Player")]
+  return (players, [parsePlayerName(player['playerName'], '') for player in players])
+
+# Finds head to head records of every pair of players that can meet in a draw from the matches in the match store
+# Parameter playerList: list of players in the tournament
+# Returns list of head to head records with the round where the two players would meet
+def getDrawH2H(playerList):
+  (players, parsedNames)=getDrawPlayers(playerList)
+  playerIndex=PlayerIndex(playerList)
+  h2h={}
+  for (player, parsedName) in zip(players, parsedNames):
+    playerId=player['playerId']
+    for (opponent, record) in matchStore.getH2HRecords(parsedName).items():
+      opponentId=playerIndex.search(opponent)
+      if(opponentId==-1 or opponentId==playerId):
+        continue
+      key=(min(playerId, opponentId), max(playerId, opponentId))
+      if(key in h2h): # record was already found from the matches of the other player
+        continue
+      (wins, losses)=(record["wins"], record["losses"]) if playerId<opponentId else (record["losses"], record["wins"])
+      roundNumber=(playerIndex.positions[key[0]]^playerIndex.positions[key[1]]).bit_length() # round where the two players would meet
+      h2h[key]={"id1": key[0], "id2": key[1], "roundNumber": roundNumber, "wins": wins, "losses": losses}
+  # pairs of players that have never played each other are left out, their head to head record is 0-0
+  return list(h2h.values())
+
+# Gets current rank and tour of a player without failing the whole draw if the player pages cannot be read
+# Parameter player: name of player (parsed for url search)
+# Returns dictionary of current rank of player and if player is ATP (men's) or WTA (women's), both None if player pages cannot be read
+def loadPlayerProfileSafely(player):
+  try:
+    return loadPlayerProfile(player)
+  except Exception:
+    logger.warning("Could not load player pages of %s", player, exc_info=True)
+    return {"rank": None, "tourType": None}
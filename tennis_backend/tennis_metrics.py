@@ -0,0 +1,207 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from configparser import ConfigParser
+from pathlib import Path
+
+# optional [Metrics] section of config.ini (see config.ini.example), metrics are off by default
+CONFIG=ConfigParser()
+CONFIG.read(Path(__file__).resolve().parent / "config.ini")
+
+METRICS_ENABLED=CONFIG.getboolean("Metrics", "Enabled", fallback=False)
+HISTOGRAM_BUCKETS=[1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000] # upper bounds of histogram buckets
+
+# timings of the request that is being handled, set by MetricsMiddleware
+currentRequest=contextvars.ContextVar("currentRequest", default=None)
+# true while the queries of a function are counted, so queries of nested timed functions are not counted twice
+countingQueries=contextvars.ContextVar("countingQueries", default=False)
+
+# time spent in each stage and counters of one request, sent back in the Server-Timing header
+class RequestTimings:
+  def __init__(self):
+    self.stages={} # stage to list of total seconds and amount of calls
+    self.counters={}
+    self.lock=threading.Lock() # stages can be timed from several threads at once (ex. pages downloaded concurrently)
+
+  # Adds time spent in a stage
+  # Parameter stage: name of stage
+  # Parameter seconds: time spent in stage
+  # Returns void
+  def addStage(self, stage, seconds):
+    with self.lock:
+      totals=self.stages.setdefault(stage, [0, 0])
+      totals[0]+=seconds
+      totals[1]+=1
+
+  # Adds an amount to a counter
+  # Parameter name: name of counter
+  # Parameter amount: amount added
+  # Returns void
+  def addCounter(self, name, amount):
+    with self.lock:
+      self.counters[name]=self.counters.get(name, 0)+amount
+
+  # Creates the Server-Timing header, a stage timed more than once (ex. downloads at the same time) shows the sum of its times
+  # Parameter totalSeconds: time spent handling the request
+  # Returns Server-Timing header value
+  def getServerTiming(self, totalSeconds):
+    with self.lock:
+      entries=[f'{stage};dur={seconds*1000:.2f};desc="{calls} calls"' for (stage, (seconds, calls)) in self.stages.items()]
+    entries.append(f"total;dur={totalSeconds*1000:.2f}")
+    return ", ".join(entries)
+
+# histogram of values with fixed buckets
+class Histogram:
+  def __init__(self, buckets=HISTOGRAM_BUCKETS):
+    self.buckets=buckets
+    self.counts=[0]*(len(buckets)+1) # last bucket counts values above the highest bound
+    self.count=0
+    self.sum=0
+    self.max=0
+
+  # Adds a value to the histogram, caller holds the lock of the registry
+  # Parameter value: value to add
+  # Returns void
+  def observe(self, value):
+    index=0
+    while(index<len(self.buckets) and value>self.buckets[index]):
+      index+=1
+    self.counts[index]+=1
+    self.count+=1
+    self.sum+=value
+    self.max=max(self.max, value)
+
+  # Returns dictionary of histogram that can be sent as JSON
+  def toDict(self):
+    buckets={f"le{bound}": count for (bound, count) in zip(self.buckets, self.counts)}
+    buckets["inf"]=self.counts[-1]
+    return {"count": self.count, "sum": self.sum, "mean": self.sum/self.count if self.count else 0, "max": self.max, "buckets": buckets}
+
+# histograms and counters of all requests since the server started
+class MetricsRegistry:
+  def __init__(self):
+    self.histograms={}
+    self.counters={}
+    self.lock=threading.Lock()
+
+  # Adds a value to a histogram
+  # Parameter name: name of histogram
+  # Parameter value: value to add
+  # Returns void
+  def observe(self, name, value):
+    with self.lock:
+      histogram=self.histograms.get(name)
+      if(histogram==None):
+        histogram=Histogram()
+        self.histograms[name]=histogram
+      histogram.observe(value)
+
+  # Adds an amount to a counter
+  # Parameter name: name of counter
+  # Parameter amount: amount added
+  # Returns void
+  def increment(self, name, amount=1):
+    with self.lock:
+      self.counters[name]=self.counters.get(name, 0)+amount
+
+  # Returns dictionary of all histograms and counters
+  def getMetrics(self):
+    with self.lock:
+      return {"counters": dict(self.counters), "histograms": {name: histogram.toDict() for (name, histogram) in self.histograms.items()}}
+
+metrics=MetricsRegistry()
+
+# Records the time spent in a stage for the current request and the stage histogram (in milliseconds)
+# Parameter stage: name of stage
+# Parameter seconds: time spent in stage
+# Returns void
+def recordStage(stage, seconds):
+  metrics.observe(f"stage.{stage}", seconds*1000)
+  timings=currentRequest.get()
+  if(timings!=None):
+    timings.addStage(stage, seconds)
+
+# Adds an amount to a counter for the current request and for all requests, does nothing if metrics are off
+# Parameter name: name of counter (ex. "cacheHits", "upstreamBytes", "queries")
+# Parameter amount: amount added
+# Returns void
+def count(name, amount=1):
+  if(not METRICS_ENABLED):
+    return
+  metrics.increment(name, amount)
+  timings=currentRequest.get()
+  if(timings!=None):
+    timings.addCounter(name, amount)
+
+# Counts a database query, used with connection.execute_wrapper
+def countQuery(execute, sql, params, many, context):
+  count("queries")
+  return execute(sql, params, many, context)
+
+# Decorator that times a function as a stage of the request, the function is returned unchanged if metrics are off
+# Parameter stage: name of stage shown in the Server-Timing header
+# Parameter countQueries: if true, database queries run by the function are counted
+# Returns decorator
+def timed(stage, countQueries=False):
+  def decorator(function):
+    if(not METRICS_ENABLED):
+      return function
+    if(inspect.iscoroutinefunction(function)):
+      @functools.wraps(function)
+      async def asyncWrapper(*args, **kwargs):
+        start=time.perf_counter()
+        try:
+          return await function(*args, **kwargs)
+        finally:
+          recordStage(stage, time.perf_counter()-start)
+      return asyncWrapper
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      start=time.perf_counter()
+      try:
+        if(countQueries and not countingQueries.get()):
+          from django.db import connection
+          token=countingQueries.set(True)
+          try:
+            with connection.execute_wrapper(countQuery):
+              return function(*args, **kwargs)
+          finally:
+            countingQueries.reset(token)
+        return function(*args, **kwargs)
+      finally:
+        recordStage(stage, time.perf_counter()-start)
+    return wrapper
+  return decorator
+
+# Makes a function keep the timings of the current request when it runs in another thread (ex. in a ThreadPoolExecutor)
+# Parameter function: function that will run in another thread
+# Returns function that runs in a copy of the current context, or parameter function if metrics are off
+def bindContext(function):
+  if(not METRICS_ENABLED):
+    return function
+  context=contextvars.copy_context()
+  # each call runs in its own copy since a context cannot be entered by two threads at once
+  return lambda *args: context.copy().run(function, *args)
+
+# Starts collecting timings of a request
+# Returns tuple of RequestTimings object and token used by finishRequest
+def startRequest():
+  timings=RequestTimings()
+  return (timings, currentRequest.set(timings))
+
+# Stops collecting timings of a request and adds them to the histograms of all requests
+# Parameter timings: RequestTimings object from startRequest
+# Parameter token: token from startRequest
+# Parameter path: path of request (ex. "/bracket")
+# Parameter totalSeconds: time spent handling the request
+# Returns void
+def finishRequest(timings, token, path, totalSeconds):
+  currentRequest.reset(token)
+  metrics.increment("requests")
+  metrics.observe(f"request.{path}", totalSeconds*1000)
+  with timings.lock:
+    counters=dict(timings.counters)
+  metrics.observe("queriesPerRequest", counters.get("queries", 0))
+  metrics.observe("upstreamBytesPerRequest", counters.get("upstreamBytes", 0)/1024) # in KB
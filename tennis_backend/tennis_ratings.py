@@ -0,0 +1,166 @@
+import json
+import threading
+from collections import Counter
+import numpy as np
+from tennis_matches import matchStore
+from tennis_metrics import timed
+from tennis_scraper import parsePlayerName
+
+# Surface aware Elo ratings computed from the match histories in the local match store
+# Every player has an overall rating and a rating per surface, a match on a surface updates both
+# Ratings are updated with "python manage.py update_ratings" and stored in the match store, requests only read them
+
+SURFACES=["All", "Hard", "Clay", "Grass", "Carpet"] # "All" is the overall rating
+SURFACE_INDEX={surface: index for (index, surface) in enumerate(SURFACES)}
+INITIAL_RATING=1500
+# K factor shrinks as a player plays more matches so ratings of new players move faster: K_FACTOR/(matches+K_OFFSET)^K_SHAPE
+K_FACTOR=250
+K_OFFSET=5
+K_SHAPE=0.4
+SURFACE_WEIGHT=0.5 # weight of surface rating in the rating used for a match on that surface
+# order of matches of the same tournament, tennisabstract.com match arrays only have the date the tournament started
+ROUND_ORDER={"Q1": 0, "Q2": 1, "Q3": 2, "Q4": 3, "R128": 4, "R64": 5, "R32": 6, "R16": 7, "RR": 7, "QF": 8, "SF": 9, "BR": 10, "F": 10}
+
+# ratings loaded from the match store, dictionary from player to dictionary from surface to rating and amount of matches
+ratingsCache={"ratings": None}
+ratingsCacheLock=threading.Lock()
+
+# Gets every played match in the match store once, a match between two stored players is in the matches of both
+# Returns dictionary from rating key of match to tuple of date, round order, winner, loser, and surface
+def collectMatches():
+  matches={}
+  for (player, opponent, result, date, surface, match) in matchStore.getPlayedMatches():
+    opponent=parsePlayerName(opponent, '') # same form as names of stored players
+    if(opponent=='' or opponent==player):
+      continue
+    (winner, loser)=(player, opponent) if result=="W" else (opponent, player)
+    ratingKey=json.dumps([date, match[1], match[8], min(player, opponent), max(player, opponent)]) # date, tournament, round, and players
+    matches[ratingKey]=(date, ROUND_ORDER.get(match[8], len(ROUND_ORDER)), winner, loser, surface)
+  return matches
+
+# Updates ratings with the matches of one round, every match of the round is updated at once
+# Parameter ratings: array of ratings, [surface index, player index]
+# Parameter counts: array of amount of rated matches, same shape as ratings
+# Parameter rows: array of surface index of each match
+# Parameter winners: array of player index of winner of each match
+# Parameter losers: array of player index of loser of each match
+# Returns void: ratings and counts are updated
+def updateRound(ratings, counts, rows, winners, losers):
+  expected=1/(1+10**((ratings[rows, losers]-ratings[rows, winners])/400)) # probability of winner winning
+  winnerChange=K_FACTOR/(counts[rows, winners]+K_OFFSET)**K_SHAPE*(1-expected)
+  loserChange=K_FACTOR/(counts[rows, losers]+K_OFFSET)**K_SHAPE*(1-expected)
+  # np.add.at adds every change even if a player is in more than one match of the round
+  np.add.at(ratings, (rows, winners), winnerChange)
+  np.add.at(ratings, (rows, losers), -loserChange)
+  np.add.at(counts, (rows, winners), 1)
+  np.add.at(counts, (rows, losers), 1)
+
+# Computes ratings from matches in the order they were played, starting from stored ratings
+# Parameter matches: list of tuples of date, round order, winner, loser, and surface, in the order they were played
+# Parameter storedRatings: dictionary from (player, surface) to tuple of rating and amount of rated matches
+# Returns list of tuples of player, surface, rating, and amount of rated matches, for every player in the matches
+@timed("ratings")
+def computeRatings(matches, storedRatings):
+  players=sorted({match[2] for match in matches}|{match[3] for match in matches})
+  playerIndex={player: index for (index, player) in enumerate(players)}
+  ratings=np.full((len(SURFACES), len(players)), INITIAL_RATING, dtype=np.float64)
+  counts=np.zeros((len(SURFACES), len(players)), dtype=np.int64)
+  for ((player, surface), (rating, count)) in storedRatings.items():
+    if(player in playerIndex and surface in SURFACE_INDEX):
+      ratings[SURFACE_INDEX[surface], playerIndex[player]]=rating
+      counts[SURFACE_INDEX[surface], playerIndex[player]]=count
+  winners=np.array([playerIndex[match[2]] for match in matches], dtype=np.int64)
+  losers=np.array([playerIndex[match[3]] for match in matches], dtype=np.int64)
+  surfaces=np.array([SURFACE_INDEX.get(match[4], 0) for match in matches], dtype=np.int64) # unknown surface only updates overall rating
+  # matches with the same date and round are played at the same time so they are rated together
+  roundStarts=[index for index in range(len(matches)) if index==0 or matches[index][:2]!=matches[index-1][:2]]
+  for (start, end) in zip(roundStarts, roundStarts[1:]+[len(matches)]):
+    (roundWinners, roundLosers, roundSurfaces)=(winners[start:end], losers[start:end], surfaces[start:end])
+    updateRound(ratings, counts, np.zeros(end-start, dtype=np.int64), roundWinners, roundLosers)
+    onSurface=roundSurfaces>0
+    if(onSurface.any()):
+      updateRound(ratings, counts, roundSurfaces[onSurface], roundWinners[onSurface], roundLosers[onSurface])
+  ratingRows=[]
+  for (surfaceIndex, surface) in enumerate(SURFACES):
+    for index in np.flatnonzero(counts[surfaceIndex]):
+      ratingRows.append((players[index], surface, float(ratings[surfaceIndex, index]), int(counts[surfaceIndex, index])))
+  return ratingRows
+
+# Updates stored ratings with the matches added to the match store since the last update
+# New matches are added on top of the stored ratings, if any of them are older than the last rated match
+# (ex. career matches of a player stored for the first time) every match is rated again in order
+# Returns amount of new matches rated
+def updateRatings():
+  matches=collectMatches()
+  ratedMatches=matchStore.getRatedMatches()
+  newKeys=[ratingKey for ratingKey in matches if ratingKey not in ratedMatches]
+  if(not newKeys):
+    return 0
+  lastDate=max(ratedMatches.values(), default='')
+  replace=any(matches[ratingKey][0]<lastDate for ratingKey in newKeys)
+  if(replace):
+    ratingKeys=list(matches)
+    storedRatings={}
+  else:
+    ratingKeys=newKeys
+    storedRatings=matchStore.getRatings()
+  ratingKeys.sort(key=lambda ratingKey: matches[ratingKey][:2])
+  ratingRows=computeRatings([matches[ratingKey] for ratingKey in ratingKeys], storedRatings)
+  matchStore.storeRatings(ratingRows, [(ratingKey, matches[ratingKey][0]) for ratingKey in ratingKeys], replace)
+  with ratingsCacheLock:
+    ratingsCache["ratings"]=None
+  return len(newKeys)
+
+# Gets stored ratings, loaded from the match store once and kept until ratings are updated
+# Returns dictionary from player to dictionary from surface to tuple of rating and amount of rated matches
+def getRatings():
+  with ratingsCacheLock:
+    ratings=ratingsCache["ratings"]
+  if(ratings!=None):
+    return ratings
+  ratings={}
+  for ((player, surface), values) in matchStore.getRatings().items():
+    ratings.setdefault(player, {})[surface]=values
+  with ratingsCacheLock:
+    ratingsCache["ratings"]=ratings
+  return ratings
+
+# Gets the rating of a player for a match, the overall rating is blended with the surface rating if the player has one
+# Parameter player: name of player (parsed for url search)
+# Parameter surface: surface of match (ex. "Hard"), None if not known
+# Returns rating, or None if player has no rating
+def getPlayerRating(player, surface=None):
+  playerRatings=getRatings().get(player)
+  if(playerRatings==None or "All" not in playerRatings):
+    return None
+  rating=playerRatings["All"][0]
+  if(surface in playerRatings and surface!="All"):
+    rating=(1-SURFACE_WEIGHT)*rating+SURFACE_WEIGHT*playerRatings[surface][0]
+  return rating
+
+# Gets the probability of a player beating an opponent from their ratings
+# Parameter player: name of player (parsed for url search)
+# Parameter opponent: name of opponent (parsed for url search)
+# Parameter surface: surface of match (ex. "Hard"), None if not known
+# Returns probability of player winning, or None if either player has no rating
+def getWinProbability(player, opponent, surface=None):
+  playerRating=getPlayerRating(player, surface)
+  opponentRating=getPlayerRating(opponent, surface)
+  if(playerRating==None or opponentRating==None):
+    return None
+  return 1/(1+10**((opponentRating-playerRating)/400))
+
+# Gets the ratings of the players in a draw, the surface of the tournament is the surface most players last played on
+# Parameter roster: list of players in the tournament, None for an empty spot (bye)
+# Returns tuple of surface (None if not known) and array of rating of player in each draw position (NaN if no rating)
+def getDrawRatings(roster):
+  names=[None if player==None else parsePlayerName(player['playerName'], '') for player in roster]
+  latestSurfaces=Counter(matchStore.getLatestSurfaces([name for name in names if name!=None]).values())
+  surface=latestSurfaces.most_common(1)[0][0] if latestSurfaces else None
+  ratings=np.full(len(roster), np.nan)
+  for (position, name) in enumerate(names):
+    if(name!=None):
+      rating=getPlayerRating(name, surface)
+      if(rating!=None):
+        ratings[position]=rating
+  return (surface, ratings)
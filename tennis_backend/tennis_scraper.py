@@ -1,20 +1,58 @@
+import html
 import json
-import requests
+import logging
+import re
+import threading
+import time
+import unicodedata
+from urllib.parse import unquote
 from bs4 import BeautifulSoup
 from dataclasses import dataclass
 import math
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-
-# Gets the html on the URL page chosen by user
-# Returns page content on URL given by BeautifulSoup library
-def getPage(url):
-  headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-  page = requests.get(url, headers=headers)
-  pageContent = BeautifulSoup(page.content, "html.parser")
-  return pageContent
+from tennis_extract import decodePage, findHeadScript, findTitle
+from tennis_fetch import CONFIG, fetchPage, fetchPages
+from tennis_matches import matchStore
+from tennis_metrics import timed
+from tennis_singleflight import SingleFlight
+
+logger=logging.getLogger(__name__)
+
+TOURNAMENT_URL="https://www.tennisabstract.com/current/{tournament}.html"
+ATP_PLAYER_URL="https://www.tennisabstract.com/cgi-bin/player.cgi?p={player}"
+ATP_CAREER_URL="https://www.tennisabstract.com/cgi-bin/player.cgi?p={player}&f=ACareerqq"
+WTA_PLAYER_URL="https://www.tennisabstract.com/cgi-bin/wplayer-classic.cgi?p={player}"
+WTA_RECENT_MATCHES_URL="https://www.minorleaguesplits.com/tennisabstract/cgi-bin/jsmatches/{player}.js"
+WTA_CAREER_MATCHES_URL="https://www.minorleaguesplits.com/tennisabstract/cgi-bin/jsmatches/{player}Career.js"
+
+SEED_PATTERN=re.compile(r'^\([^)]*\)\s*')
+NAME_SEPARATOR_PATTERN=re.compile(r'[\s\-.]+')
+HOME_URL="https://www.tennisabstract.com/"
+RANKINGS_URLS={"ATP": "https://www.tennisabstract.com/reports/atpRankings.html", "WTA": "https://www.tennisabstract.com/reports/wtaRankings.html"}
+TOURNAMENT_LINK_PATTERN=re.compile(r'<a\s[^>]*href\s*=\s*["\']?[^"\'>]*?current/([^"\'>\s]+\.html)["\']?[^>]*>\s*Results and Forecasts\s*</a>', re.IGNORECASE)
+TOURNAMENTS_TTL=CONFIG.getint("Scraper", "Tournaments_TTL", fallback=10*60) # seconds before the tournament list is refreshed
+USE_BROWSER_FALLBACK=CONFIG.getboolean("Scraper", "Use_Browser_Fallback", fallback=False)
+RANKINGS_TTL=CONFIG.getint("Scraper", "Rankings_TTL", fallback=6*60*60) # seconds before the rankings tables are downloaded again
+RANKINGS_RETRY_INTERVAL=5*60 # seconds before rankings are downloaded again after a failed download
+RANKINGS_RELOAD_INTERVAL=60 # seconds before the rankings index is loaded again from the match store
+# row of a rankings table: rank in the first cell and a link to the player page (with the player name for url search) in the second
+RANKING_ROW_PATTERN=re.compile(r'<tr[^>]*>\s*<td[^>]*>\s*(\d+)\s*</td>\s*<td[^>]*>\s*<a\s[^>]*href\s*=\s*["\'][^"\']*[?&]p=([^"\'&]+)[^"\']*["\'][^>]*>(.*?)</a>', re.IGNORECASE|re.DOTALL)
+
+# parsed completed results of each tournament page so a scrape only parses results that are new since the last scrape
+completedResultsState={}
+completedResultsLock=threading.Lock()
+RESULTS_HISTORY_SIZE=100 # amount of versions of new results kept for getResultsDelta
+
+# cached list of current tournaments, refreshed in the background once it is older than TOURNAMENTS_TTL
+tournamentIndex={"tournaments": None, "updatedAt": 0, "refreshing": False}
+tournamentIndexLock=threading.Lock()
+
+bracketFlights=SingleFlight() # threads asking for the same tournament wait for one download and parse of its page
+
+# current ATP and WTA ranks of players, loaded from the rankings stored in the match store by the prefetch_tournaments command,
+# loaded again once older than RANKINGS_RELOAD_INTERVAL so rankings stored by the command in another process are picked up
+rankingsIndex={"players": None, "loadedAt": 0, "refreshing": False}
+rankingsIndexLock=threading.Lock()
+rankingsFlights=SingleFlight() # threads that need the rankings index before it is loaded wait for one load
 
 # Find the specific HTML in the page content that lists the players in the tournament
 # Parameter playerContent: the HTML page content
@@ -65,10 +103,10 @@ def getPlayerList(playersSoup):
   return playerList
 
 # Gets the tournament name from the tournamnt URL page
-# Parameter soup: HTML of tournament URL page 
+# Parameter page: raw bytes of tournament URL page 
 # Returns tournament title
-def getTournamentTitle(htmlPage):
-  content=htmlPage.head.title.text
+def getTournamentTitle(page):
+  content=findTitle(page)
   return getContentUsingStartAndEndString(content, ":", "Results", 2, 1)
 
 # Check if html has score information about match
@@ -122,21 +160,68 @@ def playerScore(score, player):
         i+=2
   return playerScore
 
-# Get id of player using the player list created by getPlayerList function
-# Parameter player: name of player in interest
-# Parameter playerList: list of players and their corresponding ids
-# Returns id of player in interest or -1 if player not found in playerList
-def searchIDForPlayer(player, playerList): 
-  for item in playerList:
-    if(item!=None):
-      checkForSeedIndex=item['playerName'].find(') ')
-      playerName=item['playerName']
-      # remove seed off player name
-      if(checkForSeedIndex!=-1):
-        playerName=item['playerName'][checkForSeedIndex+2:]
-      if(playerName==player):
-        return item['playerId']
-  return -1
+# Normalizes a player name so the same player matches regardless of seed, accents, case and spacing
+# Parameter playerName: name of player, possibly with a seed such as "(1) " or "(Q) " in front
+# Returns normalized player name
+def normalizePlayerName(playerName):
+  name=SEED_PATTERN.sub('', playerName.strip())
+  name=unicodedata.normalize('NFKD', name)
+  name=''.join(character for character in name if not unicodedata.combining(character))
+  return NAME_SEPARATOR_PATTERN.sub(' ', name).strip().lower()
+
+# index from normalized player name to player id, built once from the player list created by getPlayerList function
+class PlayerIndex:
+  # Parameter playerList: list of players and their corresponding ids
+  def __init__(self, playerList):
+    self.playerList=playerList
+    self.ids={}
+    self.positions={} # player id to position in the draw
+    self.unmatched=[]
+    for (position, item) in enumerate(playerList):
+      if(item!=None):
+        self.ids.setdefault(normalizePlayerName(item['playerName']), item['playerId'])
+        self.positions[item['playerId']]=position
+    # fingerprint of the draw, built once with the index so a scrape compares rosters without serializing them
+    self.fingerprint=tuple(None if item==None else (item['playerId'], item['playerName']) for item in playerList)
+
+  # Get id of player
+  # Parameter player: name of player in interest
+  # Returns id of player in interest or -1 if player not found in player list
+  def search(self, player):
+    return self.ids.get(normalizePlayerName(player), -1)
+
+  # Get id of a qualifier that was not known when the draw was made, using the draw position next to their first round opponent
+  # Parameter player: name of qualifier
+  # Parameter opponentId: id of first round opponent of qualifier
+  # Returns id of "Qualifer Player" spot that the qualifier took or -1 if there is no such spot
+  def searchQualifier(self, player, opponentId):
+    if(opponentId not in self.positions):
+      return -1
+    position=self.positions[opponentId]^1 # first round opponents are next to each other in the draw
+    if(position>=len(self.playerList) or self.playerList[position]==None):
+      return -1
+    item=self.playerList[position]
+    if(not item['playerName'].startswith("Qualifer Player")):
+      return -1
+    self.ids[normalizePlayerName(player)]=item['playerId'] # qualifier is found by name in later rounds
+    return item['playerId']
+
+  # Get ids of both players in a match and report players that cannot be found
+  # Parameter player1: name of player 1 in the match
+  # Parameter player2: name of player 2 in the match
+  # Returns tuple of ids of both players, -1 for a player not found in player list
+  def searchMatch(self, player1, player2):
+    playerId1=self.search(player1)
+    playerId2=self.search(player2)
+    if(playerId1==-1 and playerId2!=-1):
+      playerId1=self.searchQualifier(player1, playerId2)
+    elif(playerId2==-1 and playerId1!=-1):
+      playerId2=self.searchQualifier(player2, playerId1)
+    for (player, playerId) in ((player1, playerId1), (player2, playerId2)):
+      if(playerId==-1 and player not in self.unmatched):
+        self.unmatched.append(player)
+        logger.warning("Player %s in completed matches is not in the tournament draw", player)
+    return (playerId1, playerId2)
 
 # Check if the round name string can be found in the content HTML
 # Paramter content: HTML that represents the matches in the tennis bracket
@@ -201,82 +286,280 @@ def findMatchResultInfo(content, index, highestRoundNumber):
 # Paramater player1: player 1 in the match
 # Paramater player2: player 2 in the match
 # Paramater scoreHTML: html related to match score
-# Parameter matchList: list of match results for tennis bracket
-# Paramter playerList: list of players and corresponding ids
-# Returns matchList with new match result
-def getMatchResultInfo(roundNumber, player1, player2, scoreHTML, matchList, playerList):
-  playerId1=searchIDForPlayer(player1.text, playerList)
-  playerId2=searchIDForPlayer(player2.text, playerList)
+# Paramter playerIndex: PlayerIndex object used to find ids of players
+# Returns match result
+def getMatchResultInfo(roundNumber, player1, player2, scoreHTML, playerIndex):
+  (playerId1, playerId2)=playerIndex.searchMatch(player1.text, player2.text)
   filteredScore=filterScore(scoreHTML)
   scoreWinner=playerScore(filteredScore, 1)
   scoreLoser=playerScore(filteredScore, 2)
   if(playerId1<playerId2):
     opp1={"score": scoreWinner, "result": 'win'}
     opp2={"score": scoreLoser}
-    matchList.append({"roundNumber": roundNumber, "id1": playerId1, "id2": playerId2, "opponent1": opp1, "opponent2": opp2})
-  else:
-    opp1={"score": scoreLoser}
-    opp2={"score": scoreWinner, "result": 'win'}
-    matchList.append({"roundNumber": roundNumber, "id1": playerId2, "id2": playerId1, "opponent1": opp1, "opponent2": opp2})
-  return matchList
+    return {"roundNumber": roundNumber, "id1": playerId1, "id2": playerId2, "opponent1": opp1, "opponent2": opp2}
+  opp1={"score": scoreLoser}
+  opp2={"score": scoreWinner, "result": 'win'}
+  return {"roundNumber": roundNumber, "id1": playerId2, "id2": playerId1, "opponent1": opp1, "opponent2": opp2}
 
 # Gets list of match results for the tennis bracket from the related HTML
 # Paramter content: html related to tennis bracket
-# Parameter playerList: list of players and corresponding ids
+# Parameter playerIndex: PlayerIndex object used to find ids of players
 # Parameter highestRoundNumber: highest round number in tournament bracket
 # Returns list of match results for tennis bracket
-def getCompletedMatchList(content, playerList, highestRoundNumber):
+def getCompletedMatchList(content, playerIndex, highestRoundNumber):
+  return parseCompletedMatches(content, playerIndex, highestRoundNumber)[0]
+
+# Gets list of match results for the tennis bracket from the related HTML and if reading stopped at the qualifying rounds
+# Paramter content: html related to tennis bracket
+# Parameter playerIndex: PlayerIndex object used to find ids of players
+# Parameter highestRoundNumber: highest round number in tournament bracket
+# Returns tuple of list of match results for tennis bracket and boolean that is true if qualifying rounds were found
+def parseCompletedMatches(content, playerIndex, highestRoundNumber):
+  matches=iterateCompletedMatches(content, playerIndex, highestRoundNumber)
   matchList=[]
+  while(True):
+    try:
+      matchList.append(next(matches))
+    except StopIteration as stop: # value of stop is the value returned by the generator
+      return (matchList, stop.value)
+
+# Finds the match results for the tennis bracket in the related HTML one at a time
+# Paramter content: html related to tennis bracket
+# Parameter playerIndex: PlayerIndex object used to find ids of players
+# Parameter highestRoundNumber: highest round number in tournament bracket
+# Returns generator that yields each match result and returns true if qualifying rounds were found
+def iterateCompletedMatches(content, playerIndex, highestRoundNumber):
   index=0
   while(index<len(content)):
     if(checkForRoundName(content, index)):
       (newIndex, matchResult)=findMatchResultInfo(content, index, highestRoundNumber)
       if(matchResult!=None):
         (roundNumber, player1, player2, scoreHTML)=matchResult
-        matchList=getMatchResultInfo(roundNumber, player1, player2, scoreHTML, matchList, playerList)
+        yield getMatchResultInfo(roundNumber, player1, player2, scoreHTML, playerIndex)
       index+=(newIndex-index)
     elif("Q1" in content[index] or "Q2" in content[index]): # rounds not needed for bracket
-      break
+      return True
     else:
       index+=1
-  return matchList
+  return False
 
 # Gets the match results in the tournament bracket
-# Parameter playerList: list of playerse in the tournament
+# Parameter playerIndex: PlayerIndex object of players in the tournament
 # Parameter content: HTML of tournament URL page 
 # Parameter highestRoundNumber: highest round number in tournament bracket
-# Returns tournament title
-def getCompletedMatchResults(playerList, content, highestRoundNumber):
+# Parameter url: URL of tournament page, used to only parse new results
+# Returns list of match results for tennis bracket
+def getCompletedMatchResults(playerIndex, content, highestRoundNumber, url=None):
   resultsHTML=getContentUsingStartAndEndString(content, 'completedSingles', 'completedDoubles', 19, 7)
+  if(url==None):
+    return parseResultsHTML(resultsHTML, playerIndex, highestRoundNumber)[0]
+  with completedResultsLock:
+    state=completedResultsState.get(url)
+    if(state==None):
+      state=CompletedResults()
+      completedResultsState[url]=state
+  return state.update(resultsHTML, playerIndex, highestRoundNumber)
+
+# Parses the html of completed matches
+# Parameter resultsHTML: html of completed matches of tournament
+# Parameter playerIndex: PlayerIndex object used to find ids of players
+# Parameter highestRoundNumber: highest round number in tournament bracket
+# Returns tuple of list of match results and boolean that is true if qualifying rounds were found
+def parseResultsHTML(resultsHTML, playerIndex, highestRoundNumber):
   soup=BeautifulSoup(resultsHTML, "html.parser")
-  matchContent=soup.contents
-  matchList=getCompletedMatchList(matchContent, playerList, highestRoundNumber)
-  return matchList
+  return parseCompletedMatches(soup.contents, playerIndex, highestRoundNumber)
+
+# completed results of one tournament page from the last scrape
+# New results are added to the completed results html at the start or at the end, so only the added html is parsed
+# Every change creates a new version, the matches added in each version are kept so callers can apply them with getResultsDelta
+class CompletedResults:
+  def __init__(self):
+    self.lock=threading.Lock()
+    self.rosterKey=None
+    self.playerIndex=None
+    self.resultsHTML=None
+    self.matchList=[]
+    self.stopped=False # reading stopped at the qualifying rounds
+    self.version=0
+    self.baseVersion=0 # version of the last full parse, deltas from older versions are not known
+    self.history=[] # tuples of version and matches added in that version
+
+  # Updates the completed results with the html from a new scrape
+  # Parameter resultsHTML: html of completed matches of tournament
+  # Parameter playerIndex: PlayerIndex object of players in the tournament
+  # Parameter highestRoundNumber: highest round number in tournament bracket
+  # Returns list of match results for tennis bracket
+  def update(self, resultsHTML, playerIndex, highestRoundNumber):
+    rosterKey=(playerIndex.fingerprint, highestRoundNumber)
+    with self.lock:
+      if(rosterKey==self.rosterKey and resultsHTML==self.resultsHTML):
+        return list(self.matchList)
+      newMatches=None
+      if(rosterKey==self.rosterKey): # ids of players have not changed so matches parsed before are still correct
+        newMatches=self.parseNewResults(resultsHTML, highestRoundNumber)
+      if(newMatches==None):
+        (self.matchList, self.stopped)=parseResultsHTML(resultsHTML, playerIndex, highestRoundNumber)
+        self.playerIndex=playerIndex
+        self.rosterKey=rosterKey
+        self.version+=1
+        self.baseVersion=self.version
+        self.history=[]
+      elif(newMatches):
+        self.version+=1
+        self.history.append((self.version, newMatches))
+        del self.history[:-RESULTS_HISTORY_SIZE]
+        self.baseVersion=max(self.baseVersion, self.history[0][0]-1)
+      self.resultsHTML=resultsHTML
+      return list(self.matchList)
+
+  # Parses only the html that was added since the last scrape and adds the new matches to the match list, caller holds the lock
+  # Parameter resultsHTML: html of completed matches of tournament
+  # Parameter highestRoundNumber: highest round number in tournament bracket
+  # Returns list of new matches or None if the html changed in another way and has to be parsed again
+  def parseNewResults(self, resultsHTML, highestRoundNumber):
+    oldHTML=self.resultsHTML
+    if(not oldHTML or len(resultsHTML)<=len(oldHTML)):
+      return None
+    if(resultsHTML.startswith(oldHTML) and oldHTML[-1]=='>'): # results added at the end, after a tag
+      if(self.stopped): # added results are after the qualifying rounds which are not read
+        return []
+      (newMatches, self.stopped)=parseResultsHTML(resultsHTML[len(oldHTML):], self.playerIndex, highestRoundNumber)
+      self.matchList=self.matchList+newMatches
+      return newMatches
+    addedLength=len(resultsHTML)-len(oldHTML)
+    # results added at the start, which can be after text in front of the first tag (ex. quote of javascript string)
+    for start in range(oldHTML.find('<')+1):
+      addedEnd=start+addedLength
+      if(resultsHTML[addedEnd-1]=='>' and resultsHTML.startswith(oldHTML[:start]) and resultsHTML.endswith(oldHTML[start:])):
+        (newMatches, stopped)=parseResultsHTML(resultsHTML[:addedEnd], self.playerIndex, highestRoundNumber)
+        if(stopped): # results parsed before are now after the qualifying rounds
+          return None
+        self.matchList=newMatches+self.matchList
+        return newMatches
+    return None
+
+  # Gets matches added since a version
+  # Parameter sinceVersion: version the caller already has
+  # Returns dictionary of current version and matches added since parameter sinceVersion, or None if caller has to reload all matches
+  def getDelta(self, sinceVersion):
+    with self.lock:
+      if(sinceVersion<self.baseVersion or sinceVersion>self.version):
+        return None
+      matches=[match for (version, newMatches) in self.history if version>sinceVersion for match in newMatches]
+      return {"version": self.version, "matches": matches}
+
+# Gets the version of the completed results of a tournament from the last scrape
+# Parameter url: URL of tournament page
+# Returns version number, 0 if tournament has not been scraped
+def getResultsVersion(url):
+  with completedResultsLock:
+    state=completedResultsState.get(url)
+  if(state==None):
+    return 0
+  with state.lock:
+    return state.version
+
+# Gets completed matches of a tournament that are new since a version, so callers can add them to the match list they already have
+# Parameter url: URL of tournament page
+# Parameter sinceVersion: version from getResultsVersion that the caller already has
+# Returns dictionary of current version and new matches, or None if the version is too old and all results have to be loaded again
+def getResultsDelta(url, sinceVersion):
+  with completedResultsLock:
+    state=completedResultsState.get(url)
+  if(state==None):
+    return None
+  return state.getDelta(sinceVersion)
 
 # Get players in the tournament from tournament HTML page chosen by user
+# Threads asking for a tournament that is already being downloaded and parsed share its result
 # Returns list of players and ids for players
 def getBracketInfo(url):
-  content=getPage(url)
-  tournamentTitle=getTournamentTitle(content)
-  playersContent=str(content.head.find_all('script')[-1].contents[0]) # last script tag in head has relevant bracket data needed
+  return bracketFlights.do(url, lambda: parseBracketPage(fetchPage(url), url))
+
+# Get players and match results of a tournament from its downloaded page
+# Parameter page: raw bytes of tournament URL page
+# Parameter url: URL of tournament page
+# Returns tuple of tournament title, list of players and ids for players, and list of match results, or None if page has no bracket
+@timed("parse")
+def parseBracketPage(page, url):
+  bracketRoster=parseBracketRoster(page)
+  if(bracketRoster==None):
+    return None
+  (tournamentTitle, playersContent, playerList)=bracketRoster
+  playerIndex=PlayerIndex(playerList) # built once so each match result is a dictionary lookup
+  highestRoundNumber=int(math.ceil(math.log2(len(playerList))))
+  matchList=getCompletedMatchResults(playerIndex, playersContent, highestRoundNumber, url)
+  return (tournamentTitle, playerList, matchList)
+
+# Get players of a tournament from its downloaded page, without parsing its match results
+# Parameter page: raw bytes of tournament URL page
+# Returns tuple of tournament title, last script in head of page, and list of players and ids for players, or None if page has no bracket
+def parseBracketRoster(page):
+  tournamentTitle=getTournamentTitle(page)
+  playersContent=findHeadScript(page) # last script tag in head has relevant bracket data needed
+  if(playersContent==None):
+    return None
   playersHTML=findPlayerList(playersContent)
   playersSoup = BeautifulSoup(playersHTML, "html.parser")
   playerList=getPlayerList(playersSoup)
   if(playerList==None):
     return None
-  highestRoundNumber=int(math.ceil(math.log2(len(playerList))))
-  matchList=getCompletedMatchResults(playerList, playersContent, highestRoundNumber)
-  return (tournamentTitle, playerList, matchList)
+  return (tournamentTitle, playersContent, playerList)
 
 # Get all current tournament brackets that are available to view from tennisabstract.com
+# Tournaments are served from a cached index, a stale index is returned while it is refreshed in the background
 # Returns array of tournament names and their urls
 def getAllTournaments():
+  with tournamentIndexLock:
+    tournaments=tournamentIndex["tournaments"]
+    stale=time.time()-tournamentIndex["updatedAt"]>=TOURNAMENTS_TTL
+    startRefresh=tournaments!=None and stale and not tournamentIndex["refreshing"]
+    if(startRefresh):
+      tournamentIndex["refreshing"]=True
+  if(tournaments==None): # nothing cached yet so the first request has to wait
+    return refreshTournamentIndex()
+  if(startRefresh):
+    threading.Thread(target=refreshTournamentIndex, daemon=True).start()
+  return tournaments
+
+# Downloads the current tournaments and stores them in the cached tournament index
+# Returns array of tournament names and their urls
+def refreshTournamentIndex():
+  try:
+    tournaments=findAllTournaments()
+    with tournamentIndexLock:
+      tournamentIndex["tournaments"]=tournaments
+      tournamentIndex["updatedAt"]=time.time()
+    return tournaments
+  finally:
+    with tournamentIndexLock:
+      tournamentIndex["refreshing"]=False
+
+# Finds current tournaments from the "Results and Forecasts" links on the tennisabstract.com home page
+# Uses a headless browser only if the links cannot be found in the html and Use_Browser_Fallback is set in config.ini
+# Returns array of tournament names and their urls
+def findAllTournaments():
+  homePage=fetchPage(HOME_URL).decode('utf-8', errors='replace')
+  tournaments=[]
+  for url in TOURNAMENT_LINK_PATTERN.findall(homePage):
+    title=parsedTitle(url.replace('.html', ''))
+    tournaments.append({'title': title, 'url': url})
+  if(not tournaments and USE_BROWSER_FALLBACK):
+    return findAllTournamentsWithBrowser()
+  return tournaments
+
+# Finds current tournaments by loading the tennisabstract.com home page in a headless browser
+# Returns array of tournament names and their urls
+def findAllTournamentsWithBrowser():
+  from selenium import webdriver
+  from selenium.webdriver.chrome.service import Service as ChromeService
+  from selenium.webdriver.common.by import By
+  from webdriver_manager.chrome import ChromeDriverManager
   tournaments=[]
   options=webdriver.ChromeOptions()
   options.add_argument("--headless")
   driver=webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
-  URL="https://www.tennisabstract.com/"
-  driver.get(URL)
+  driver.get(HOME_URL)
   allTournaments=driver.find_elements(By.LINK_TEXT, "Results and Forecasts")
   for tournament in allTournaments:
     url=tournament.get_attribute("href").removeprefix("http://www.tennisabstract.com/current/")
@@ -310,49 +593,269 @@ def parsedTitle(title):
   return ' '.join(words)
 
 # Gets head to head record between two players in a match
+# Matches of player 1 are kept in the local match store, so only recent matches are downloaded once career matches are stored
 # Parameter player: name of player 1 in match (parsed for url search)
 # Parameter opponent: name of player 2 in match
-# Parmeter opponentParsed: name of player 2 but parsed for url search
+# Parmeter opponentParsed: name of player 2 but parsed for url search (not needed since h2h is found in match store)
 # Returns head to head record from perspective of player 1 and if the match is ATP (men's) or WTA (women's)
 def getH2H(player, opponent, opponentParsed):
-  wins=0
-  losses=0
-  # Get h2h record if match between men players
-  url=f"https://www.tennisabstract.com/cgi-bin/player.cgi?p={player}&f=ACareerqq&q={opponentParsed}"
-  matchArrayString=findRelevantData(url, "var matchmx", "var fourspaces", 14, 4)
-  tour="ATP" # men's tennis
-  if(matchArrayString):
-    matchArray=json.loads(matchArrayString)
+  urls=[ATP_PLAYER_URL.format(player=player)]
+  careerLoaded=matchStore.isCareerLoaded(player)
+  if(not careerLoaded):
+    urls.append(ATP_CAREER_URL.format(player=player))
+  pages=fetchPages(urls)
+  recentMatchArrayString=findMatchArrayString(findHeadScript(pages[0]))
+  if(recentMatchArrayString):
+    # Get h2h record if match between men players
+    tour="ATP" # men's tennis
+    updateMenMatches(player, recentMatchArrayString, None if careerLoaded else pages[1])
   else:
     # Get h2h record if match between women players
-    url1=f"https://www.minorleaguesplits.com/tennisabstract/cgi-bin/jsmatches/{player}.js"
-    url2=f"https://www.minorleaguesplits.com/tennisabstract/cgi-bin/jsmatches/{player}Career.js"
-    matchArray=findWomenMatches(url1, url2)
     tour="WTA" # women's tour
-  for match in matchArray:
-    if(match[11]==opponent): # match[11] stores opponent in match
-      if(match[9]!="W/O" and match[9]!=""): # withdraws and matches that hasn't happened do not count towards H2H
-        if(match[4]=="W"): # match[4] stores result of match (either "W" or "L")
-          wins+=1
-        else: # match[4]=="L"
-          losses+=1
-  return ({"wins": wins, "losses": losses}, tour)
-
-# Get current rank of player
+    urls=[WTA_RECENT_MATCHES_URL.format(player=player)]
+    if(not careerLoaded):
+      urls.append(WTA_CAREER_MATCHES_URL.format(player=player))
+    pages=fetchPages(urls)
+    updateWomenMatches(player, pages[0], None if careerLoaded else pages[1])
+  return (matchStore.getH2H(player, opponent), tour)
+
+# Stores matches of an ATP player in the local match store, career matches are only stored the first time
+# Parameter player: name of player (parsed for url search)
+# Parameter recentMatchArrayString: string of array of recent matches from the player page
+# Parameter careerPage: raw bytes of career page of player if career matches are not stored yet, None otherwise
+# Returns void
+@timed("matchStore")
+def updateMenMatches(player, recentMatchArrayString, careerPage):
+  if(careerPage!=None):
+    careerMatchArrayString=findMatchArrayString(findHeadScript(careerPage))
+    if(careerMatchArrayString):
+      matchStore.storeCareerMatches(player, "ATP", json.loads(careerMatchArrayString))
+  matchStore.storeRecentMatches(player, "ATP", recentMatchArrayString)
+
+# Stores matches of a WTA player in the local match store, career matches are only stored the first time
+# Parameter player: name of player (parsed for url search)
+# Parameter recentPage: raw bytes of file that contains recent matches of player
+# Parameter careerPage: raw bytes of file that contains older matches of player if they are not stored yet, None otherwise
+# Returns void
+@timed("matchStore")
+def updateWomenMatches(player, recentPage, careerPage):
+  if(careerPage!=None):
+    matchStore.storeCareerMatches(player, "WTA", json.loads(findWomenOlderMatches(careerPage)))
+  matchStore.storeRecentMatches(player, "WTA", findWomenRecentMatches(recentPage))
+
+# Finds the string of the match array in the relevant data of an ATP player page
+# Parameter dataContent: last script tag in head of player page, None if page has no data
+# Returns string of match array or '' if page has no matches
+def findMatchArrayString(dataContent):
+  if(dataContent==None or "var matchmx" not in dataContent):
+    return ''
+  return getContentUsingStartAndEndString(dataContent, "var matchmx", "var fourspaces", 14, 4)
+
+# Gets current rank and tour of a player and stores matches of player in the local match store
+# Pages are downloaded one after another so many players can be loaded at the same time from a thread pool
+# The rank and tour of a ranked player come from the rankings index, so WTA players skip the ATP player page and WTA player page
+# Parameter player: name of player (parsed for url search)
+# Returns dictionary of current rank of player and if player is ATP (men's) or WTA (women's)
+def loadPlayerProfile(player):
+  ranking=getRanking(player)
+  careerLoaded=matchStore.isCareerLoaded(player)
+  if(ranking==None or ranking["tourType"]=="ATP"):
+    playerPage=fetchPage(ATP_PLAYER_URL.format(player=player))
+    recentMatchArrayString=findMatchArrayString(findHeadScript(playerPage))
+    if(recentMatchArrayString):
+      careerPage=None if careerLoaded else fetchPage(ATP_CAREER_URL.format(player=player))
+      updateMenMatches(player, recentMatchArrayString, careerPage)
+      return {"rank": getIndexedRank(ranking, playerPage), "tourType": "ATP"}
+  recentPage=fetchPage(WTA_RECENT_MATCHES_URL.format(player=player))
+  careerPage=None if careerLoaded else fetchPage(WTA_CAREER_MATCHES_URL.format(player=player))
+  updateWomenMatches(player, recentPage, careerPage)
+  playerPage=None if ranking!=None else fetchPage(WTA_PLAYER_URL.format(player=player))
+  return {"rank": getIndexedRank(ranking, playerPage), "tourType": "WTA"}
+
+# Modifies player name in the same way as the frontend, used for url searches to get player/match data
+# Parameter playerName: name of player in tournament bracket, may have seed in front
+# Parameter joinString: string used to modify player name ('' for url searches, ' ' for opponent names in matches)
+# Returns modified player name
+def parsePlayerName(playerName, joinString):
+  nameArray=playerName.split(' ')
+  if(len(nameArray)>=1 and '(' in nameArray[0] and ')' in nameArray[0]):
+    nameArray.pop(0)
+  return joinString.join(nameArray)
+
+# Gets the key of a player in the rankings index, the same for the name in a draw and the name parsed for url search
+# Parameter playerName: name of player (ex. "(1) Jannik Sinner" or "JannikSinner")
+# Returns key string
+def getRankingKey(playerName):
+  return normalizePlayerName(playerName).replace(' ', '')
+
+# Finds every ranked player in a rankings table of tennisabstract.com
+# Parameter page: raw bytes of rankings page
+# Returns list of tuples of player (parsed for url search), name, and rank
+@timed("parse")
+def parseRankingsPage(page):
+  rankings=[]
+  for (rank, player, name) in RANKING_ROW_PATTERN.findall(decodePage(page)):
+    name=html.unescape(re.sub(r'<[^>]+>', '', name)).replace('\xa0', ' ').strip()
+    rankings.append((unquote(player), name, int(rank)))
+  return rankings
+
+# Downloads the ATP and WTA rankings tables, one page for each tour, and stores them in the match store
+# Returns dictionary of tour to amount of ranked players stored
+def updateRankings():
+  pages=fetchPages(list(RANKINGS_URLS.values()))
+  rankingsByTour={tour: parseRankingsPage(page) for (tour, page) in zip(RANKINGS_URLS, pages)}
+  for (tour, rankings) in rankingsByTour.items():
+    if(not rankings): # page changed or could not be downloaded, stored rankings are kept
+      raise ValueError(f"No {tour} rankings found on {RANKINGS_URLS[tour]}")
+  for (tour, rankings) in rankingsByTour.items():
+    matchStore.storeRankings(tour, rankings)
+  with rankingsIndexLock:
+    rankingsIndex["players"]=None # next lookup in this process loads the index again from the stored rankings
+  return {tour: len(rankings) for (tour, rankings) in rankingsByTour.items()}
+
+# Creates the rankings index from stored rankings
+# Parameter rows: list of tuples of tour, player, name, and rank from the match store
+# Returns dictionary from player (parsed for url search) and ranking keys of player to dictionary of rank and tour
+def createRankingsIndex(rows):
+  players={}
+  for (tour, player, name, rank) in rows:
+    ranking={"rank": rank, "tourType": tour}
+    players[player]=ranking
+    players.setdefault(getRankingKey(player), ranking)
+    players.setdefault(getRankingKey(name), ranking)
+  return players
+
+# Gets the rankings index, a stale index is used while it is loaded again in the background
+# Rankings are never downloaded here, players are looked up on their pages while no rankings are stored (see getRanking)
+# Returns dictionary from createRankingsIndex function
+def getRankingsIndex():
+  with rankingsIndexLock:
+    players=rankingsIndex["players"]
+    stale=time.time()-rankingsIndex["loadedAt"]>=RANKINGS_RELOAD_INTERVAL
+    startRefresh=players!=None and stale and not rankingsIndex["refreshing"]
+    if(startRefresh):
+      rankingsIndex["refreshing"]=True
+  if(players==None): # nothing loaded yet so the first requests wait for the match store to be read
+    return rankingsFlights.do("rankings", loadRankingsIndex)
+  if(startRefresh):
+    threading.Thread(target=loadRankingsIndex, daemon=True).start()
+  return players
+
+# Loads the rankings index from the rankings stored in the match store, the index is empty if none are stored yet
+# Rankings are downloaded by the prefetch_tournaments command (see updateRankings), never while a request waits
+# Returns dictionary from createRankingsIndex function
+def loadRankingsIndex():
+  try:
+    (rows, updatedAt)=matchStore.getRankings()
+    players=createRankingsIndex(rows)
+    with rankingsIndexLock:
+      rankingsIndex["players"]=players
+      rankingsIndex["loadedAt"]=time.time()
+    return players
+  finally:
+    with rankingsIndexLock:
+      rankingsIndex["refreshing"]=False
+
+# Gets the current rank and tour of a player from the rankings index, without downloading player pages
+# Parameter player: name of player (parsed for url search or as shown in a draw)
+# Returns dictionary of current rank and if player is ATP (men's) or WTA (women's), or None if player is not in the rankings
+# (or no rankings are stored yet), in which case callers look the player up on their player page
+def getRanking(player):
+  players=getRankingsIndex()
+  return players.get(player) or players.get(getRankingKey(player))
+
+# Gets the rank of a player from the rankings index, or from the player page if the player is not in the rankings
+# Parameter ranking: dictionary from getRanking function, None if player is not in the rankings
+# Parameter page: raw bytes of player page, only read if parameter ranking is None
+# Returns current rank of player, -1 if unranked
+def getIndexedRank(ranking, page):
+  if(ranking!=None):
+    return ranking["rank"]
+  return parseRank(findRankData(findHeadScript(page)))
+
+# Get current rank of player, player pages are only downloaded if the player is not in the rankings index
 # Paremeter player: name of player (parsed for url search)
 # Returns current rank of player
 def getPlayerRank(player):
+  ranking=getRanking(player)
+  if(ranking!=None):
+    return ranking["rank"]
   # Get current rank if player from ATP (men's)
-  url=f"https://www.tennisabstract.com/cgi-bin/player.cgi?p={player}"
+  url=ATP_PLAYER_URL.format(player=player)
   playerRankData=findRelevantData(url, "var currentrank", "var peakrank", 18, 2)
   if(playerRankData==''):
      # Get current rank if player from WTA (women's)
-    url=f"https://www.tennisabstract.com/cgi-bin/wplayer-classic.cgi?p={player}"
+    url=WTA_PLAYER_URL.format(player=player)
     playerRankData=findRelevantData(url, "var currentrank", "var peakrank", 18, 2)
+  return parseRank(playerRankData)
+
+# Converts rank data found on a player page into a rank
+# Parameter playerRankData: string with value of "var currentrank" on player page
+# Returns current rank of player, -1 if unranked
+def parseRank(playerRankData):
   if(playerRankData=='"UNR"'): # unranked
     playerRankData=-1
   return int(playerRankData)
 
+# Finds current rank of player in the relevant data of a player page
+# Parameter dataContent: last script tag in head of player page, None if page has no data
+# Returns string with value of "var currentrank" or '' if page has no data
+def findRankData(dataContent):
+  if(dataContent==None):
+    return ''
+  return getContentUsingStartAndEndString(dataContent, "var currentrank", "var peakrank", 18, 2)
+
+# Gets head to head record and current ranks of both players in a match
+# Every page is downloaded at most once, pages of both players are downloaded at the same time,
+# and the tour is detected from the first page so WTA matches skip other ATP pages
+# Ranks of ranked players come from the rankings index, so their player pages are only downloaded if their matches are needed
+# Parameter player: name of player 1 in match (parsed for url search)
+# Parameter opponent: name of player 2 in match
+# Parmeter opponentParsed: name of player 2 but parsed for url search
+# Returns dictionary of head to head record from perspective of player 1, ranks of both players, and if the match is ATP (men's) or WTA (women's)
+def getPlayerProfiles(player, opponent, opponentParsed):
+  playerRanking=getRanking(player)
+  opponentRanking=getRanking(opponentParsed)
+  careerLoaded=matchStore.isCareerLoaded(player)
+  if(playerRanking==None or playerRanking["tourType"]=="ATP"):
+    # ATP player page has both the current rank and the recent matches of a player
+    urls=getProfileUrls(player, opponentParsed, opponentRanking, careerLoaded, ATP_PLAYER_URL, ATP_PLAYER_URL, ATP_CAREER_URL)
+    pages=dict(zip(urls, fetchPages(urls)))
+    playerPage=pages[ATP_PLAYER_URL.format(player=player)]
+    recentMatchArrayString=findMatchArrayString(findHeadScript(playerPage))
+    if(recentMatchArrayString):
+      updateMenMatches(player, recentMatchArrayString, None if careerLoaded else pages[ATP_CAREER_URL.format(player=player)])
+      opponentPage=pages.get(ATP_PLAYER_URL.format(player=opponentParsed))
+      if(opponentRanking==None and findRankData(findHeadScript(opponentPage))==''): # opponent is not on ATP player pages
+        opponentPage=fetchPage(WTA_PLAYER_URL.format(player=opponentParsed))
+      return {"h2hData": matchStore.getH2H(player, opponent), "playerRank": getIndexedRank(playerRanking, playerPage), "opponentRank": getIndexedRank(opponentRanking, opponentPage), "tourType": "ATP"}
+  # women's tour
+  urls=getProfileUrls(player, opponentParsed, opponentRanking, careerLoaded, WTA_RECENT_MATCHES_URL, WTA_PLAYER_URL, WTA_CAREER_MATCHES_URL)
+  if(playerRanking==None):
+    urls.append(WTA_PLAYER_URL.format(player=player))
+  pages=dict(zip(urls, fetchPages(urls)))
+  updateWomenMatches(player, pages[WTA_RECENT_MATCHES_URL.format(player=player)], None if careerLoaded else pages[WTA_CAREER_MATCHES_URL.format(player=player)])
+  playerRank=getIndexedRank(playerRanking, pages.get(WTA_PLAYER_URL.format(player=player)))
+  opponentRank=getIndexedRank(opponentRanking, pages.get(WTA_PLAYER_URL.format(player=opponentParsed)))
+  return {"h2hData": matchStore.getH2H(player, opponent), "playerRank": playerRank, "opponentRank": opponentRank, "tourType": "WTA"}
+
+# Gets the URLs of the pages needed for the profiles of both players in a match on one tour
+# Parameter player: name of player 1 in match (parsed for url search)
+# Parameter opponentParsed: name of player 2 (parsed for url search)
+# Parameter opponentRanking: dictionary from getRanking function for player 2, None if player 2 is not in the rankings
+# Parameter careerLoaded: boolean that tells if the career matches of player 1 are already stored
+# Parameter recentUrl: URL format of page with the recent matches of player 1
+# Parameter opponentUrl: URL format of player page of player 2, only needed for the rank of player 2
+# Parameter careerUrl: URL format of page with the career matches of player 1
+# Returns list of URLs
+def getProfileUrls(player, opponentParsed, opponentRanking, careerLoaded, recentUrl, opponentUrl, careerUrl):
+  urls=[recentUrl.format(player=player)]
+  if(opponentRanking==None):
+    urls.append(opponentUrl.format(player=opponentParsed))
+  if(not careerLoaded):
+    urls.append(careerUrl.format(player=player))
+  return urls
+
 # Get a specific part of parameter content given a starting and ending string
 # Parameter content: string that will be divided based on specificed starting and ending strings
 # Parameter startParseString: string that designates start of desired string in parameter content
@@ -372,10 +875,9 @@ def getContentUsingStartAndEndString(content, startParseString, endParseString,
 # Parmeter addToStartIndex: number that is used to fine-tune desired string, usually to remove parameter startParseString from page content
 # Parmeter subtractToEndIndex: number that is used to fine-tune desired string, usually to remove parameter endParseString from page content
 def findRelevantData(url, startParseString, endParseString, addToStartIndex, subtractToEndIndex):
-  pageContent=getPage(url)
-  if(pageContent.head==None):
+  dataContent=findHeadScript(fetchPage(url)) # last script tag in head has relevant data needed
+  if(dataContent==None):
     return ''
-  dataContent=str(pageContent.head.find_all('script')[-1].contents[0]) # last script tag in head has relevant data needed
   return getContentUsingStartAndEndString(dataContent, startParseString, endParseString, addToStartIndex, subtractToEndIndex)
 
 # Finds all WTA matches for a WTA player, eventually used for finding h2h record in function getH2H
@@ -383,11 +885,28 @@ def findRelevantData(url, startParseString, endParseString, addToStartIndex, sub
 # Parameter url2: url that contains older matches of player
 # Returns array of all matches for WTA player
 def findWomenMatches(url1, url2):
-  pageContent1=getPage(url1)
-  pageContent2=getPage(url2)
-  recentMatches=getContentUsingStartAndEndString(str(pageContent1), "var matchmx", "]];", 14, 1)
-  olderMatches=getContentUsingStartAndEndString(str(pageContent2), "var morematchmx", ";", 18, 0)
-  recentMatchesArray=json.loads(recentMatches)
-  olderMatchesArray=json.loads(olderMatches)
+  (page1, page2)=fetchPages([url1, url2]) # both files are downloaded at the same time
+  return parseWomenMatches(page1, page2)
+
+# Gets all WTA matches for a WTA player from the downloaded match files
+# Parameter page1: raw bytes of file that contains recent matches of player
+# Parameter page2: raw bytes of file that contains older matches of player
+# Returns array of all matches for WTA player
+@timed("parse")
+def parseWomenMatches(page1, page2):
+  recentMatchesArray=json.loads(findWomenRecentMatches(page1))
+  olderMatchesArray=json.loads(findWomenOlderMatches(page2))
   allMatches=olderMatchesArray+recentMatchesArray
-  return allMatches
\ No newline at end of file
+  return allMatches
+
+# Finds the string of the array of recent matches of a WTA player
+# Parameter page: raw bytes of file that contains recent matches of player
+# Returns string of match array
+def findWomenRecentMatches(page):
+  return getContentUsingStartAndEndString(decodePage(page), "var matchmx", "]];", 14, 1)
+
+# Finds the string of the array of older matches of a WTA player
+# Parameter page: raw bytes of file that contains older matches of player
+# Returns string of match array
+def findWomenOlderMatches(page):
+  return getContentUsingStartAndEndString(decodePage(page), "var morematchmx", ";", 18, 0)
@@ -0,0 +1,194 @@
+import asyncio
+import weakref
+import httpx
+from tennis_cache import LEASE_POLL_INTERVAL, pageCache
+from tennis_extract import findHeadScript
+from tennis_fetch import BACKOFF_FACTOR, CONNECT_TIMEOUT, HEADERS, POOL_SIZE, READ_TIMEOUT, RETRIES, RETRY_STATUSES, countUpstream, isDownloadedSince
+from tennis_metrics import METRICS_ENABLED, count, timed
+from tennis_matches import matchStore
+from tennis_scraper import (ATP_CAREER_URL, ATP_PLAYER_URL, WTA_CAREER_MATCHES_URL, WTA_PLAYER_URL, WTA_RECENT_MATCHES_URL,
+  findMatchArrayString, findRankData, getContentUsingStartAndEndString, getIndexedRank, getProfileUrls, getRanking, parseBracketPage,
+  parseRank, parseWomenMatches, updateMenMatches, updateWomenMatches)
+from tennis_singleflight import AsyncSingleFlight
+
+# asyncio variants of the functions in tennis_scraper.py that download pages, used by the async views
+# Parsing is shared with tennis_scraper.py, only downloading and waiting for pages is different
+
+clients=weakref.WeakKeyDictionary() # one pooled client per event loop, a client cannot be shared between event loops
+pageFlights=AsyncSingleFlight() # requests downloading the same page wait for one download
+bracketFlights=AsyncSingleFlight() # requests for the same tournament wait for one download and parse of its page
+
+# Gets the pooled HTTP client of the running event loop, creating it on first use
+# Returns httpx AsyncClient object
+def getClient():
+  loop=asyncio.get_running_loop()
+  client=clients.get(loop)
+  if(client==None):
+    limits=httpx.Limits(max_connections=POOL_SIZE*2, max_keepalive_connections=POOL_SIZE)
+    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    client=httpx.AsyncClient(headers=HEADERS, limits=limits, timeout=timeout, follow_redirects=True)
+    clients[loop]=client
+  return client
+
+# Sends a GET request and retries with backoff on connection errors and retryable statuses, like the sessions in tennis_fetch.py
+# Parameter url: URL of page to download
+# Parameter headers: extra request headers
+# Returns httpx Response object
+async def requestPage(url, headers):
+  attempt=0
+  while(True):
+    try:
+      page=await getClient().get(url, headers=headers)
+      if(METRICS_ENABLED):
+        countUpstream(page)
+      if(page.status_code not in RETRY_STATUSES or attempt>=RETRIES):
+        return page
+    except httpx.TransportError:
+      if(attempt>=RETRIES):
+        raise
+    await asyncio.sleep(BACKOFF_FACTOR*(2**attempt))
+    attempt+=1
+
+# Downloads the page at the URL, using the same page cache as fetchPage in tennis_fetch.py
+# Requests asking for a page that is already being downloaded wait for that download instead of sending another request
+# Parameter url: URL of page to download
+# Returns raw bytes of the page
+@timed("fetch")
+async def fetchPage(url):
+  return await pageFlights.do(url, downloadPage, url)
+
+# Downloads the page at the URL, called by one request at a time for each URL (see fetchPage)
+# Parameter url: URL of page to download
+# Returns raw bytes of the page
+async def downloadPage(url):
+  if(pageCache==None):
+    return (await requestPage(url, {})).content
+  cachedPage=await asyncio.to_thread(pageCache.lookup, url)
+  if(cachedPage!=None and cachedPage.fresh):
+    pageCache.count("hits")
+    count("cacheHits")
+    return cachedPage.content
+  owner=await asyncio.to_thread(pageCache.acquireLease, url)
+  if(owner==None): # another process is downloading the page
+    while(owner==None):
+      await asyncio.sleep(LEASE_POLL_INTERVAL)
+      owner=await asyncio.to_thread(pageCache.acquireLease, url)
+    latestPage=await asyncio.to_thread(pageCache.lookup, url)
+    if(isDownloadedSince(latestPage, cachedPage)):
+      await asyncio.to_thread(pageCache.releaseLease, url, owner)
+      count("coalesced")
+      return latestPage.content
+  try:
+    headers={}
+    if(cachedPage!=None):
+      if(cachedPage.etag):
+        headers['If-None-Match']=cachedPage.etag
+      if(cachedPage.lastModified):
+        headers['If-Modified-Since']=cachedPage.lastModified
+    page=await requestPage(url, headers)
+    if(page.status_code==304 and cachedPage!=None): # page has not changed since it was cached
+      pageCache.count("revalidated")
+      await asyncio.to_thread(pageCache.refresh, url)
+      return cachedPage.content
+    pageCache.count("misses")
+    count("cacheMisses")
+    if(page.status_code==200):
+      await asyncio.to_thread(pageCache.store, url, page.content, page.headers.get('ETag'), page.headers.get('Last-Modified'))
+    return page.content
+  finally:
+    await asyncio.to_thread(pageCache.releaseLease, url, owner)
+
+# Downloads several pages concurrently
+# Parameter urls: list of URLs of pages to download
+# Returns list of raw bytes of the pages, in the same order as parameter urls
+async def fetchPages(urls):
+  return list(await asyncio.gather(*[fetchPage(url) for url in urls]))
+
+# Finds relevent match/bracket data, see findRelevantData in tennis_scraper.py
+# Returns string that is desired or '' if page has no data
+async def findRelevantData(url, startParseString, endParseString, addToStartIndex, subtractToEndIndex):
+  dataContent=findHeadScript(await fetchPage(url)) # last script tag in head has relevant data needed
+  if(dataContent==None):
+    return ''
+  return getContentUsingStartAndEndString(dataContent, startParseString, endParseString, addToStartIndex, subtractToEndIndex)
+
+# Finds all WTA matches for a WTA player, both files are downloaded at the same time
+# Parameter url1: url that contains recent matches of player
+# Parameter url2: url that contains older matches of player
+# Returns array of all matches for WTA player
+async def findWomenMatches(url1, url2):
+  (page1, page2)=await fetchPages([url1, url2])
+  return await asyncio.to_thread(parseWomenMatches, page1, page2)
+
+# Get players and match results of the tournament at the URL, parsing runs in a thread so the event loop is not blocked
+# Requests for a tournament that is already being downloaded and parsed share its result
+# Returns tuple of tournament title, list of players and ids for players, and list of match results, or None if page has no bracket
+async def getBracketInfo(url):
+  return await bracketFlights.do(url, parseBracketInfo, url)
+
+# Downloads and parses the tournament page at the URL, called by one request at a time for each URL (see getBracketInfo)
+# Returns tuple of tournament title, list of players and ids for players, and list of match results, or None if page has no bracket
+async def parseBracketInfo(url):
+  page=await fetchPage(url)
+  return await asyncio.to_thread(parseBracketPage, page, url)
+
+# Get current rank of player, player pages are only downloaded if the player is not in the rankings index
+# Paremeter player: name of player (parsed for url search)
+# Returns current rank of player
+async def getPlayerRank(player):
+  ranking=await asyncio.to_thread(getRanking, player)
+  if(ranking!=None):
+    return ranking["rank"]
+  playerRankData=await findRelevantData(ATP_PLAYER_URL.format(player=player), "var currentrank", "var peakrank", 18, 2)
+  if(playerRankData==''):
+    playerRankData=await findRelevantData(WTA_PLAYER_URL.format(player=player), "var currentrank", "var peakrank", 18, 2)
+  return parseRank(playerRankData)
+
+# Gets head to head record between two players in a match, see getH2H in tennis_scraper.py
+# Returns head to head record from perspective of player 1 and if the match is ATP (men's) or WTA (women's)
+async def getH2H(player, opponent, opponentParsed):
+  careerLoaded=await asyncio.to_thread(matchStore.isCareerLoaded, player)
+  urls=[ATP_PLAYER_URL.format(player=player)]
+  if(not careerLoaded):
+    urls.append(ATP_CAREER_URL.format(player=player))
+  pages=await fetchPages(urls)
+  recentMatchArrayString=findMatchArrayString(findHeadScript(pages[0]))
+  if(recentMatchArrayString):
+    tour="ATP" # men's tennis
+    await asyncio.to_thread(updateMenMatches, player, recentMatchArrayString, None if careerLoaded else pages[1])
+  else:
+    tour="WTA" # women's tour
+    urls=[WTA_RECENT_MATCHES_URL.format(player=player)]
+    if(not careerLoaded):
+      urls.append(WTA_CAREER_MATCHES_URL.format(player=player))
+    pages=await fetchPages(urls)
+    await asyncio.to_thread(updateWomenMatches, player, pages[0], None if careerLoaded else pages[1])
+  return (await asyncio.to_thread(matchStore.getH2H, player, opponent), tour)
+
+# Gets head to head record and current ranks of both players in a match, see getPlayerProfiles in tennis_scraper.py
+# Returns dictionary of head to head record from perspective of player 1, ranks of both players, and if the match is ATP (men's) or WTA (women's)
+async def getPlayerProfiles(player, opponent, opponentParsed):
+  (playerRanking, opponentRanking)=await asyncio.to_thread(lambda: (getRanking(player), getRanking(opponentParsed)))
+  careerLoaded=await asyncio.to_thread(matchStore.isCareerLoaded, player)
+  if(playerRanking==None or playerRanking["tourType"]=="ATP"):
+    urls=getProfileUrls(player, opponentParsed, opponentRanking, careerLoaded, ATP_PLAYER_URL, ATP_PLAYER_URL, ATP_CAREER_URL)
+    pages=dict(zip(urls, await fetchPages(urls)))
+    playerPage=pages[ATP_PLAYER_URL.format(player=player)]
+    recentMatchArrayString=findMatchArrayString(findHeadScript(playerPage))
+    if(recentMatchArrayString):
+      await asyncio.to_thread(updateMenMatches, player, recentMatchArrayString, None if careerLoaded else pages[ATP_CAREER_URL.format(player=player)])
+      opponentPage=pages.get(ATP_PLAYER_URL.format(player=opponentParsed))
+      if(opponentRanking==None and findRankData(findHeadScript(opponentPage))==''): # opponent is not on ATP player pages
+        opponentPage=await fetchPage(WTA_PLAYER_URL.format(player=opponentParsed))
+      h2hData=await asyncio.to_thread(matchStore.getH2H, player, opponent)
+      return {"h2hData": h2hData, "playerRank": getIndexedRank(playerRanking, playerPage), "opponentRank": getIndexedRank(opponentRanking, opponentPage), "tourType": "ATP"}
+  # women's tour
+  urls=getProfileUrls(player, opponentParsed, opponentRanking, careerLoaded, WTA_RECENT_MATCHES_URL, WTA_PLAYER_URL, WTA_CAREER_MATCHES_URL)
+  if(playerRanking==None):
+    urls.append(WTA_PLAYER_URL.format(player=player))
+  pages=dict(zip(urls, await fetchPages(urls)))
+  await asyncio.to_thread(updateWomenMatches, player, pages[WTA_RECENT_MATCHES_URL.format(player=player)], None if careerLoaded else pages[WTA_CAREER_MATCHES_URL.format(player=player)])
+  playerRank=getIndexedRank(playerRanking, pages.get(WTA_PLAYER_URL.format(player=player)))
+  opponentRank=getIndexedRank(opponentRanking, pages.get(WTA_PLAYER_URL.format(player=opponentParsed)))
+  h2hData=await asyncio.to_thread(matchStore.getH2H, player, opponent)
+  return {"h2hData": h2hData, "playerRank": playerRank, "opponentRank": opponentRank, "tourType": "WTA"}
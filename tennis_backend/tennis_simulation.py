@@ -0,0 +1,165 @@
+import threading
+import time
+import numpy as np
+from tennis_fetch import CONFIG
+from tennis_matchups import getDrawH2H
+from tennis_metrics import timed
+from tennis_ratings import getDrawRatings
+from tennis_scraper import getRanking, parsePlayerName
+
+SIMULATIONS=CONFIG.getint("Simulation", "Simulations", fallback=100000) # default amount of simulated completions of a draw
+MAX_SIMULATIONS=CONFIG.getint("Simulation", "Max_Simulations", fallback=1000000)
+RANK_EXPONENT=0.8 # how much a better rank increases win probability, rank 10 beats rank 20 about 64% of the time
+UNKNOWN_RANK=250 # rank used for unranked players and qualifiers whose rank is not known
+H2H_PRIOR_MATCHES=10 # weight of rank based win probability, counted as this many matches against the head to head record
+SIMULATION_BATCH_SIZE=25000 # simulations sampled at once so memory use does not grow with the amount of simulations
+SIMULATION_TTL=CONFIG.getint("Simulation", "Simulation_TTL", fallback=60*60) # seconds before stored ranks and ratings of a draw are read again
+
+# simulation results of each tournament, kept with the version of the stored tournament they were simulated from
+simulationCache={}
+simulationCacheLock=threading.Lock()
+
+# Gets a cached simulation of a tournament if it was simulated from the same version of the stored tournament
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter stateVersion: version of the stored tournament from getBracketStateVersion function
+# Parameter simulations: amount of simulated completions of the draw
+# Returns dictionary of tournament title and probabilities of players, or None if it is not cached
+def getCachedSimulation(tournament, stateVersion, simulations):
+  with simulationCacheLock:
+    cachedSimulation=simulationCache.get(tournament)
+  if(cachedSimulation!=None and cachedSimulation["version"]==stateVersion and cachedSimulation["simulations"]==simulations and \
+      time.time()-cachedSimulation["updatedAt"]<SIMULATION_TTL):
+    return cachedSimulation["data"]
+  return None
+
+# Gets the probability of every player in a tournament reaching each round, from simulated completions of the draw
+# Only stored data is read: the tournament stored by the prefetch_tournaments command, the stored rankings, head to head records
+# of the match store, and Elo ratings stored by the update_ratings command, so no page is downloaded while the client waits
+# Results are cached until the stored tournament changes, or for SIMULATION_TTL seconds so new ranks and ratings are used
+# Parameter tournament: name of tournament page on tennisabstract.com
+# Parameter stateVersion: version of the stored tournament from getBracketStateVersion function
+# Parameter bracketData: tuple of tournament title, list of players, and list of match results from getTournamentSnapshot function
+# Parameter simulations: amount of simulated completions of the draw
+# Returns dictionary of tournament title and probabilities of players
+def getTournamentSimulation(tournament, stateVersion, bracketData, simulations=SIMULATIONS):
+  data=getCachedSimulation(tournament, stateVersion, simulations)
+  if(data!=None):
+    return data
+  (title, roster, results)=bracketData
+  (surface, ratings)=getDrawRatings(roster)
+  probabilities=getWinProbabilities(roster, getDrawRanks(roster), getDrawH2H(roster), ratings)
+  roundProbabilities=simulateTournament(roster, results, probabilities, simulations)
+  players=[]
+  for (position, player) in enumerate(roster):
+    if(player!=None):
+      players.append({"playerId": player['playerId'], "playerName": player['playerName'], "roundProbabilities": roundProbabilities[position].tolist()})
+  data={"title": title, "surface": surface, "simulations": simulations, "players": players}
+  with simulationCacheLock:
+    simulationCache[tournament]={"version": stateVersion, "simulations": simulations, "data": data, "updatedAt": time.time()}
+  return data
+
+# Gets current ranks of the players in a draw from the rankings stored by the prefetch_tournaments command
+# Parameter roster: list of players in the tournament
+# Returns list of player ids with current ranks, rank is None if the player is not in the stored rankings
+def getDrawRanks(roster):
+  ranks=[]
+  for player in roster:
+    if(player!=None):
+      ranking=getRanking(parsePlayerName(player['playerName'], ''))
+      ranks.append({"playerId": player['playerId'], "rank": None if ranking==None else ranking["rank"]})
+  return ranks
+
+# Creates the probability of each player winning a match against each other player
+# Elo ratings are used for players that both have one, otherwise ranks blended with head to head records
+# Parameter roster: list of players in the tournament, None for an empty spot (bye)
+# Parameter ranks: list of player ids with current ranks from getDrawRanks function
+# Parameter h2h: list of head to head records from getDrawH2H function
+# Parameter ratings: array of Elo rating of player in each draw position (NaN if no rating) from getDrawRatings function, or None
+# Returns matrix where [i, j] is probability of the player in draw position i beating the player in draw position j,
+# the last row and column are an empty spot that loses every match
+def getWinProbabilities(roster, ranks, h2h, ratings=None):
+  drawSize=len(roster)
+  rankById={rank["playerId"]: rank["rank"] for rank in ranks}
+  positions={}
+  strengths=np.ones(drawSize+1)
+  for (position, player) in enumerate(roster):
+    if(player==None):
+      continue
+    positions[player['playerId']]=position
+    rank=rankById.get(player['playerId'])
+    if(rank==None or rank<1): # unranked or rank not found
+      rank=UNKNOWN_RANK
+    strengths[position]=rank**-RANK_EXPONENT
+  probabilities=strengths[:, None]/(strengths[:, None]+strengths[None, :])
+  bothRated=np.zeros((drawSize+1, drawSize+1), dtype=bool)
+  if(ratings is not None): # array of ratings cannot be compared with ==
+    rated=np.append(~np.isnan(ratings), False)
+    eloRatings=np.append(np.nan_to_num(ratings), 0)
+    bothRated=rated[:, None]&rated[None, :]
+    eloProbabilities=1/(1+10**((eloRatings[None, :]-eloRatings[:, None])/400))
+    probabilities=np.where(bothRated, eloProbabilities, probabilities)
+  for record in h2h:
+    if(record["id1"] not in positions or record["id2"] not in positions):
+      continue
+    (position1, position2)=(positions[record["id1"]], positions[record["id2"]])
+    if(bothRated[position1, position2]): # head to head matches are already counted in Elo ratings
+      continue
+    matches=record["wins"]+record["losses"]
+    probability=(probabilities[position1, position2]*H2H_PRIOR_MATCHES+record["wins"])/(H2H_PRIOR_MATCHES+matches)
+    probabilities[position1, position2]=probability
+    probabilities[position2, position1]=1-probability
+  probabilities[:, drawSize]=1 # every player beats an empty spot
+  probabilities[drawSize, :]=0
+  return probabilities.astype(np.float32)
+
+# Finds the winners of completed matches by round, so simulations keep every result that already happened
+# Parameter roster: list of players in the tournament
+# Parameter results: list of completed match results
+# Parameter roundCount: amount of rounds in the draw
+# Returns list for each round of arrays with draw position of winner of each match, -1 if match has not been played
+def getCompletedWinners(roster, results, roundCount):
+  drawSize=len(roster)
+  positions={player['playerId']: position for (position, player) in enumerate(roster) if player!=None}
+  completedWinners=[np.full(drawSize>>roundNumber, -1, dtype=np.int32) for roundNumber in range(1, roundCount+1)]
+  for match in results:
+    roundNumber=match["roundNumber"]
+    winnerId=match["id1"] if "result" in match["opponent1"] else match["id2"]
+    if(winnerId not in positions or not 1<=roundNumber<=roundCount):
+      continue
+    winner=positions[winnerId]
+    completedWinners[roundNumber-1][winner>>roundNumber]=winner # players of match k of a round come from positions k*2^round to (k+1)*2^round-1
+  return completedWinners
+
+# Simulates completions of a draw round by round, every match of a round is sampled at once for every simulation
+# Parameter roster: list of players in the tournament, None for an empty spot (bye)
+# Parameter results: list of completed match results
+# Parameter probabilities: matrix of win probabilities from getWinProbabilities function
+# Parameter simulations: amount of simulated completions of the draw
+# Parameter seed: seed of random number generator, None for a random seed
+# Returns array where [i, r] is probability of player in draw position i reaching round r+1, the last column is winning the tournament
+@timed("simulation")
+def simulateTournament(roster, results, probabilities, simulations, seed=None):
+  drawSize=len(roster)
+  roundCount=(drawSize-1).bit_length()
+  if(drawSize!=1<<roundCount):
+    raise ValueError(f"Draw size {drawSize} is not a power of two")
+  completedWinners=getCompletedWinners(roster, results, roundCount)
+  entrants=np.array([drawSize if player==None else position for (position, player) in enumerate(roster)], dtype=np.int16)
+  reached=np.zeros((roundCount+1, drawSize+1), dtype=np.int64)
+  reached[0]=np.bincount(entrants, minlength=drawSize+1)*simulations
+  generator=np.random.default_rng(seed)
+  for batchStart in range(0, simulations, SIMULATION_BATCH_SIZE):
+    batchSize=min(SIMULATION_BATCH_SIZE, simulations-batchStart)
+    slots=np.broadcast_to(entrants, (batchSize, drawSize))
+    for (roundIndex, winners) in enumerate(completedWinners):
+      player1=slots[:, 0::2]
+      player2=slots[:, 1::2]
+      played=winners>=0
+      if(played.all()): # no need to sample a round that is over
+        slots=np.broadcast_to(winners.astype(np.int16), player1.shape)
+      else:
+        player1Won=generator.random(player1.shape, dtype=np.float32)<probabilities[player1, player2]
+        slots=np.where(player1Won, player1, player2)
+        slots[:, played]=winners[played]
+      reached[roundIndex+1]+=np.bincount(slots.ravel(), minlength=drawSize+1)
+  return (reached[:, :drawSize]/simulations).T
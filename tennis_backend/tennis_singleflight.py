@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import weakref
+from tennis_metrics import count
+
+# Single-flight coalescing: callers asking for the same key while it is in progress wait for the first caller and share its result
+# This only coalesces callers in one process, downloads are coalesced across processes with the leases of the page cache (tennis_cache.py)
+
+# represents a call in progress that other threads wait on
+class Flight:
+  def __init__(self):
+    self.done=threading.Event()
+    self.result=None
+    self.error=None
+
+  # Waits for the call to finish
+  # Returns result of call, the exception of the call is raised again if it failed
+  def wait(self):
+    self.done.wait()
+    if(self.error!=None):
+      raise self.error
+    return self.result
+
+# coalesces calls made by threads
+class SingleFlight:
+  def __init__(self):
+    self.flights={}
+    self.lock=threading.Lock()
+
+  # Calls a function unless a call with the same key is in progress, in which case its result is waited for
+  # Parameter key: key of call (ex. URL of page)
+  # Parameter function: function called by the first caller
+  # Parameter args: arguments of function
+  # Returns result of function
+  def do(self, key, function, *args):
+    with self.lock:
+      flight=self.flights.get(key)
+      leader=flight==None
+      if(leader):
+        flight=Flight()
+        self.flights[key]=flight
+    if(not leader):
+      count("coalesced")
+      return flight.wait()
+    try:
+      flight.result=function(*args)
+      return flight.result
+    except BaseException as error:
+      flight.error=error
+      raise
+    finally:
+      with self.lock:
+        del self.flights[key]
+      flight.done.set()
+
+# coalesces calls made by coroutines, each event loop has its own calls in progress since a task cannot be awaited from another loop
+class AsyncSingleFlight:
+  def __init__(self):
+    self.flights=weakref.WeakKeyDictionary() # event loop to dictionary of key to task
+
+  # Awaits a coroutine function unless a call with the same key is in progress, in which case its result is awaited
+  # Parameter key: key of call (ex. URL of page)
+  # Parameter function: coroutine function called by the first caller
+  # Parameter args: arguments of function
+  # Returns result of function
+  async def do(self, key, function, *args):
+    flights=self.flights.setdefault(asyncio.get_running_loop(), {})
+    task=flights.get(key)
+    if(task==None):
+      task=asyncio.ensure_future(function(*args))
+      flights[key]=task
+      task.add_done_callback(lambda _: flights.pop(key) if flights.get(key) is task else None)
+    else:
+      count("coalesced")
+    # shield so a cancelled caller (ex. client disconnected) does not cancel the call for the other callers
+    return await asyncio.shield(task)
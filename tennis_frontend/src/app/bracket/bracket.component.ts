@@ -17,6 +17,8 @@ import { MatOptionModule } from "@angular/material/core";
 import { FormsModule } from "@angular/forms";
 import { HeaderComponent } from "../header/header.component";
 
+const MAX_QUEUED_ATTEMPTS=30; // attempts while the backend scrapes a tournament that is not stored yet
+
 @Component({
     standalone: true,
     selector: 'bracket',
@@ -76,22 +78,36 @@ export class BracketComponent implements OnInit {
   
   /**
    * Gets bracket data based on specified tournament name from backend using axios
+   * A tournament that is not stored yet is answered with 202 while the backend scrapes it, so it is asked for again after Retry-After seconds
    * @returns Promise<BackendData | null>: Returns bracket data (or null if no data) from backend
    */
   async getBracketData(): Promise<BackendData | null> {
     let bracketData=null;
-    await axios.get('http://localhost:8000/bracket', {
-      params: {
-        tournament: this.tournament,
-        type: this.type
-      }
-    }).then((response) => {
-      bracketData=response.data;
-    })
-    .catch(() => {
+    let queued=true;
+    for(let attempt=0; queued && attempt<MAX_QUEUED_ATTEMPTS; attempt++) {
+      queued=false;
+      await axios.get('http://localhost:8000/bracket', {
+        params: {
+          tournament: this.tournament,
+          type: this.type
+        }
+      }).then(async (response) => {
+        if(response.status==202) {
+          queued=true;
+          await new Promise((resolve) => setTimeout(resolve, Number(response.headers['retry-after'] ?? 2)*1000));
+          return;
+        }
+        bracketData=response.data;
+      })
+      .catch(() => {
+        this.dialog.open(ErrorDialog);
+        this.navigateToChooseTournaments();
+      });
+    }
+    if(queued) {
       this.dialog.open(ErrorDialog);
       this.navigateToChooseTournaments();
-    });
+    }
     return bracketData;
   }
 